@@ -1,24 +1,136 @@
+from derex.runner import __version__
 from derex.runner.docker import build_image
+from derex.runner.docker import client as docker_client
 from derex.runner.docker import docker_has_experimental
+from derex.runner.docker import get_image_id
+from derex.runner.docker import image_exists
 from derex.runner.project import Project
+from derex.runner.telemetry import BUILDS_DIR
+from derex.runner.telemetry import BuildTelemetry
+from derex.runner.telemetry import recording_build
+from derex.runner.utils import abspath_from_egg
+from derex.runner.wheelhouse import fill_wheelhouse
+from derex.runner.wheelhouse import uses_shared_wheelhouse
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
 
+import docker
+import hashlib
+import json
 import logging
 import os
 
 
 logger = logging.getLogger(__name__)
+COMPILED_THEMES = ("open-edx",)
+#: Label storing what an image was built from, besides the files its tag depends on
+BUILD_INPUTS_LABEL = "io.derex.build-inputs"
+BYTECODE_STATS_PATH = "/openedx/bytecode_stats.json"
+# Build stage installing requirements from the shared wheelhouse, and the python
+# user base it installs them to
+WHEELS_STAGE = "derex-wheels"
+WHEELS_USER_BASE = "/openedx/derex.install"
+#: Directories written by the assets compilation, copied when compiled assets are reused
+COMPILED_ASSETS_DIRS = (
+    "/openedx/staticfiles",
+    "/openedx/edx-platform/common/static",
+    "/openedx/edx-platform/lms/static",
+    "/openedx/edx-platform/cms/static",
+)
+# Run with the python of the requirements image (possibly python 2) to print
+# a hash of all static files shipped by installed packages
+ASSETS_FINGERPRINT_SCRIPT = """
+import hashlib, os, site, sys
+roots = [el for el in sys.path if el.endswith("-packages")]
+roots += ["/openedx/derex.requirements"] + getattr(site, "getsitepackages", list)()
+result = hashlib.sha256()
+for root in sorted(set(roots)):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        parts = dirpath.split(os.sep)
+        if "static" not in parts and "public" not in parts:
+            continue
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            result.update(path.encode("utf-8"))
+            with open(path, "rb") as fh:
+                result.update(hashlib.sha256(fh.read()).digest())
+print(result.hexdigest())
+"""
 
 
-def docker_commands_to_install_requirements(project: Project):
+def get_build_inputs(images: List[str], **settings) -> Optional[str]:
+    """Return a hash of what an image is built from besides the files its tag
+    depends on: the derex version (that determines the Dockerfile), the IDs of
+    the given base images and the given settings.
+    Return None if one of the base images is not present locally.
+    """
+    image_ids = [get_image_id(image) for image in images]
+    if None in image_ids:
+        return None
+    return hashlib.sha256(
+        json.dumps([__version__, image_ids, settings], sort_keys=True).encode()
+    ).hexdigest()
+
+
+def get_build_labels(inputs: Optional[str]) -> Dict[str, str]:
+    """Return the labels to build an image with the given inputs with.
+    An image built while its base images were missing is not labelled:
+    the next build will run again, using the docker cache.
+    """
+    return {BUILD_INPUTS_LABEL: inputs} if inputs is not None else {}
+
+
+def get_requirements_build_inputs(project: Project) -> Optional[str]:
+    return get_build_inputs(
+        [project.base_image], shared_wheelhouse=uses_shared_wheelhouse(project)
+    )
+
+
+def get_assets_build_inputs(project: Project) -> Optional[str]:
+    return get_build_inputs([project.base_image], themes=COMPILED_THEMES)
+
+
+def get_themes_build_inputs(project: Project) -> Optional[str]:
+    # The static files come from the requirements or assets images,
+    # so the themes image also depends on their base image
+    return get_build_inputs(
+        [project.base_image, project.final_base_image],
+        shared_wheelhouse=uses_shared_wheelhouse(project),
+        compile_assets=project.assets_image_name is not None,
+    )
+
+
+def docker_commands_to_copy_requirements() -> str:
+    return (
+        "RUN pip install pip==20.0.2\n"
+        # Constrain edx version, but omit the relative paths: we run this from our
+        # requirements dir so that the derex user can use `./` in their requirements files
+        "RUN grep == /openedx/edx-platform/requirements/edx/base.txt |grep -v ^git+https > /tmp/base.txt\n"
+        "COPY requirements /openedx/derex.requirements/\n"
+    )
+
+
+def docker_commands_to_install_requirements(
+    project: Project, wheels_dir: Optional[Path] = None
+):
+    """Return the Dockerfile lines that install the project requirements.
+    If `wheels_dir` is given the packages are copied from the stage returned
+    by `docker_stage_to_install_wheels`, that must come before them in the Dockerfile.
+    """
     dockerfile_contents = []
     if project.requirements_dir:
-        dockerfile_contents.append(
-            f"RUN pip install pip==20.0.2\n"
-            # Constrain edx version, but omit the relative paths: we run this from our
-            # requirements dir so that the derex user can use `./` in their requirements files
-            f"RUN grep == /openedx/edx-platform/requirements/edx/base.txt |grep -v ^git+https > /tmp/base.txt\n"
-            f"COPY requirements /openedx/derex.requirements/\n"
-        )
+        dockerfile_contents.append(docker_commands_to_copy_requirements())
+        if wheels_dir is not None:
+            dockerfile_contents.append(
+                f"COPY --from={WHEELS_STAGE} {WHEELS_USER_BASE} {WHEELS_USER_BASE}\n"
+                f"ENV PYTHONUSERBASE={WHEELS_USER_BASE}\n"
+                # Make the console scripts of the requirements runnable by name
+                f"ENV PATH={WHEELS_USER_BASE}/bin:${{PATH}}\n"
+            )
+            return dockerfile_contents
         for requirments_file in os.listdir(project.requirements_dir):
             if requirments_file.endswith(".txt"):
                 dockerfile_contents.append(
@@ -27,15 +139,139 @@ def docker_commands_to_install_requirements(project: Project):
     return dockerfile_contents
 
 
+def docker_stage_to_install_wheels(
+    project: Project, base_image: str, wheels_dir: Optional[Path]
+) -> List[str]:
+    """Return the Dockerfile lines of a stage that installs the project requirements
+    using the wheels in `wheels_dir` (part of the build context), or no lines
+    if `wheels_dir` is None.
+    Packages are installed in a separate python user base, that the final stage
+    copies: this way the wheels are not shipped in the image.
+    """
+    if wheels_dir is None or project.requirements_dir is None:
+        return []
+    dockerfile_contents = [
+        f"FROM {base_image} as {WHEELS_STAGE}",
+        docker_commands_to_copy_requirements(),
+        f"COPY {wheels_dir.name} /tmp/derex.wheels/\n"
+        f"ENV PYTHONUSERBASE={WHEELS_USER_BASE}\n",
+    ]
+    for requirments_file in os.listdir(project.requirements_dir):
+        if requirments_file.endswith(".txt"):
+            dockerfile_contents.append(
+                f"RUN cd /openedx/derex.requirements && pip install --user --find-links /tmp/derex.wheels -c /tmp/base.txt -r {requirments_file}\n"
+            )
+    return dockerfile_contents
+
+
+def prepare_wheels(project: Project, paths_to_copy: List[str]) -> Optional[Path]:
+    """If the project uses the shared wheelhouse collect the wheels it needs,
+    add them to the paths to copy in the build context and return their directory.
+    """
+    if not uses_shared_wheelhouse(project):
+        return None
+    wheels_dir = fill_wheelhouse(project)
+    paths_to_copy.append(str(wheels_dir))
+    return wheels_dir
+
+
 def build_requirements_image(project: Project):
     """Build the docker image the includes project requirements for the given project.
-    The requirements are installed in a container based on the dev image, and assets
-    are compiled there.
+    The requirements are installed in a container based on the dev image.
     """
     if project.requirements_dir is None:
         return
-    dockerfile_contents = [f"FROM {project.base_image}"]
-    dockerfile_contents.extend(docker_commands_to_install_requirements(project))
+    paths_to_copy = [str(project.requirements_dir)]
+    wheels_dir = prepare_wheels(project, paths_to_copy)
+    dockerfile_contents = docker_stage_to_install_wheels(
+        project, project.base_image, wheels_dir
+    )
+    dockerfile_contents.append(f"FROM {project.base_image}")
+    dockerfile_contents.extend(
+        docker_commands_to_install_requirements(project, wheels_dir)
+    )
+    dockerfile_text = "\n".join(dockerfile_contents)
+    with recording_build(
+        project.private_filepath(BUILDS_DIR),
+        "requirements",
+        project.requirements_image_name,
+    ) as telemetry:
+        build_image(
+            dockerfile_text,
+            paths_to_copy,
+            tag=project.requirements_image_name,
+            extra_opts=dict(
+                labels=get_build_labels(get_requirements_build_inputs(project))
+            ),
+            telemetry=telemetry,
+        )
+
+
+def get_compiled_assets_image_name(project: Project) -> str:
+    """Return a name for the image with the compiled assets for the given project
+    that only depends on the files that can influence the compiled assets:
+    the static files shipped by the installed packages, the base image
+    and the list of compiled themes. A change to python code alone
+    will not change it.
+    The requirements image must be present in the docker daemon.
+    """
+    output = docker_client.containers.run(
+        project.requirements_image_name,
+        ["python", "-c", ASSETS_FINGERPRINT_SCRIPT],
+        remove=True,
+    )
+    # Also hash what the image build inputs label depends on, so that reused
+    # images are labelled with the current inputs
+    base_image = get_image_id(project.base_image) or project.base_image
+    fingerprint = hashlib.sha256(
+        "\n".join(
+            (
+                output.decode().strip(),
+                base_image,
+                ",".join(COMPILED_THEMES),
+                __version__,
+            )
+        ).encode()
+    ).hexdigest()
+    return f"{project.image_prefix}-assets:{fingerprint[:6]}"
+
+
+def tag_image(image: str, name: str):
+    repository, _, tag = name.rpartition(":")
+    docker_client.api.tag(image, repository, tag)
+
+
+def build_assets_image(project: Project):
+    """Build the docker image with the compiled static assets for the given project.
+    The image is also tagged with a name derived from the files the assets are
+    compiled from: if an image with that name is already present (for instance
+    because only python code changed in the requirements) its compiled assets
+    are copied on top of the requirements image instead of compiling them again.
+    """
+    if project.assets_image_name is None:
+        return
+    labels = get_build_labels(get_assets_build_inputs(project))
+    compiled_image_name = get_compiled_assets_image_name(project)
+    if image_exists(compiled_image_name):
+        logger.info(f"Reusing the assets compiled in {compiled_image_name}")
+        dockerfile_text = "\n".join(
+            [f"FROM {project.requirements_image_name}"]
+            + [
+                f"COPY --from={compiled_image_name} {directory} {directory}"
+                for directory in COMPILED_ASSETS_DIRS
+            ]
+        )
+        with recording_build(
+            project.private_filepath(BUILDS_DIR), "assets", project.assets_image_name
+        ) as telemetry:
+            build_image(
+                dockerfile_text,
+                [],
+                tag=project.assets_image_name,
+                extra_opts=dict(labels=labels),
+                telemetry=telemetry,
+            )
+        return
     compile_command = ("; \\\n").join(
         (
             # Remove files from the previous image
@@ -52,15 +288,60 @@ def build_requirements_image(project: Project):
             "unset SERVICE_VARIANT",
             # XXX we only compile the `open-edx` theme. We could make this configurable per-project
             # but probably most people are only interested in their own theme
-            "paver update_assets --settings derex.assets --themes open-edx",
+            f"paver update_assets --settings derex.assets --themes {' '.join(COMPILED_THEMES)}",
             'rmlint -c sh:symlink -o sh:rmlint.sh /openedx/staticfiles > /dev/null 2> /dev/null && sed "/# empty /d" -i rmlint.sh && ./rmlint.sh -d > /dev/null',
         )
     )
-    if project.config.get("compile_assets", False):
-        dockerfile_contents.append(f"RUN sh -c '{compile_command}'")
-    dockerfile_text = "\n".join(dockerfile_contents)
-    paths_to_copy = [str(project.requirements_dir)]
-    build_image(dockerfile_text, paths_to_copy, tag=project.requirements_image_name)
+    dockerfile_text = "\n".join(
+        (f"FROM {project.requirements_image_name}", f"RUN sh -c '{compile_command}'")
+    )
+    with recording_build(
+        project.private_filepath(BUILDS_DIR), "assets", project.assets_image_name
+    ) as telemetry:
+        build_image(
+            dockerfile_text,
+            [],
+            tag=project.assets_image_name,
+            extra_opts=dict(labels=labels),
+            telemetry=telemetry,
+        )
+    tag_image(project.assets_image_name, compiled_image_name)
+
+
+def record_bytecode_stats(image: str, telemetry: BuildTelemetry):
+    """Read the startup times measured when compiling bytecode in the given image,
+    log them and store them in the build telemetry.
+    """
+    try:
+        output = docker_client.containers.run(
+            image, ["cat", BYTECODE_STATS_PATH], remove=True
+        )
+    except docker.errors.ContainerError:
+        logger.warning(f"Could not find bytecode compilation stats in {image}")
+        return
+    stats = json.loads(output)
+    for name, value in stats.items():
+        telemetry.record_metric(name, value)
+    # See precompile_python.py: python < 3.8 can't ignore the base image bytecode
+    if "cold_start_no_bytecode" in stats:
+        before = f"{stats['cold_start_no_bytecode']:.2f}s without bytecode"
+    else:
+        before = f"{stats['cold_start_base_bytecode']:.2f}s with the base image bytecode only"
+    logger.info(
+        f"Cold start time: {before}, {stats['cold_start_after']:.2f}s with all bytecode compiled"
+    )
+
+
+def docker_command_to_precompile_mako(*args: str) -> str:
+    """Return the Dockerfile line that compiles Mako templates for both
+    lms and cms, passing the given arguments to `precompile_mako.py`.
+    """
+    options = "".join(f" {arg}" for arg in args)
+    return (
+        "RUN cd /openedx/edx-platform && for variant in lms cms; do "
+        "SERVICE_VARIANT=${variant} DJANGO_SETTINGS_MODULE=${variant}.envs.derex.assets "
+        f"python /usr/local/bin/precompile_mako.py /openedx/mako_modules/${{variant}}{options}; done"
+    )
 
 
 def build_themes_image(project: Project):
@@ -69,24 +350,46 @@ def build_themes_image(project: Project):
     """
     if project.themes_dir is None:
         return
+    # Requirements are installed first: their layers only depend on the
+    # requirements directory, so the docker cache can reuse them when only themes change
     dockerfile_contents = [
-        f"FROM {project.requirements_image_name} as static",
-        f"FROM {project.final_base_image}",
-        "COPY --from=static /openedx/staticfiles /openedx/staticfiles",
-        "COPY themes/ /openedx/themes/",
-        "COPY --from=static /openedx/edx-platform/common/static /openedx/edx-platform/common/static",
-        "COPY --from=static /openedx/empty_dump.sql.bz2 /openedx/",
+        f"FROM {project.assets_image_name or project.requirements_image_name} as static",
     ]
-    if docker_has_experimental():
-        # When experimental is enabled we have the `squash` option: we can remove duplicates
-        # so they won't end up in our layer.
-        dockerfile_contents.append(
-            'RUN rmlint -g -c sh:symlink -o sh:rmlint.sh /openedx/ > /dev/null 2> /dev/null && sed "/# empty /d" -i rmlint.sh && ./rmlint.sh -d > /dev/null'
-        )
     paths_to_copy = [str(project.themes_dir)]
+    wheels_dir = None
     if project.requirements_dir is not None:
-        dockerfile_contents.extend(docker_commands_to_install_requirements(project))
         paths_to_copy.append(str(project.requirements_dir))
+        wheels_dir = prepare_wheels(project, paths_to_copy)
+    dockerfile_contents.extend(
+        docker_stage_to_install_wheels(project, project.final_base_image, wheels_dir)
+    )
+    dockerfile_contents.append(f"FROM {project.final_base_image}")
+    dockerfile_contents.extend(
+        docker_commands_to_install_requirements(project, wheels_dir)
+    )
+    # Compile Mako templates and python files to bytecode, so that new containers
+    # and gunicorn workers don't need to. Everything but the themes is compiled
+    # before they're copied, so that a change to the themes only recompiles them.
+    # The python script also measures the effect on startup time.
+    for script in ("precompile_mako.py", "precompile_python.py"):
+        paths_to_copy.append(
+            str(abspath_from_egg("derex.runner", f"docker-definition/{script}"))
+        )
+    dockerfile_contents.append(
+        "COPY precompile_mako.py precompile_python.py /usr/local/bin/"
+    )
+    dockerfile_contents.append(docker_command_to_precompile_mako())
+    dockerfile_contents.append(
+        f"RUN cd /openedx/edx-platform && python /usr/local/bin/precompile_python.py {BYTECODE_STATS_PATH}"
+    )
+    dockerfile_contents.extend(
+        [
+            "COPY --from=static /openedx/staticfiles /openedx/staticfiles",
+            "COPY --from=static /openedx/edx-platform/common/static /openedx/edx-platform/common/static",
+            "COPY --from=static /openedx/empty_dump.sql* /openedx/",
+            "COPY themes/ /openedx/themes/",
+        ]
+    )
     cmd = []
     if project.themes_dir is not None:
         for dir in project.themes_dir.iterdir():
@@ -100,26 +403,38 @@ def build_themes_image(project: Project):
                     )
     if cmd:
         dockerfile_contents.append(f"RUN sh -c '{';'.join(cmd)}'")
+    dockerfile_contents.append(docker_command_to_precompile_mako("--themes-only"))
+    dockerfile_contents.append(
+        "RUN python /usr/local/bin/precompile_python.py --only /openedx/themes"
+    )
+    if docker_has_experimental():
+        # When experimental is enabled we have the `squash` option: we can remove duplicates
+        # so they won't end up in our layer.
+        dockerfile_contents.append(
+            'RUN rmlint -g -c sh:symlink -o sh:rmlint.sh /openedx/ > /dev/null 2> /dev/null && sed "/# empty /d" -i rmlint.sh && ./rmlint.sh -d > /dev/null'
+        )
 
     dockerfile_text = "\n".join(dockerfile_contents)
+    # When experimental is enabled we have the `squash` option
+    extra_opts: Dict = dict(labels=get_build_labels(get_themes_build_inputs(project)))
     if docker_has_experimental():
+        extra_opts["squash"] = True
+    with recording_build(
+        project.private_filepath(BUILDS_DIR), "themes", project.themes_image_name
+    ) as telemetry:
         build_image(
             dockerfile_text,
             paths_to_copy,
             tag=project.themes_image_name,
             tag_final=True,
-            extra_opts=dict(squash=True),
-        )
-    else:
-        build_image(
-            dockerfile_text,
-            paths_to_copy,
-            tag=project.themes_image_name,
-            tag_final=True,
+            extra_opts=extra_opts,
+            telemetry=telemetry,
         )
+        record_bytecode_stats(project.themes_image_name, telemetry)
+    if not extra_opts.get("squash"):
         logger.warning(
             "To build a smaller image enable the --experimental flag in the docker server"
         )
 
 
-__all__ = ["build_requirements_image", "build_themes_image"]
+__all__ = ["build_assets_image", "build_requirements_image", "build_themes_image"]
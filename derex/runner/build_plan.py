@@ -0,0 +1,198 @@
+"""Plan and execute the builds of the images of a project.
+
+The images are modeled as stages of a graph: each stage has a content addressed
+tag and depends on other stages. Stages whose tag is already present
+in the local docker daemon are skipped, unless the image was built from
+other base images or by another derex version, stages whose tag can be found
+in the registry are pulled, and the others are built after their dependencies.
+Pulls don't need any other stage, and run while earlier stages are built;
+stages that don't depend on each other are built concurrently.
+"""
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from derex.runner.build import build_assets_image
+from derex.runner.build import BUILD_INPUTS_LABEL
+from derex.runner.build import build_requirements_image
+from derex.runner.build import build_themes_image
+from derex.runner.build import get_assets_build_inputs
+from derex.runner.build import get_requirements_build_inputs
+from derex.runner.build import get_themes_build_inputs
+from derex.runner.docker import get_image_labels
+from derex.runner.docker import get_image_registry
+from derex.runner.docker import image_exists
+from derex.runner.docker import image_in_registry
+from derex.runner.docker import pull_images
+from derex.runner.docker import push_image
+from derex.runner.project import Project
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+SKIP = "skip"
+PULL = "pull"
+BUILD = "build"
+REBUILD = "rebuild"
+#: Not a planned action: pushes are run after builds when requested
+PUSH = "push"
+
+
+class BuildStage(NamedTuple):
+    name: str
+    tag: str
+    build: Callable[[], None]
+    depends_on: Tuple[str, ...] = ()
+    #: Return a hash of what the image is built from besides the files its tag
+    #: depends on, or None if it can't be computed
+    inputs: Callable[[], Optional[str]] = lambda: None
+
+
+class PlannedStage(NamedTuple):
+    stage: BuildStage
+    #: One of SKIP (the image is present locally), PULL, BUILD or
+    #: REBUILD (the image is present but was built from other inputs)
+    action: str
+
+
+def get_build_stages(project: Project) -> Dict[str, BuildStage]:
+    """Return the stages that can be built for the given project,
+    each one after its dependencies.
+    """
+    stages: Dict[str, BuildStage] = {}
+    if project.requirements_dir is not None:
+        stages["requirements"] = BuildStage(
+            "requirements",
+            project.requirements_image_name,
+            lambda: build_requirements_image(project),
+            inputs=lambda: get_requirements_build_inputs(project),
+        )
+        if project.assets_image_name is not None:
+            stages["assets"] = BuildStage(
+                "assets",
+                project.assets_image_name,
+                lambda: build_assets_image(project),
+                ("requirements",),
+                lambda: get_assets_build_inputs(project),
+            )
+    if project.themes_dir is not None:
+        stages["themes"] = BuildStage(
+            "themes",
+            project.themes_image_name,
+            lambda: build_themes_image(project),
+            tuple(name for name in ("requirements", "assets") if name in stages),
+            lambda: get_themes_build_inputs(project),
+        )
+    return stages
+
+
+def plan_build(
+    project: Project,
+    targets: Iterable[str],
+    force: bool = False,
+    pull: Optional[bool] = None,
+) -> List[PlannedStage]:
+    """Return the stages needed to build the given targets, in dependency order.
+    Targets not available for the project (for instance `themes` for a project
+    without a themes directory) are ignored.
+    Unless `force` is True, stages whose tag exists locally will not be built
+    (unless the image is outdated, see `is_outdated`), and stages whose tag
+    exists in the registry will be pulled. The dependencies of a stage are only
+    included if it needs to be built.
+    The registry is only checked if `pull` is True or, when it's None,
+    if the project `image_prefix` points to a registry other than the Docker Hub.
+    """
+    if pull is None:
+        pull = get_image_registry(project.image_prefix) is not None
+    stages = get_build_stages(project)
+    actions: Dict[str, str] = {}
+    to_visit = [target for target in targets if target in stages]
+    while to_visit:
+        name = to_visit.pop()
+        if name not in actions:
+            actions[name] = get_stage_action(stages[name], force, pull)
+            # Dependencies are only needed to build a stage
+            if actions[name] in (BUILD, REBUILD):
+                to_visit.extend(stages[name].depends_on)
+    return [
+        PlannedStage(stage, actions[name])
+        for name, stage in stages.items()
+        if name in actions
+    ]
+
+
+def get_stage_action(stage: BuildStage, force: bool, pull: bool) -> str:
+    if force:
+        return BUILD
+    if image_exists(stage.tag):
+        return REBUILD if is_outdated(stage) else SKIP
+    if pull and image_in_registry(stage.tag):
+        return PULL
+    return BUILD
+
+
+def is_outdated(stage: BuildStage) -> bool:
+    """Return True if the local image of the stage was built from other base
+    images, settings or derex version than the current ones: for instance
+    after newer base images have been pulled.
+    Images are trusted if their inputs can't be computed because the base
+    images are not present locally.
+    """
+    inputs = stage.inputs()
+    if inputs is None:
+        return False
+    return get_image_labels(stage.tag).get(BUILD_INPUTS_LABEL) != inputs
+
+
+def execute_plan(
+    plan: List[PlannedStage], max_workers: Optional[int] = None, push: bool = False
+):
+    """Pull or build the stages of the plan that are not present locally.
+    A stage is built as soon as all its dependencies are available, so
+    independent stages run concurrently. Pulled stages do not need their
+    dependencies, and are pulled right away.
+    If `push` is True built images are pushed to their registry: the stages
+    that depend on them don't wait for the push.
+    """
+    stages = {el.stage.name: el.stage for el in plan}
+    pending = {el.stage.name: el.action for el in plan if el.action != SKIP}
+    done = {el.stage.name for el in plan if el.action == SKIP}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        #: The stage name and the step (PULL, BUILD or PUSH) of each running job
+        running: Dict[Future, Tuple[str, str]] = {}
+        while pending or running:
+            for name, action in list(pending.items()):
+                stage = stages[name]
+                if action == PULL:
+                    logger.info(f"Pulling {name} stage ({stage.tag})")
+                    running[executor.submit(pull_images, [stage.tag])] = (name, PULL)
+                elif all(dependency in done for dependency in stage.depends_on):
+                    logger.info(f"Building {name} stage ({stage.tag})")
+                    running[executor.submit(stage.build)] = (name, BUILD)
+                else:
+                    continue
+                del pending[name]
+            if not running:
+                raise RuntimeError(
+                    f"Unsatisfiable dependencies for stages {', '.join(pending)}"
+                )
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, step = running.pop(future)
+                # Re-raise the exception if the job failed
+                future.result()
+                if step == PUSH:
+                    continue
+                done.add(name)
+                if push and step == BUILD:
+                    logger.info(f"Pushing {name} stage ({stages[name].tag})")
+                    job = executor.submit(push_image, stages[name].tag)
+                    running[job] = (name, PUSH)
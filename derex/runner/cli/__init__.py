@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 """Console script for derex.runner."""
+from .benchmark import benchmark
 from .build import build
+from .images import images
 from .mongodb import mongodb
 from .mysql import mysql
+from .snapshot import snapshot
 from .utils import ensure_project
 from click_plugins import with_plugins
 from derex.runner.logging_utils import setup_logging_decorator
@@ -73,29 +76,77 @@ def reset_mailslurper(project):
 
 
 @derex.command()
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Compile all themes, even the ones that did not change",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Keep running and compile themes as soon as their sass files change",
+)
 @click.pass_obj
 @ensure_project
-def compile_theme(project):
-    """Compile theme sass files"""
+def compile_theme(project, force, watch):
+    """Compile theme sass files.
+    Only themes whose sass files changed since the last compilation are compiled.
+    """
     from derex.runner.compose_utils import run_compose
+    from derex.runner.themes import compile_themes_script
+    from derex.runner.themes import get_sass_cache_path
+    from derex.runner.themes import get_themes_to_compile
+    from derex.runner.themes import save_sass_cache
 
     if project.themes_dir is None:
         click.echo("No theme directory present in this project")
         return
-    themes = ",".join(el.name for el in project.themes_dir.iterdir())
-    uid = os.getuid()
+    themes, hashes = get_themes_to_compile(project, force=force)
+    if watch:
+        from derex.runner.utils import abspath_from_egg
+
+        watch_themes_path = abspath_from_egg(
+            "derex.runner", "derex/runner/watch_themes.py.source"
+        )
+        # The script updates the sass cache after compiling themes
+        args = [
+            "run",
+            "--rm",
+            "-v",
+            f"{watch_themes_path}:/watch_themes.py",
+            "-v",
+            f"{get_sass_cache_path(project)}:/sass_cache.json",
+            "lms",
+            "python",
+            "/watch_themes.py",
+            str(os.getuid()),
+            "/sass_cache.json",
+            project.base_image,
+        ] + themes
+        run_compose(args, project=DebugBaseImageProject(), exit_afterwards=True)
+        return
+    if not themes:
+        click.echo(
+            "Themes are up to date: nothing to compile (use --force to compile anyway)"
+        )
+        return
+    click.echo(f"Compiling themes: {', '.join(themes)}")
     args = [
         "run",
         "--rm",
         "lms",
         "sh",
         "-c",
-        f"""set -ex
-            export PATH=/openedx/edx-platform/node_modules/.bin:$PATH  # FIXME: this should not be necessary
-            paver compile_sass --theme-dirs /openedx/themes --themes {themes}
-            chown {uid}:{uid} /openedx/themes/* -R""",
+        compile_themes_script(themes, os.getuid()),
     ]
-    run_compose(args, project=DebugBaseImageProject(), exit_afterwards=True)
+    try:
+        run_compose(args, project=DebugBaseImageProject())
+    except RuntimeError:
+        click.echo("Theme compilation failed")
+        raise click.exceptions.Exit(1)
+    save_sass_cache(project, hashes)
 
 
 @derex.command()
@@ -261,6 +312,9 @@ def red(string: str) -> str:
 derex.add_command(mysql)
 derex.add_command(mongodb)
 derex.add_command(build)
+derex.add_command(images)
+derex.add_command(benchmark)
+derex.add_command(snapshot)
 
 
 __all__ = ["derex"]
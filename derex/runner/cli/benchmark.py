@@ -0,0 +1,184 @@
+from .utils import ensure_project
+from derex.runner.project import Project
+from derex.runner.project import ProjectRunMode
+from tabulate import tabulate
+from typing import List
+from typing import Optional
+
+import click
+
+
+@click.group()
+def benchmark():
+    """Commands to measure the performance of a project"""
+
+
+def parse_configurations(ctx, param, value):
+    from derex.runner.gunicorn_benchmark import parse_gunicorn_options
+
+    try:
+        return [parse_gunicorn_options(el) for el in value]
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+
+@benchmark.command()
+@click.option(
+    "-c",
+    "--config",
+    "configurations",
+    multiple=True,
+    default=["sync:2", "gthread:2:4", "gevent:2"],
+    show_default=True,
+    callback=parse_configurations,
+    help="Gunicorn configuration to test, as worker_class[:workers[:threads]]",
+)
+@click.option(
+    "-p",
+    "--path",
+    "paths",
+    multiple=True,
+    default=["/heartbeat", "/"],
+    show_default=True,
+    help="LMS path to request",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Number of concurrent clients",
+)
+@click.option(
+    "--duration",
+    type=float,
+    default=30,
+    show_default=True,
+    help="Seconds to send requests for, for every configuration",
+)
+@click.pass_obj
+@ensure_project
+def gunicorn(
+    project: Project,
+    configurations: List,
+    paths: List[str],
+    concurrency: int,
+    duration: float,
+):
+    """Run the LMS with different gunicorn configurations and compare
+    throughput and latency under the same load.
+    The project needs to be in production runmode.
+    """
+    from derex.runner.gunicorn_benchmark import benchmark_gunicorn
+
+    if project.runmode is not ProjectRunMode.production:
+        click.echo("Gunicorn is only used in production runmode")
+        click.echo("Switch to it with\nderex runmode production")
+        raise click.exceptions.Exit(1)
+    try:
+        results = benchmark_gunicorn(
+            project, configurations, paths, concurrency, duration
+        )
+    except RuntimeError as exc:
+        click.echo(str(exc), err=True)
+        raise click.exceptions.Exit(1)
+    click.echo(
+        tabulate(
+            (
+                (
+                    el.options.worker_class,
+                    el.options.workers,
+                    el.options.threads if el.options.worker_class == "gthread" else "",
+                    el.requests,
+                    el.errors,
+                    el.requests_per_second,
+                    el.p50 * 1000,
+                    el.p95 * 1000,
+                    el.p99 * 1000,
+                )
+                for el in results
+            ),
+            headers=[
+                "Worker class",
+                "Workers",
+                "Threads",
+                "Requests",
+                "Errors",
+                "Req/s",
+                "p50 (ms)",
+                "p95 (ms)",
+                "p99 (ms)",
+            ],
+            floatfmt=".1f",
+        )
+    )
+
+
+@benchmark.command()
+@click.option(
+    "--dump",
+    "dump_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help=(
+        "Database dump to use, uncompressed (.sql) or compressed (.zst, .lz4, .bz2). "
+        "Defaults to the one in the project image"
+    ),
+)
+@click.option(
+    "-f",
+    "--format",
+    "formats",
+    multiple=True,
+    type=click.Choice(["zstd", "lz4", "bzip2", "none"]),
+    default=["zstd", "lz4", "bzip2", "none"],
+    show_default=True,
+    help="Compression format to test",
+)
+@click.pass_obj
+def dump(project: Optional[Project], dump_path: Optional[str], formats: List[str]):
+    """Compare the compression formats for the database dump used by
+    `derex mysql reset`: size and time to compress and decompress it.
+    """
+    from derex.runner.dump_benchmark import benchmark_dump_formats
+    from derex.runner.dump_benchmark import extract_dump
+    from derex.runner.utils import human_size
+    from pathlib import Path
+    from tempfile import TemporaryDirectory
+
+    if dump_path is None and not isinstance(project, Project):
+        raise click.BadParameter(
+            "Specify a dump or run this command from a project directory",
+            param_hint="--dump",
+        )
+    with TemporaryDirectory(prefix="derex-dump-") as workdir:
+        try:
+            if dump_path is None:
+                dump_path = str(extract_dump(project.base_image, Path(workdir)))
+            results = benchmark_dump_formats(Path(dump_path), formats, Path(workdir))
+        except (ValueError, RuntimeError) as exc:
+            click.echo(str(exc), err=True)
+            raise click.exceptions.Exit(1)
+    click.echo(
+        tabulate(
+            (
+                (
+                    el.compression,
+                    human_size(el.compressed_size),
+                    el.ratio,
+                    el.compress_seconds,
+                    el.decompress_seconds,
+                    human_size(el.decompress_throughput) + "/s",
+                )
+                for el in results
+            ),
+            headers=[
+                "Format",
+                "Size",
+                "Ratio",
+                "Compress (s)",
+                "Decompress (s)",
+                "Decompress speed",
+            ],
+            floatfmt=".2f",
+        )
+    )
@@ -1,68 +1,139 @@
 from .utils import ensure_project
 from derex.runner import __version__
+from derex.runner.local_appdir import DEREX_DIR
 from derex.runner.project import OpenEdXVersions
 from derex.runner.project import Project
+from derex.runner.telemetry import BUILDS_DIR
 from derex.runner.utils import abspath_from_egg
-from distutils.spawn import find_executable
+from pathlib import Path
+from typing import List
+from typing import Optional
 
 import click
 import os
+import subprocess
 import sys
 
 
+ACTION_DESCRIPTIONS = {
+    "skip": "present, skip",
+    "pull": "pull from registry",
+    "build": "build",
+    "rebuild": "outdated, rebuild",
+}
+
+
 @click.group()
 def build():
     """Commands to build container images"""
 
 
-@build.command()
-@click.pass_obj
-@ensure_project
-def requirements(project):
-    """Build the image that contains python requirements"""
-    from derex.runner.build import build_requirements_image
+def build_options(func):
+    """Add the options shared by the commands that build project images.
+    """
+    func = click.option(
+        "--force",
+        is_flag=True,
+        default=False,
+        help="Build the images even if they are already present",
+    )(func)
+    func = click.option(
+        "--push",
+        is_flag=True,
+        default=False,
+        help="Push the built images to the registry",
+    )(func)
+    func = click.option(
+        "--pull/--no-pull",
+        default=None,
+        help=(
+            "Look for the images in the registry before building them. "
+            "By default only done if the project image prefix includes a registry host"
+        ),
+    )(func)
+    func = click.option(
+        "--plan", is_flag=True, default=False, help="Only print what would be built",
+    )(func)
+    return func
+
 
+def run_build(
+    project: Project,
+    targets: List[str],
+    plan: bool,
+    force: bool,
+    pull: Optional[bool],
+    push: bool,
+):
+    """Build the images needed for the given targets, skipping the ones
+    already present unless `force` is True.
+    """
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import plan_build
+    from tabulate import tabulate
+
+    build_plan = plan_build(project, targets, force=force, pull=pull)
     click.echo(
-        f'Building docker image {project.requirements_image_name} ("{project.name}" requirements)'
+        tabulate(
+            (
+                (el.stage.name, el.stage.tag, ACTION_DESCRIPTIONS[el.action])
+                for el in build_plan
+            ),
+            headers=["Stage", "Image", "Action"],
+        )
     )
-    build_requirements_image(project)
+    if plan:
+        return
+    execute_plan(build_plan, push=push)
+    click.echo(f"Built image {project.image_name}")
 
 
 @build.command()
+@build_options
 @click.pass_obj
-@click.pass_context
 @ensure_project
-def themes(ctx, project: Project):
-    """Build the image that includes compiled themes"""
-    from derex.runner.build import build_themes_image
+def requirements(project, plan: bool, force: bool, pull, push: bool):
+    """Build the image that contains python requirements,
+    and the one with compiled assets if the project compiles them"""
+    run_build(project, ["requirements", "assets"], plan, force, pull, push)
 
-    ctx.forward(requirements)
-    click.echo(
-        f'Building docker image {project.themes_image_name} with "{project.name}" themes'
-    )
-    build_themes_image(project)
-    click.echo(f"Built image {project.themes_image_name}")
+
+@build.command()
+@build_options
+@click.pass_obj
+@ensure_project
+def themes(project: Project, plan: bool, force: bool, pull, push: bool):
+    """Build the image that includes compiled themes"""
+    run_build(project, ["themes"], plan, force, pull, push)
 
 
 @build.command()
+@build_options
 @click.pass_obj
-@click.pass_context
 @ensure_project
-def final(ctx, project: Project):
+def final(project: Project, plan: bool, force: bool, pull, push: bool):
     """Build the final image for this project.
     For now this is the same as the final image"""
-    ctx.forward(themes)
+    run_build(project, ["requirements", "assets", "themes"], plan, force, pull, push)
 
 
 @build.command()
+@build_options
 @click.pass_obj
 @click.pass_context
 @ensure_project
-def final_refresh(ctx, project: Project):
-    """Also pull base docker image before starting building"""
+def final_refresh(ctx, project: Project, plan: bool, force: bool, pull, push: bool):
+    """Also pull base docker image before starting building.
+    Images built on older versions of the base images are rebuilt"""
+    from derex.runner import docker_async
     from derex.runner.docker import pull_images
 
-    pull_images([project.base_image, project.final_base_image])
+    if not plan:
+        images = [project.base_image, project.final_base_image]
+        if docker_async.is_available():
+            docker_async.run(docker_async.pull_images(images))
+        else:
+            pull_images(images)
     ctx.forward(final)
 
 
@@ -100,6 +171,13 @@ def final_refresh(ctx, project: Project):
     default=False,
     help="Only print image name for the given target",
 )
+@click.option(
+    "--dump-compression",
+    type=click.Choice(["zstd", "lz4", "bzip2", "none"]),
+    default="zstd",
+    show_default=True,
+    help="Compression of the database dump included in the dev image",
+)
 @click.option(
     "-d",
     "--docker-opts",
@@ -110,8 +188,19 @@ def final_refresh(ctx, project: Project):
         "By default outputs the image to the local docker daemon."
     ),
 )
-def openedx(version, target, push, only_print_image_name, docker_opts):
+@click.pass_obj
+def openedx(
+    project,
+    version,
+    target,
+    push,
+    only_print_image_name,
+    dump_compression,
+    docker_opts,
+):
     """Build openedx image using docker. Defaults to dev image target."""
+    from derex.runner.telemetry import recording_build
+
     dockerdir = abspath_from_egg("derex.runner", "docker-definition/Dockerfile").parent
     git_repo = version.value["git_repo"]
     git_branch = version.value["git_branch"]
@@ -135,6 +224,8 @@ def openedx(version, target, push, only_print_image_name, docker_opts):
         f"EDX_PLATFORM_VERSION={git_branch}",
         "--build-arg",
         f"EDX_PLATFORM_REPOSITORY={git_repo}",
+        "--build-arg",
+        f"DUMP_COMPRESSION={dump_compression}",
         f"--target={target}",
     ]
     transifex_path = os.path.expanduser("~/.transifexrc")
@@ -142,5 +233,205 @@ def openedx(version, target, push, only_print_image_name, docker_opts):
         command.extend(["--secret", f"id=transifex,src={transifex_path}"])
     if docker_opts:
         command.extend(docker_opts.format(**locals()).split())
+    # Plain progress output can be parsed to collect build telemetry
+    command.append("--progress=plain")
     print("Invoking\n" + " ".join(command), file=sys.stderr)
-    os.execve(find_executable(command[0]), command, os.environ)
+    with recording_build(
+        get_builds_dir(project), f"openedx-{version.name}-{target}", image_name
+    ) as telemetry:
+        process = subprocess.Popen(
+            command, stderr=subprocess.PIPE, universal_newlines=True
+        )
+        for line in process.stderr:
+            sys.stderr.write(line)
+            telemetry.feed_buildkit_line(line)
+        returncode = process.wait()
+        if returncode:
+            raise click.exceptions.Exit(returncode)
+        if not push:
+            from derex.runner.docker import client
+            import docker
+
+            try:
+                telemetry.record_layers(client.api.history(image_name))
+            except docker.errors.APIError:
+                # The image was not exported to the local docker daemon
+                pass
+
+
+@build.command()
+@click.argument("name", required=False)
+@click.option(
+    "--threshold",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Only show steps that got slower by more than this many seconds",
+)
+@click.pass_obj
+def report(project: Optional[Project], name: Optional[str], threshold: float):
+    """Show telemetry of the latest builds and the steps that
+    got slower compared to the previous build with the same name.
+    """
+    from derex.runner.telemetry import cache_hit_ratio
+    from derex.runner.telemetry import compare_reports
+    from derex.runner.telemetry import load_reports
+    from derex.runner.utils import human_size
+    from tabulate import tabulate
+
+    reports = load_reports(get_builds_dir(project), name)
+    if not reports:
+        click.echo("No build reports found")
+        return
+    by_name = {}
+    for build_report in reports:
+        by_name.setdefault(build_report["name"], []).append(build_report)
+    rows = []
+    regressions = []
+    for build_name, build_reports in sorted(by_name.items()):
+        current = build_reports[-1]
+        previous = build_reports[-2] if len(build_reports) > 1 else None
+        delta = ""
+        if previous is not None:
+            delta = f'{current["duration"] - previous["duration"]:+.1f}s'
+            regressions.extend(
+                (
+                    build_name,
+                    el["step"][:60],
+                    el["before"],
+                    el["after"],
+                    el["cache_lost"],
+                )
+                for el in compare_reports(previous, current, min_seconds=threshold)
+            )
+        rows.append(
+            (
+                build_name,
+                current["tag"],
+                "ok" if current["success"] else "failed",
+                f'{current["duration"]:.1f}s',
+                delta,
+                f"{cache_hit_ratio(current):.0%}",
+                human_size(current["context_size"] or 0),
+                f'{current["context_upload_time"] or 0:.1f}s',
+                human_size(sum(layer["size"] for layer in current["layers"])),
+            )
+        )
+    click.echo(
+        tabulate(
+            rows,
+            headers=[
+                "Build",
+                "Tag",
+                "Status",
+                "Duration",
+                "Change",
+                "Cache hits",
+                "Context",
+                "Upload",
+                "Layers",
+            ],
+        )
+    )
+    metrics = [
+        (build_name, metric, value)
+        for build_name, build_reports in sorted(by_name.items())
+        for metric, value in sorted(build_reports[-1].get("metrics", {}).items())
+    ]
+    if metrics:
+        click.echo("\nMeasurements taken during the latest builds:\n")
+        click.echo(
+            tabulate(metrics, headers=["Build", "Measure", "Value"], floatfmt=".2f")
+        )
+    if regressions:
+        click.echo("\nSteps slower than in the previous build:\n")
+        click.echo(
+            tabulate(
+                regressions,
+                headers=["Build", "Step", "Before (s)", "After (s)", "Cache lost"],
+                floatfmt=".1f",
+            )
+        )
+
+
+@build.command()
+@click.argument("image", required=False)
+@click.option(
+    "--top",
+    type=int,
+    default=10,
+    show_default=True,
+    help="How many directories and duplicates to show",
+)
+@click.pass_obj
+def analyze(project: Optional[Project], image: Optional[str], top: int):
+    """Show where the space goes in the layers of an image.
+    Defaults to the image of the current project.
+    """
+    from derex.runner.image_analysis import analyze_image
+    from derex.runner.utils import human_size
+    from tabulate import tabulate
+
+    if image is None:
+        if not isinstance(project, Project):
+            raise click.BadParameter(
+                "Specify an image or run this command from a project directory",
+                param_hint="IMAGE",
+            )
+        image = project.image_name
+    click.echo(f"Reading {image} layers...")
+    analysis = analyze_image(image, top=top)
+    click.echo(
+        tabulate(
+            (
+                (
+                    index,
+                    human_size(layer.size),
+                    len(layer.files),
+                    len(layer.deleted),
+                    layer.created_by[-70:],
+                )
+                for index, layer in enumerate(analysis.layers)
+            ),
+            headers=["Layer", "Size", "Files", "Deletions", "Created by"],
+        )
+    )
+    click.echo("\nLargest directories:\n")
+    click.echo(
+        tabulate(
+            (
+                (directory, human_size(size))
+                for directory, size in analysis.largest_dirs
+            ),
+            headers=["Directory", "Size"],
+        )
+    )
+    if analysis.duplicates:
+        click.echo("\nDuplicate files:\n")
+        click.echo(
+            tabulate(
+                (
+                    (
+                        human_size(el.size),
+                        len(el.paths),
+                        human_size(el.wasted),
+                        "\n".join(el.paths),
+                    )
+                    for el in analysis.duplicates
+                ),
+                headers=["Size", "Copies", "Wasted", "Paths"],
+            )
+        )
+    if analysis.suggestions:
+        click.echo("\nSuggestions:\n")
+        for suggestion in analysis.suggestions:
+            click.echo(f"* {suggestion}")
+
+
+def get_builds_dir(project: Optional[Project]) -> Path:
+    """Return the directory where build reports are stored: inside the project
+    private directory if we're in a project, in the derex data dir otherwise.
+    """
+    if isinstance(project, Project):
+        return project.private_filepath(BUILDS_DIR)
+    return DEREX_DIR / BUILDS_DIR
@@ -0,0 +1,135 @@
+from .utils import ensure_project
+from derex.runner.project import Project
+from derex.runner.utils import human_size
+from tabulate import tabulate
+
+import click
+
+
+@click.group()
+def images():
+    """Commands to manage project docker images"""
+
+
+@images.command()
+@click.option(
+    "-k",
+    "--keep",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Number of most recently used images to keep for each stage",
+)
+@click.option(
+    "--min-age",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Never remove images used less than this many hours ago",
+)
+@click.option(
+    "--dry-run", is_flag=True, default=False, help="Only show what would be removed"
+)
+@click.pass_obj
+@ensure_project
+def gc(project: Project, keep: int, min_age: float, dry_run: bool):
+    """Remove old requirements and themes images of this project.
+    Images used by running containers and the ones the project
+    currently uses are never removed.
+    """
+    from derex.runner.images import gc_project_images
+
+    images, reclaimed = gc_project_images(
+        project, keep=keep, min_age=min_age * 3600, dry_run=dry_run
+    )
+    if not images:
+        click.echo("No images to remove")
+        return
+    click.echo(
+        tabulate(
+            [(image.tag, human_size(image.size)) for image in images],
+            headers=["Would remove" if dry_run else "Removed", "Size"],
+        )
+    )
+    if not dry_run:
+        click.echo(f"\nReclaimed {human_size(reclaimed)}")
+
+
+@images.command()
+@click.argument("image", required=False)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    required=True,
+    help="Path of the compressed archive to write",
+)
+@click.option(
+    "--known-layers",
+    type=click.File("r"),
+    help=(
+        "File listing the layers present on the target host, "
+        "as printed by `derex images layers` there. They will be left out"
+    ),
+)
+@click.pass_obj
+def save(project, image, output, known_layers):
+    """Save an image to a zstd compressed archive, to be loaded on another
+    host with `derex images load`. Defaults to the final image of the current project.
+    """
+    from derex.runner.image_transfer import save_image
+
+    if image is None:
+        if not isinstance(project, Project):
+            raise click.BadParameter(
+                "Specify an image or run this command from a project directory",
+                param_hint="IMAGE",
+            )
+        image = project.image_name
+    layers = set(known_layers.read().split()) if known_layers else None
+    try:
+        stats = save_image(image, output, known_layers=layers)
+    except RuntimeError as exc:
+        click.echo(str(exc), err=True)
+        raise click.exceptions.Exit(1)
+    if stats.skipped_layers:
+        click.echo(
+            f"Left out {stats.skipped_layers} known layers "
+            f"({human_size(stats.skipped_size)})"
+        )
+    click.echo(
+        f"Saved {image} to {output}: {human_size(stats.size)} compressed to "
+        f"{human_size(stats.compressed_size)} in {stats.seconds:.1f}s "
+        f"({human_size(stats.throughput)}/s)"
+    )
+
+
+@images.command()
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+def load(archive):
+    """Load images from an archive created by `derex images save`"""
+    from derex.runner.image_transfer import load_image
+
+    try:
+        stats, messages = load_image(archive)
+    except RuntimeError as exc:
+        click.echo(str(exc), err=True)
+        raise click.exceptions.Exit(1)
+    for message in messages:
+        click.echo(message)
+    click.echo(
+        f"Loaded {human_size(stats.size)} in {stats.seconds:.1f}s "
+        f"({human_size(stats.throughput)}/s)"
+    )
+
+
+@images.command()
+def layers():
+    """Print the layers of all images present in the docker daemon.
+    Pass the output to `derex images save --known-layers` on another host
+    to only include the layers missing here.
+    """
+    from derex.runner.image_transfer import get_local_layers
+
+    for layer in sorted(get_local_layers()):
+        click.echo(layer)
@@ -1,3 +1,4 @@
+from .utils import ensure_project
 from derex.runner.project import DebugBaseImageProject
 from derex.runner.project import Project
 from derex.runner.project import ProjectRunMode
@@ -148,9 +149,20 @@ def show_users_cmd():
 @mysql.command("copy-database")
 @click.argument("source_db_name", type=str, required=True)
 @click.argument("destination_db_name", type=str)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Number of tables to copy at the same time",
+)
 @click.pass_obj
 def copy_database_cmd(
-    project: Optional[Project], source_db_name: str, destination_db_name: Optional[str],
+    project: Optional[Project],
+    source_db_name: str,
+    destination_db_name: Optional[str],
+    workers: int,
 ):
     """
     Copy an existing mysql database. If no destination database is given it defaults
@@ -172,7 +184,17 @@ def copy_database_cmd(
     ):
         from derex.runner.mysql import copy_database
 
-        copy_database(source_db_name, destination_db_name)
+        results = copy_database(source_db_name, destination_db_name, workers=workers)
+        results = sorted(
+            (el for el in results if el.rows), key=lambda el: el.seconds, reverse=True
+        )
+        click.echo(
+            tabulate(
+                ((el.name, el.rows, el.seconds, el.rows_per_second) for el in results),
+                headers=["Table", "Rows", "Seconds", "Rows/s"],
+                floatfmt=".1f",
+            )
+        )
     return 0
 
 
@@ -184,8 +206,17 @@ def copy_database_cmd(
     default=False,
     help="Do not ask for confirmation and allow resetting mysql database if runmode is production",
 )
-def reset_mysql_cmd(context, force):
-    """Reset MySQL database for the current project"""
+@click.option(
+    "--full",
+    is_flag=True,
+    default=False,
+    help="Restore the dump and load the fixtures again instead of using the pristine copy",
+)
+def reset_mysql_cmd(context, force, full):
+    """Reset MySQL database for the current project.
+    The first reset keeps a pristine copy of the database: following ones
+    copy it back, which is much faster than restoring the dump again.
+    """
 
     if context.obj is None:
         click.echo("This command needs to be run inside a derex project")
@@ -208,5 +239,280 @@ def reset_mysql_cmd(context, force):
             f'"{project.name}" default state ?'
         ):
             return 1
-    reset_mysql_openedx(DebugBaseImageProject())
+    reset_mysql_openedx(DebugBaseImageProject(), full=full)
+    return 0
+
+
+@mysql.command(name="load-fixtures")
+@click.pass_obj
+@ensure_project
+def load_fixtures_cmd(project: Project):
+    """Load the project fixtures that changed since they were last loaded"""
+    from derex.runner.mysql import load_fixtures
+
+    if not project.fixtures_dir:
+        click.echo("This project has no fixtures directory")
+        return 1
+    load_fixtures(project)
+    return 0
+
+
+def get_database_name(project: Optional[Project], database: Optional[str]) -> str:
+    if database:
+        return database
+    if isinstance(project, Project):
+        return project.mysql_db_name
+    raise click.exceptions.MissingParameter(
+        param_hint="database",
+        param_type="str",
+        message="Either specify a database name or run in a derex project.",
+    )
+
+
+@mysql.command(name="stats")
+@click.argument("database", type=str, required=False)
+@click.option(
+    "-n",
+    "--limit",
+    type=int,
+    default=20,
+    show_default=True,
+    help="Number of tables to show, biggest first",
+)
+@click.pass_obj
+def stats_cmd(project: Optional[Project], database: Optional[str], limit: int):
+    """Show sizes, row estimates, fragmentation and unused indexes of the
+    tables of a database. Defaults to the project database.
+    """
+    from derex.runner.mysql_stats import get_table_stats
+    from derex.runner.mysql_stats import get_unused_indexes
+    from derex.runner.utils import human_size
+
+    database = get_database_name(project, database)
+    stats = get_table_stats(database)
+    if not stats:
+        click.echo(f'No tables found in database "{database}"')
+        return 1
+    click.echo(
+        tabulate(
+            (
+                (
+                    el.name,
+                    el.rows,
+                    human_size(el.data_size),
+                    human_size(el.index_size),
+                    human_size(el.free_size),
+                    el.fragmentation * 100,
+                )
+                for el in stats[:limit]
+            ),
+            headers=["Table", "Rows (est.)", "Data", "Indexes", "Free", "Frag. %"],
+            floatfmt=".1f",
+        )
+    )
+    click.echo(
+        f"\n{len(stats)} tables: {human_size(sum(el.data_size for el in stats))} data, "
+        f"{human_size(sum(el.index_size for el in stats))} indexes, "
+        f"{human_size(sum(el.free_size for el in stats))} free"
+    )
+    unused = get_unused_indexes(database)
+    if unused is None:
+        click.echo("\nperformance_schema is disabled: index usage is not available")
+    elif unused:
+        click.echo("\nIndexes not used since the mysql server started:")
+        click.echo(tabulate(unused, headers=["Table", "Index"]))
+    return 0
+
+
+@mysql.command(name="optimize")
+@click.argument("database", type=str, required=False)
+@click.option(
+    "--min-free",
+    type=int,
+    default=16,
+    show_default=True,
+    help="Only rebuild tables with at least this many MB of free space",
+)
+@click.option(
+    "--min-fragmentation",
+    type=click.FloatRange(0, 100),
+    default=10,
+    show_default=True,
+    help="Only rebuild tables with at least this percentage of free space",
+)
+@click.option(
+    "-n",
+    "--limit",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Maximum number of tables to rebuild, the ones with most free space first",
+)
+@click.option(
+    "--dry-run", is_flag=True, default=False, help="Only show what would be rebuilt"
+)
+@click.pass_obj
+def optimize_cmd(
+    project: Optional[Project],
+    database: Optional[str],
+    min_free: int,
+    min_fragmentation: float,
+    limit: int,
+    dry_run: bool,
+):
+    """Rebuild the most fragmented InnoDB tables of a database online, to give
+    back their free space. Defaults to the project database.
+    """
+    from derex.runner.mysql_stats import get_table_stats
+    from derex.runner.mysql_stats import get_tables_to_optimize
+    from derex.runner.mysql_stats import optimize_table
+    from derex.runner.utils import human_size
+
+    database = get_database_name(project, database)
+    tables = get_tables_to_optimize(
+        get_table_stats(database),
+        min_free=min_free * 1024 * 1024,
+        min_fragmentation=min_fragmentation / 100,
+        limit=limit,
+    )
+    if not tables:
+        click.echo("No tables need to be rebuilt")
+        return 0
+    if dry_run:
+        click.echo(
+            tabulate(
+                ((el.name, human_size(el.free_size)) for el in tables),
+                headers=["Would rebuild", "Free"],
+            )
+        )
+        return 0
+    results = [optimize_table(database, el.name) for el in tables]
+    click.echo(
+        tabulate(
+            (
+                (el.table, human_size(el.freed), el.seconds, el.error or "")
+                for el in results
+            ),
+            headers=["Table", "Freed", "Seconds", "Error"],
+            floatfmt=".1f",
+        )
+    )
+    return 1 if any(el.error for el in results) else 0
+
+
+@mysql.command(name="slowlog")
+@click.option(
+    "--enable/--disable",
+    default=None,
+    help="Turn the slow query log on or off on the running mysql server",
+)
+@click.option(
+    "--long-query-time",
+    type=float,
+    default=0.1,
+    show_default=True,
+    help="With --enable: log queries taking longer than this many seconds",
+)
+@click.option(
+    "--not-using-indexes",
+    is_flag=True,
+    default=False,
+    help="With --enable: also log queries that read all rows of a table",
+)
+@click.option(
+    "--clear", is_flag=True, default=False, help="Remove all logged queries",
+)
+@click.option(
+    "-d",
+    "--database",
+    type=str,
+    help="Only show queries on this database. Defaults to the project one",
+)
+@click.option(
+    "-s",
+    "--sort",
+    type=click.Choice(["time", "count", "rows"]),
+    default="time",
+    show_default=True,
+    help="Rank queries by total time, count or rows examined",
+)
+@click.option(
+    "-n",
+    "--limit",
+    type=int,
+    default=20,
+    show_default=True,
+    help="Number of queries to show",
+)
+@click.pass_obj
+def slowlog_cmd(
+    project: Optional[Project],
+    enable: Optional[bool],
+    long_query_time: float,
+    not_using_indexes: bool,
+    clear: bool,
+    database: Optional[str],
+    sort: str,
+    limit: int,
+):
+    """Capture slow queries and show a digest of them. Queries that differ
+    only in their values are grouped together.
+    """
+    from derex.runner.mysql_slowlog import clear_slow_log
+    from derex.runner.mysql_slowlog import digest
+    from derex.runner.mysql_slowlog import disable_slow_log
+    from derex.runner.mysql_slowlog import enable_slow_log
+    from derex.runner.mysql_slowlog import fetch_slow_queries
+    from derex.runner.mysql_slowlog import get_slow_log_settings
+
+    if clear:
+        clear_slow_log()
+        click.echo("Slow query log cleared")
+    if enable:
+        enable_slow_log(long_query_time, not_using_indexes=not_using_indexes)
+        click.echo(
+            f"Logging queries slower than {long_query_time}s. "
+            "Connections opened before now keep the previous threshold"
+        )
+    elif enable is False:
+        disable_slow_log()
+        click.echo("Slow query log disabled")
+    if enable is not None or clear:
+        return 0
+
+    if database is None and isinstance(project, Project):
+        database = project.mysql_db_name
+    digests = digest(fetch_slow_queries(database), sort=sort)
+    if not digests:
+        if get_slow_log_settings().get("slow_query_log") != "ON":
+            click.echo('The slow query log is off: turn it on with "--enable"')
+        else:
+            click.echo("No slow queries logged yet")
+        return 0
+    click.echo(
+        tabulate(
+            (
+                (
+                    el.calls,
+                    el.total_time,
+                    el.average_time * 1000,
+                    el.max_time * 1000,
+                    el.rows_examined,
+                    el.rows_sent,
+                    el.fingerprint[:100],
+                )
+                for el in digests[:limit]
+            ),
+            headers=[
+                "Count",
+                "Total (s)",
+                "Avg (ms)",
+                "Max (ms)",
+                "Rows examined",
+                "Rows sent",
+                "Query",
+            ],
+            floatfmt=".1f",
+        )
+    )
     return 0
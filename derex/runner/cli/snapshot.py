@@ -0,0 +1,96 @@
+from derex.runner.utils import human_size
+from tabulate import tabulate
+
+import click
+
+
+@click.group()
+def snapshot():
+    """Commands to save and restore the data of mysql, mongodb and minio"""
+
+
+@snapshot.command()
+@click.argument("name")
+@click.option(
+    "--archive",
+    is_flag=True,
+    default=False,
+    help=(
+        "Store the snapshot as compressed archives in the derex data directory "
+        "instead of docker volumes"
+    ),
+)
+def create(name: str, archive: bool):
+    """Take a snapshot of the services data.
+    The services using it are stopped while it's copied.
+    """
+    from derex.runner.snapshots import create_snapshot
+
+    try:
+        create_snapshot(name, archive=archive)
+    except (ValueError, RuntimeError) as exc:
+        click.echo(str(exc), err=True)
+        raise click.exceptions.Exit(1)
+    click.echo(f"Created snapshot {name}")
+
+
+@snapshot.command()
+@click.argument("name")
+@click.option(
+    "--force", is_flag=True, default=False, help="Do not ask for confirmation",
+)
+def restore(name: str, force: bool):
+    """Replace the services data with the content of a snapshot"""
+    from derex.runner.snapshots import restore_snapshot
+
+    if not force and not click.confirm(
+        f"All data in mysql, mongodb and minio will be replaced by snapshot {name}. "
+        "Continue?"
+    ):
+        return 1
+    try:
+        restore_snapshot(name)
+    except (ValueError, RuntimeError) as exc:
+        click.echo(str(exc), err=True)
+        raise click.exceptions.Exit(1)
+    click.echo(f"Restored snapshot {name}")
+    return 0
+
+
+@snapshot.command(name="list")
+def list_cmd():
+    """List the available snapshots"""
+    from derex.runner.snapshots import list_snapshots
+
+    snapshots = list_snapshots()
+    if not snapshots:
+        click.echo('No snapshots found. Create one with "derex snapshot create NAME"')
+        return
+    click.echo(
+        tabulate(
+            (
+                (
+                    el.name,
+                    el.kind,
+                    el.created.strftime("%Y-%m-%d %H:%M:%S"),
+                    human_size(el.size) if el.size is not None else "",
+                )
+                for el in snapshots
+            ),
+            headers=["Name", "Kind", "Created", "Size"],
+        )
+    )
+
+
+@snapshot.command()
+@click.argument("name")
+def delete(name: str):
+    """Delete a snapshot"""
+    from derex.runner.snapshots import delete_snapshot
+    from derex.runner.snapshots import get_snapshot
+
+    if get_snapshot(name) is None:
+        click.echo(f"Snapshot {name} does not exist", err=True)
+        raise click.exceptions.Exit(1)
+    delete_snapshot(name)
+    click.echo(f"Deleted snapshot {name}")
@@ -10,6 +10,13 @@ static_root = {"lms": "/openedx/staticfiles", "cms": "/openedx/staticfiles/studi
     service
 ]
 
+if os.environ.get("DEREX_GUNICORN_WORKER_CLASS") == "gevent":
+    # The C MySQLdb driver can't be patched by gevent, and would block
+    # all greenlets of a worker during queries: use the pure python one
+    import pymysql
+
+    pymysql.install_as_MySQLdb()
+
 edx_application = __import__("{}.wsgi".format(service)).wsgi.application  # type: ignore
 
 application = WhiteNoise(edx_application, root=static_root, prefix="/static")
@@ -3,12 +3,14 @@
 """
 from derex.runner.secrets import DerexSecrets
 from derex.runner.secrets import get_secret
+from derex.runner.telemetry import BuildTelemetry
 from derex.runner.utils import abspath_from_egg
 from pathlib import Path
 from requests.exceptions import RequestException
 from typing import Dict
 from typing import Iterable
 from typing import List
+from typing import Optional
 
 import docker
 import io
@@ -110,11 +112,15 @@ def build_image(
     tag: str,
     tag_final: bool = False,
     extra_opts: Dict = {},
+    telemetry: Optional[BuildTelemetry] = None,
 ):
     """Build a docker image. Prepares a build context (a tar stream)
     based on the `paths` argument and includes the Dockerfile text passed
     in `dockerfile_text`.
+    If a `telemetry` object is passed, timing and cache information about
+    the build will be recorded in it.
     """
+    start = time.time()
     dockerfile = io.BytesIO(dockerfile_text.encode())
     context = io.BytesIO()
     context_tar = tarfile.open(fileobj=context, mode="w:gz", dereference=True)
@@ -128,11 +134,15 @@ def build_image(
     output = client.api.build(
         fileobj=context, custom_context=True, encoding="gzip", tag=tag, **extra_opts
     )
+    if telemetry is not None:
+        telemetry.record_context(len(context.getvalue()), time.time() - start)
     for lines in output:
         for line in re.split(br"\r\n|\n", lines):
             if not line:  # Split empty lines
                 continue
             line_decoded = json.loads(line)
+            if telemetry is not None:
+                telemetry.feed_docker_line(line_decoded)
             if "error" in line_decoded:
                 raise BuildError(line_decoded["error"])
             print(line_decoded.get("stream", ""), end="")
@@ -140,6 +150,8 @@ def build_image(
                 print(line_decoded.get("error", ""))
             if "aux" in line_decoded:
                 print(f'Built image: {line_decoded["aux"]["ID"]}')
+    if telemetry is not None:
+        telemetry.record_layers(client.api.history(tag))
     if tag_final:
         final_tag = tag.rpartition(":")[0] + ":latest"
         for image in client.api.images():
@@ -147,6 +159,33 @@ def build_image(
                 client.api.tag(image["Id"], final_tag)
 
 
+def image_exists(needle: str) -> bool:
+    """If the given image exists in the local docker daemon return True.
+    """
+    try:
+        client.api.inspect_image(needle)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+
+def get_image_id(name: str) -> Optional[str]:
+    """Return the ID of the given image, or None if it's not present
+    in the local docker daemon.
+    """
+    try:
+        return client.api.inspect_image(name)["Id"]
+    except docker.errors.ImageNotFound:
+        return None
+
+
+def get_image_labels(name: str) -> Dict[str, str]:
+    """Return the labels of the given image, that must be present
+    in the local docker daemon.
+    """
+    return client.api.inspect_image(name)["Config"].get("Labels") or {}
+
+
 def pull_images(image_names: List[str]):
     """Pull the given image to the local docker daemon.
     """
@@ -160,11 +199,50 @@ def pull_images(image_names: List[str]):
                 print(out["status"])
 
 
+def get_image_registry(image_name: str) -> Optional[str]:
+    """Return the host of the registry the given image name refers to,
+    or None if it refers to the Docker Hub.
+    """
+    first, separator, _ = image_name.partition("/")
+    if separator and ("." in first or ":" in first or first == "localhost"):
+        return first
+    return None
+
+
+def image_in_registry(image_name: str) -> bool:
+    """Return True if the given image tag can be pulled from its registry.
+    """
+    try:
+        client.api.inspect_distribution(image_name)
+    except docker.errors.APIError:
+        return False
+    return True
+
+
+def push_image(image_name: str):
+    """Push the given image to its registry.
+    """
+    repository, _, tag = image_name.rpartition(":")
+    print(f"Pushing image {image_name}")
+    for out in client.api.push(repository, tag, stream=True, decode=True):
+        if "error" in out:
+            raise RegistryError(out["error"])
+        if "progress" in out:
+            print(f'{out["id"]}: {out["progress"]}', end="\r")
+        elif "status" in out:
+            print(out["status"])
+
+
 class BuildError(RuntimeError):
     """An error occurred while building a docker image
     """
 
 
+class RegistryError(RuntimeError):
+    """An error occurred while talking to a docker registry
+    """
+
+
 def get_running_containers():
     return {
         container.name: client.api.inspect_container(container.name)
@@ -173,8 +251,14 @@ def get_running_containers():
 
 
 def get_exposed_container_names():
+    from derex.runner import docker_async
+
+    if docker_async.is_available():
+        containers = docker_async.run(docker_async.get_running_containers())
+    else:
+        containers = get_running_containers()
     result = []
-    for name, container in get_running_containers().items():
+    for name, container in containers.items():
         names = container["NetworkSettings"]["Networks"]["derex"]["Aliases"]
         matching_names = list(filter(lambda el: el.endswith("localhost.derex"), names))
         if matching_names:
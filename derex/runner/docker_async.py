@@ -0,0 +1,305 @@
+# -coding: utf8-
+"""Asyncio counterparts of the functions in `derex.runner.docker`.
+
+The docker engine API is spoken directly over the docker unix socket, one
+connection per request, so that operations spanning many containers, volumes
+or images can be issued concurrently and cost about one round trip overall.
+"""
+from derex.runner.docker import VOLUMES
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import quote
+from urllib.parse import urlencode
+
+import asyncio
+import docker
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+DEFAULT_DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+class DockerAPIError(RuntimeError):
+    """The docker engine answered with an error status code
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class DockerNotFound(DockerAPIError):
+    """The requested docker object does not exist
+    """
+
+
+def get_docker_socket_path() -> Optional[str]:
+    """Return the path to the docker unix socket, honouring the `DOCKER_HOST`
+    environment variable. Return None if it points to a daemon that can't be
+    reached through a unix socket (like `tcp://` and `ssh://` hosts).
+    """
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if not docker_host:
+        return DEFAULT_DOCKER_SOCKET
+    scheme, _, path = docker_host.partition("://")
+    if scheme == "unix":
+        return path
+    return None
+
+
+def is_available() -> bool:
+    """Return True if the docker daemon can be reached by this module.
+    Callers should fall back to the functions in `derex.runner.docker` otherwise.
+    """
+    return get_docker_socket_path() is not None
+
+
+class AsyncDockerClient:
+    """Minimal asyncio HTTP client for the docker engine API.
+    A new connection is opened for every request: the daemon handles them
+    in parallel and no state is shared between concurrent coroutines.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None):
+        self.socket_path = socket_path or get_docker_socket_path()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Any:
+        """Perform a request and return its JSON decoded body
+        (or None if the response is empty).
+        """
+        chunks = []
+        async for chunk in self._request(method, path, params, body, headers):
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        if not data.strip():
+            return None
+        return json.loads(data)
+
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> AsyncIterator[Dict]:
+        """Perform a request whose response is a stream of JSON objects
+        (like the ones returned when pulling or building) and yield them
+        as they arrive.
+        """
+        buffer = b""
+        async for chunk in self._request(method, path, params, body, headers):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]],
+        body: Optional[Any],
+        headers: Optional[Dict[str, str]],
+    ) -> AsyncIterator[bytes]:
+        if self.socket_path is None:
+            raise DockerAPIError(
+                0,
+                f"The docker daemon at {os.environ.get('DOCKER_HOST')} "
+                "can't be reached through a unix socket",
+            )
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            url = quote(path)
+            if params:
+                url += "?" + urlencode(params)
+            data = b"" if body is None else json.dumps(body).encode()
+            request_lines = [
+                f"{method} {url} HTTP/1.1",
+                "Host: docker",
+                "Connection: close",
+                f"Content-Length: {len(data)}",
+            ]
+            if body is not None:
+                request_lines.append("Content-Type: application/json")
+            for name, value in (headers or {}).items():
+                request_lines.append(f"{name}: {value}")
+            writer.write(("\r\n".join(request_lines) + "\r\n\r\n").encode() + data)
+            await writer.drain()
+            status, headers = await read_response_head(reader)
+            if status >= 400:
+                message = b"".join(
+                    [chunk async for chunk in read_body(reader, headers)]
+                )
+                raise error_from_response(status, message)
+            async for chunk in read_body(reader, headers):
+                yield chunk
+        finally:
+            writer.close()
+
+
+async def read_response_head(
+    reader: asyncio.StreamReader,
+) -> Tuple[int, Dict[str, str]]:
+    """Read the status line and headers of an HTTP response.
+    Return the status code and a dictionary with lowercased header names.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise DockerAPIError(0, "Connection closed by the docker daemon")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def read_body(
+    reader: asyncio.StreamReader, headers: Dict[str, str]
+) -> AsyncIterator[bytes]:
+    """Yield the body of an HTTP response as it arrives, taking care of
+    chunked transfer encoding.
+    """
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                break
+            yield await reader.readexactly(size)
+            await reader.readline()  # The CRLF closing the chunk
+    elif "content-length" in headers:
+        length = int(headers["content-length"])
+        if length:
+            yield await reader.readexactly(length)
+    else:
+        while True:
+            data = await reader.read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+
+def error_from_response(status: int, body: bytes) -> DockerAPIError:
+    try:
+        message = json.loads(body)["message"]
+    except (ValueError, KeyError, TypeError):
+        message = body.decode(errors="replace")
+    if status == 404:
+        return DockerNotFound(status, message)
+    return DockerAPIError(status, message)
+
+
+def run(coroutine):
+    """Run the given coroutine in a new event loop and return its result.
+    Useful to call the functions in this module from synchronous code.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+client = AsyncDockerClient()
+
+
+async def ensure_volumes_present():
+    """Make sure the derex volumes necessary for our docker-compose files to
+    work are in place. Missing volumes are created concurrently.
+    """
+    response = await client.request("GET", "/volumes")
+    existing = {volume["Name"] for volume in response.get("Volumes") or []}
+    missing = VOLUMES - existing
+    for volume in missing:
+        logger.warning("Creating docker volume '%s'", volume)
+    await asyncio.gather(
+        *(
+            client.request("POST", "/volumes/create", body={"Name": volume})
+            for volume in missing
+        )
+    )
+
+
+async def check_services(services: Iterable[str]) -> bool:
+    """Check if the services needed for running Open edX are running.
+    All containers are inspected concurrently.
+    """
+    try:
+        containers = await asyncio.gather(
+            *(
+                client.request("GET", f"/containers/{service}/json")
+                for service in services
+            )
+        )
+    except DockerNotFound:
+        return False
+    return all(container["State"]["Status"] == "running" for container in containers)
+
+
+async def get_running_containers() -> Dict[str, Dict]:
+    """Return a dictionary mapping names of the containers attached to the
+    derex network to their details, as returned by `docker inspect`.
+    """
+    network = await client.request("GET", "/networks/derex")
+    ids = list((network.get("Containers") or {}).keys())
+    containers = await asyncio.gather(
+        *(client.request("GET", f"/containers/{id}/json") for id in ids)
+    )
+    return {container["Name"].lstrip("/"): container for container in containers}
+
+
+async def pull_images(image_names: List[str]):
+    """Pull the given images to the local docker daemon, all at the same time."""
+    await asyncio.gather(*(pull_image(image_name) for image_name in image_names))
+
+
+def get_registry_auth_headers(repository: str) -> Dict[str, str]:
+    """Return the headers with the credentials for the registry of `repository`
+    found in the docker client configuration, like docker-py sends them.
+    """
+    registry, _ = docker.auth.resolve_repository_name(repository)
+    authconfig = docker.auth.resolve_authconfig(docker.auth.load_config(), registry)
+    if not authconfig:
+        return {}
+    return {"X-Registry-Auth": docker.auth.encode_header(authconfig).decode()}
+
+
+async def pull_image(image_name: str):
+    # The tag can also be a digest, like the engine API expects
+    repository, tag = docker.utils.parse_repository_tag(image_name)
+    print(f"Pulling image {image_name}")
+    async for out in client.stream(
+        "POST",
+        "/images/create",
+        params={"fromImage": repository, "tag": tag or "latest"},
+        headers=get_registry_auth_headers(repository),
+    ):
+        if "error" in out:
+            raise DockerAPIError(500, out["error"])
+        # Progress bars from concurrent pulls would garble the output
+        if "progress" not in out:
+            print(f'{image_name}: {out.get("status", "")}')
@@ -0,0 +1,145 @@
+"""Compare the formats the database dump included in the Open edX images
+can be compressed with.
+
+Every format is measured with the same commands and levels the image build
+and `restore_dump.py` use: size, time to compress, and time to decompress,
+that is spent by every `derex mysql reset`.
+"""
+from derex.runner.docker import client as docker_client
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import docker
+import io
+import shutil
+import subprocess
+import tarfile
+import time
+
+
+# Keep in sync with the dev stage of the Dockerfile
+COMPRESS_COMMANDS: Dict[str, Optional[List[str]]] = {
+    "zstd": ["zstd", "-q", "-T0", "-10", "-c"],
+    "lz4": ["lz4", "-q", "-9", "-c"],
+    "bzip2": ["bzip2", "-9", "-c"],
+    "none": None,
+}
+# Keep in sync with restore_dump.py
+DECOMPRESS_COMMANDS: Dict[str, Optional[List[str]]] = {
+    "zstd": ["zstd", "-q", "-d", "-c", "-T0"],
+    "lz4": ["lz4", "-q", "-d", "-c"],
+    "bzip2": ["bzip2", "-d", "-c"],
+    "none": None,
+}
+DUMP_EXTENSIONS = {".zst": "zstd", ".lz4": "lz4", ".bz2": "bzip2", ".sql": "none"}
+DUMP_PATHS = [
+    "/openedx/empty_dump.sql.zst",
+    "/openedx/empty_dump.sql.lz4",
+    "/openedx/empty_dump.sql.bz2",
+    "/openedx/empty_dump.sql",
+]
+
+
+class DumpFormatResult(NamedTuple):
+    compression: str
+    size: int
+    compressed_size: int
+    compress_seconds: float
+    decompress_seconds: float
+
+    @property
+    def ratio(self) -> float:
+        return self.size / self.compressed_size if self.compressed_size else 0
+
+    @property
+    def decompress_throughput(self) -> float:
+        """Uncompressed bytes produced per second"""
+        return self.size / self.decompress_seconds if self.decompress_seconds else 0
+
+
+def get_compression(dump_path: Path) -> str:
+    try:
+        return DUMP_EXTENSIONS[dump_path.suffix]
+    except KeyError:
+        raise ValueError(
+            f"Can't tell the compression of {dump_path}: "
+            f"its extension should be one of {', '.join(DUMP_EXTENSIONS)}"
+        )
+
+
+def check_commands(formats: Iterable[str]):
+    for compression in formats:
+        command = COMPRESS_COMMANDS[compression]
+        if command is not None and shutil.which(command[0]) is None:
+            raise RuntimeError(
+                f"The {command[0]} command is needed to test {compression}"
+            )
+
+
+def run_timed(command: Optional[List[str]], source: Path, destination: Path) -> float:
+    """Run `command` with `source` as input and `destination` as output,
+    and return how long it took. Without a command just copy the file.
+    """
+    start = time.time()
+    if command is None:
+        shutil.copyfile(str(source), str(destination))
+    else:
+        with open(source, "rb") as input_fh, open(destination, "wb") as output_fh:
+            subprocess.run(command, stdin=input_fh, stdout=output_fh, check=True)
+    return time.time() - start
+
+
+def extract_dump(image: str, destination: Path) -> Path:
+    """Copy the database dump included in `image` to the `destination` directory
+    and return its path.
+    """
+    container = docker_client.containers.create(image)
+    try:
+        for dump_path in DUMP_PATHS:
+            try:
+                chunks, _ = container.get_archive(dump_path)
+            except docker.errors.NotFound:
+                continue
+            with tarfile.open(fileobj=io.BytesIO(b"".join(chunks))) as archive:
+                archive.extractall(str(destination))
+            return destination / Path(dump_path).name
+    finally:
+        container.remove(force=True)
+    raise RuntimeError(f"No database dump found in image {image}")
+
+
+def benchmark_dump_formats(
+    dump_path: Path, formats: List[str], workdir: Path
+) -> List[DumpFormatResult]:
+    """Compress the dump at `dump_path` in each of the given formats and
+    decompress it again, measuring size and time. `workdir` is used for
+    temporary files.
+    """
+    check_commands(formats + [get_compression(dump_path)])
+    sql_path = workdir / "dump.sql"
+    run_timed(DECOMPRESS_COMMANDS[get_compression(dump_path)], dump_path, sql_path)
+    size = sql_path.stat().st_size
+    results = []
+    for compression in formats:
+        compressed_path = workdir / f"dump.{compression}"
+        compress_seconds = run_timed(
+            COMPRESS_COMMANDS[compression], sql_path, compressed_path
+        )
+        decompress_seconds = run_timed(
+            DECOMPRESS_COMMANDS[compression], compressed_path, workdir / "restored.sql"
+        )
+        results.append(
+            DumpFormatResult(
+                compression,
+                size,
+                compressed_path.stat().st_size,
+                compress_seconds,
+                decompress_seconds,
+            )
+        )
+        compressed_path.unlink()
+    return results
@@ -0,0 +1,114 @@
+"""Compare gunicorn configurations by running the project LMS with each of
+them and measuring how it performs under the same load.
+
+The load is generated by a script running in a container attached to the
+derex network, so that the measurements don't depend on the host networking.
+"""
+from derex.runner.compose_utils import run_compose
+from derex.runner.docker import client as docker_client
+from derex.runner.project import get_gunicorn_options
+from derex.runner.project import GunicornOptions
+from derex.runner.project import Project
+from derex.runner.utils import abspath_from_egg
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+
+import docker
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+LOAD_BENCHMARK_SCRIPT = "derex/runner/load_benchmark.py.source"
+DEFAULT_PATHS = ("/heartbeat", "/")
+
+
+class BenchmarkResult(NamedTuple):
+    options: GunicornOptions
+    requests: int
+    errors: int
+    seconds: float
+    #: Latency percentiles, in seconds
+    p50: float
+    p95: float
+    p99: float
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0
+
+
+def parse_gunicorn_options(value: str) -> GunicornOptions:
+    """Parse a gunicorn configuration in the form `worker_class[:workers[:threads]]`,
+    like `gthread:2:8`. Missing values take their default.
+    """
+    parts = value.split(":")
+    if len(parts) > 3:
+        raise ValueError(f"Invalid gunicorn configuration: {value}")
+    config: Dict = {"worker_class": parts[0]}
+    try:
+        config.update(zip(("workers", "threads"), map(int, parts[1:])))
+    except ValueError:
+        raise ValueError(f"Invalid gunicorn configuration: {value}")
+    return get_gunicorn_options(config)
+
+
+def run_load(
+    project: Project, paths: Iterable[str], concurrency: int, duration: float
+) -> Dict:
+    """Send requests to the project LMS for `duration` seconds from `concurrency`
+    threads and return the statistics collected by the load script.
+    """
+    script_path = abspath_from_egg("derex.runner", LOAD_BENCHMARK_SCRIPT)
+    urls = [f"http://{project.name}.localhost.derex{path}" for path in paths]
+    try:
+        output = docker_client.containers.run(
+            project.image_name,
+            ["python", "/load_benchmark.py", str(concurrency), str(duration), *urls],
+            volumes={str(script_path): {"bind": "/load_benchmark.py", "mode": "ro"}},
+            network="derex",
+            remove=True,
+        )
+    except docker.errors.ContainerError as exc:
+        message = (exc.stderr or b"").decode().strip() or "unknown error"
+        raise RuntimeError(f"Load benchmark failed: {message}")
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def benchmark_gunicorn(
+    project: Project,
+    configurations: List[GunicornOptions],
+    paths: Iterable[str] = DEFAULT_PATHS,
+    concurrency: int = 10,
+    duration: float = 30,
+) -> List[BenchmarkResult]:
+    """Restart the project LMS with each of the given gunicorn configurations
+    and measure its throughput and latency.
+    The LMS is restarted with the project configuration at the end.
+    """
+    original = project.gunicorn
+    results = []
+    try:
+        for options in configurations:
+            logger.info(f"Starting LMS with {options}")
+            project.gunicorn = options
+            run_compose(["up", "-d", "--force-recreate", "lms"], project=project)
+            stats = run_load(project, paths, concurrency, duration)
+            results.append(
+                BenchmarkResult(
+                    options,
+                    stats["requests"],
+                    stats["errors"],
+                    stats["seconds"],
+                    stats["p50"],
+                    stats["p95"],
+                    stats["p99"],
+                )
+            )
+    finally:
+        project.gunicorn = original
+        run_compose(["up", "-d", "--force-recreate", "lms"], project=project)
+    return results
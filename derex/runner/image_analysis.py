@@ -0,0 +1,287 @@
+"""Analyze the layers of a docker image to find out where space goes.
+
+The image is read as a tar stream from the docker daemon (the same data
+`docker save` produces), without writing it to disk. Both the legacy format
+(`<id>/layer.tar`) and the OCI layout (`blobs/sha256/<digest>`) are supported.
+"""
+from derex.runner.docker import client as docker_client
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
+
+import bisect
+import hashlib
+import io
+import json
+import posixpath
+import tarfile
+
+
+WHITEOUT_PREFIX = ".wh."
+OPAQUE_WHITEOUT = ".wh..wh..opq"
+# Duplicates smaller than this are not worth reporting
+MIN_DUPLICATE_SIZE = 1024
+T = TypeVar("T")
+
+
+class IterStream(io.RawIOBase):
+    """A read-only file object that reads from an iterable of byte chunks,
+    like the generators the docker client returns for streamed responses.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.leftover = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.leftover:
+            try:
+                self.leftover = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.leftover))
+        buffer[:size] = self.leftover[:size]
+        self.leftover = self.leftover[size:]
+        return size
+
+
+class Layer:
+    """The files added and removed by a single image layer.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        #: Maps file path to a (size, sha256 digest) tuple
+        self.files: Dict[str, Tuple[int, str]] = {}
+        #: Paths removed by this layer (whiteouts). Directories made opaque
+        #: (whose previous contents are hidden) end with a slash
+        self.deleted: Set[str] = set()
+        self.created_by = ""
+
+    @property
+    def size(self) -> int:
+        return sum(size for size, _ in self.files.values())
+
+
+class Duplicate(NamedTuple):
+    digest: str
+    size: int
+    paths: List[str]
+
+    @property
+    def wasted(self) -> int:
+        return self.size * (len(self.paths) - 1)
+
+
+class ImageAnalysis(NamedTuple):
+    layers: List[Layer]
+    #: The largest directories of the resulting filesystem, with their size
+    largest_dirs: List[Tuple[str, int]]
+    #: Identical files present in the resulting filesystem, biggest waste first
+    duplicates: List[Duplicate]
+    #: Bytes taken by file versions that are overwritten or deleted by a later layer
+    shadowed_size: int
+    suggestions: List[str]
+
+
+def read_layer(name: str, fileobj) -> Layer:
+    layer = Layer(name)
+    with tarfile.open(fileobj=fileobj, mode="r|") as layer_tar:
+        for member in layer_tar:
+            path = posixpath.normpath("/" + member.name)
+            dirname, basename = posixpath.split(path)
+            if basename == OPAQUE_WHITEOUT:
+                layer.deleted.add(dirname.rstrip("/") + "/")
+            elif basename.startswith(WHITEOUT_PREFIX):
+                deleted_name = basename.replace(WHITEOUT_PREFIX, "", 1)
+                layer.deleted.add(posixpath.join(dirname, deleted_name))
+            elif member.isfile():
+                digest = hashlib.sha256()
+                content = layer_tar.extractfile(member)
+                assert content is not None
+                for chunk in iter(lambda: content.read(1024 * 1024), b""):
+                    digest.update(chunk)
+                layer.files[path] = (member.size, digest.hexdigest())
+    return layer
+
+
+def read_image_layers(chunks: Iterable[bytes]) -> List[Layer]:
+    """Read the image tar stream given as an iterable of chunks and return
+    its layers, lowest first.
+    """
+    layers: Dict[str, Layer] = {}
+    manifest = None
+    with tarfile.open(fileobj=IterStream(chunks), mode="r|") as image_tar:
+        for member in image_tar:
+            if not member.isfile():
+                continue
+            fileobj = image_tar.extractfile(member)
+            assert fileobj is not None
+            if member.name == "manifest.json":
+                manifest = json.load(fileobj)
+            elif member.name.endswith("/layer.tar") or member.name.startswith("blobs/"):
+                try:
+                    layers[member.name] = read_layer(member.name, fileobj)
+                except tarfile.ReadError:
+                    pass  # An OCI blob that is not a layer (like the image config)
+    if manifest is None:
+        raise ValueError("Not a docker image archive: manifest.json not found")
+    return [layers[name] for name in manifest[0]["Layers"]]
+
+
+def remove_deleted(files: Dict[str, T], deleted: Iterable[str]) -> List[T]:
+    """Remove from `files` the given deleted paths and everything below them,
+    and return the removed values.
+    The paths are sorted once: the ones below a directory are contiguous in
+    sorted order, and are found with a binary search.
+    """
+    removed: List[T] = []
+    paths = None
+    for path in deleted:
+        path = path.rstrip("/")
+        if path in files:
+            removed.append(files.pop(path))
+        if paths is None:
+            paths = sorted(files)
+        # "0" is the character following "/": this is the end of the paths below
+        start = bisect.bisect_left(paths, path + "/")
+        end = bisect.bisect_left(paths, path + "0", start)
+        for child in paths[start:end]:
+            if child in files:
+                removed.append(files.pop(child))
+    return removed
+
+
+def get_final_files(layers: List[Layer]) -> Dict[str, Tuple[int, str]]:
+    """Apply the layers in order and return the files of the resulting filesystem.
+    """
+    files: Dict[str, Tuple[int, str]] = {}
+    for layer in layers:
+        remove_deleted(files, layer.deleted)
+        files.update(layer.files)
+    return files
+
+
+def get_shadowed_size(layers: List[Layer]) -> int:
+    """Return the size of the files that are present in a layer, but that
+    are overwritten or deleted by a later one.
+    """
+    files: Dict[str, int] = {}
+    shadowed = 0
+    for layer in layers:
+        shadowed += sum(remove_deleted(files, layer.deleted))
+        for path, (size, _) in layer.files.items():
+            shadowed += files.pop(path, 0)
+            files[path] = size
+    return shadowed
+
+
+def get_largest_dirs(
+    files: Dict[str, Tuple[int, str]], depth: int = 3, top: int = 10
+) -> List[Tuple[str, int]]:
+    """Return the `top` largest directories at most `depth` levels deep.
+    """
+    sizes: Dict[str, int] = {}
+    for path, (size, _) in files.items():
+        parts = path.strip("/").split("/")[:-1]
+        for level in range(1, min(depth, len(parts)) + 1):
+            directory = "/" + "/".join(parts[:level])
+            sizes[directory] = sizes.get(directory, 0) + size
+    # Only report the deepest of nested directories with the same size
+    result = sorted(sizes.items(), key=lambda el: (-el[1], -len(el[0])))
+    return [
+        (directory, size)
+        for directory, size in result
+        if not any(
+            other.startswith(directory + "/") and sizes[other] == size
+            for other in sizes
+        )
+    ][:top]
+
+
+def get_duplicates(files: Dict[str, Tuple[int, str]], top: int = 10) -> List[Duplicate]:
+    by_digest: Dict[str, List[str]] = {}
+    for path, (size, digest) in files.items():
+        if size >= MIN_DUPLICATE_SIZE:
+            by_digest.setdefault(digest, []).append(path)
+    duplicates = [
+        Duplicate(digest, files[paths[0]][0], sorted(paths))
+        for digest, paths in by_digest.items()
+        if len(paths) > 1
+    ]
+    duplicates.sort(key=lambda el: el.wasted, reverse=True)
+    return duplicates[:top]
+
+
+def get_suggestions(
+    files: Dict[str, Tuple[int, str]], duplicated_size: int, shadowed_size: int,
+) -> List[str]:
+    from derex.runner.utils import human_size
+
+    suggestions = []
+    if shadowed_size:
+        suggestions.append(
+            f"{human_size(shadowed_size)} are taken by files overwritten or deleted "
+            "in later layers: squash the image (enable experimental mode in the "
+            "docker daemon) or remove files in the same step that creates them"
+        )
+    if duplicated_size:
+        suggestions.append(
+            f"{human_size(duplicated_size)} could be saved by replacing duplicate "
+            "files with links (rmlint does this when building the themes image)"
+        )
+    node_modules = sum(
+        size for path, (size, _) in files.items() if "/node_modules/" in path
+    )
+    if node_modules:
+        suggestions.append(
+            f"{human_size(node_modules)} are in node_modules directories: "
+            "they're only needed to compile assets"
+        )
+    return suggestions
+
+
+def analyze_layers(layers: List[Layer], top: int = 10) -> ImageAnalysis:
+    files = get_final_files(layers)
+    all_duplicates = get_duplicates(files, top=len(files))
+    shadowed_size = get_shadowed_size(layers)
+    suggestions = get_suggestions(
+        files, sum(el.wasted for el in all_duplicates), shadowed_size
+    )
+    return ImageAnalysis(
+        layers,
+        get_largest_dirs(files, top=top),
+        all_duplicates[:top],
+        shadowed_size,
+        suggestions,
+    )
+
+
+def get_layer_commands(image: str) -> Iterator[str]:
+    """Yield the commands that created the non-empty layers of the given image,
+    lowest first.
+    """
+    for entry in reversed(docker_client.api.history(image)):
+        if entry["Size"]:
+            yield entry["CreatedBy"]
+
+
+def analyze_image(image: str, top: int = 10) -> ImageAnalysis:
+    """Read the given image from the docker daemon and analyze its layers.
+    """
+    layers = read_image_layers(docker_client.api.get_image(image))
+    commands = list(get_layer_commands(image))
+    non_empty_layers = [layer for layer in layers if layer.files or layer.deleted]
+    # Only trust the pairing if the numbers match
+    if len(commands) == len(non_empty_layers):
+        for layer, command in zip(non_empty_layers, commands):
+            layer.created_by = command
+    return analyze_layers(layers, top=top)
@@ -0,0 +1,210 @@
+"""Save and load docker images as zstd compressed archives, to move them
+to hosts that can't reach a registry.
+
+Archives are in the `docker save` format, compressed by the `zstd` command
+line tool using all available CPUs. Layers the target host already has can be
+left out: `docker load` does not need them.
+Layers are identified by their chain ID, that depends on the layer content
+and on all the layers below it.
+"""
+from derex.runner.docker import client as docker_client
+from derex.runner.image_analysis import IterStream
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class TransferStats(NamedTuple):
+    #: Bytes of the uncompressed image archive
+    size: int
+    compressed_size: int
+    seconds: float
+    skipped_layers: int = 0
+    skipped_size: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Uncompressed bytes processed per second"""
+        return self.size / self.seconds if self.seconds else 0
+
+
+def zstd_command(*args: str) -> List[str]:
+    zstd = shutil.which("zstd")
+    if zstd is None:
+        raise RuntimeError("The zstd command is needed to save and load images")
+    return [zstd, "-q", "-T0", *args]
+
+
+def get_chain_ids(diff_ids: List[str]) -> List[str]:
+    """Compute the chain IDs of the layers with the given diff IDs, lowest first.
+    """
+    chain_ids: List[str] = []
+    for diff_id in diff_ids:
+        if chain_ids:
+            digest = hashlib.sha256(f"{chain_ids[-1]} {diff_id}".encode()).hexdigest()
+            chain_ids.append(f"sha256:{digest}")
+        else:
+            chain_ids.append(diff_id)
+    return chain_ids
+
+
+def get_local_layers() -> Set[str]:
+    """Return the chain IDs of the layers of all images in the local docker daemon.
+    """
+    result: Set[str] = set()
+    for image_id in docker_client.api.images(quiet=True):
+        diff_ids = docker_client.api.inspect_image(image_id)["RootFS"].get("Layers", [])
+        result.update(get_chain_ids(diff_ids))
+    return result
+
+
+def get_layers_to_skip(image: str, known_layers: Set[str]) -> Set[str]:
+    """Return the diff IDs of the layers of the given image that can be left
+    out of its archive, because their chain ID is in `known_layers`.
+    """
+    diff_ids = docker_client.api.inspect_image(image)["RootFS"]["Layers"]
+    layers = list(zip(diff_ids, get_chain_ids(diff_ids)))
+    # The same content can appear at different heights: only skip it if
+    # all its occurrences are known
+    needed = {diff_id for diff_id, chain_id in layers if chain_id not in known_layers}
+    return {diff_id for diff_id, _ in layers} - needed
+
+
+def filter_image_stream(
+    source: IO[bytes], output: IO[bytes], skip_diff_ids: Set[str]
+) -> Tuple[int, int]:
+    """Copy the image archive read from `source` to `output` leaving out
+    the layers with the given diff IDs.
+    Return the number of layers left out and their size.
+    """
+    skipped, skipped_size = 0, 0
+    with tarfile.open(fileobj=source, mode="r|") as source_tar, tarfile.open(
+        fileobj=output, mode="w|"
+    ) as output_tar:
+        for member in source_tar:
+            if not member.isfile():
+                output_tar.addfile(member)
+                continue
+            fileobj = source_tar.extractfile(member)
+            assert fileobj is not None
+            if member.name.startswith("blobs/sha256/"):
+                # OCI layout: the blob name is its digest, the diff ID for layers
+                diff_id = "sha256:" + member.name.rpartition("/")[2]
+            elif member.name.endswith("/layer.tar"):
+                # Legacy layout: we only know the diff ID after reading the layer
+                fileobj, diff_id = spool_and_hash(fileobj)
+            else:
+                diff_id = None
+            if diff_id in skip_diff_ids:
+                skipped += 1
+                skipped_size += member.size
+                continue
+            output_tar.addfile(member, fileobj)
+    return skipped, skipped_size
+
+
+def spool_and_hash(fileobj: IO[bytes]) -> Tuple[IO[bytes], str]:
+    """Copy the given file to a temporary one and return it together
+    with the digest of its content.
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.TemporaryFile()
+    for chunk in iter(lambda: fileobj.read(COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, f"sha256:{digest.hexdigest()}"
+
+
+class CountingIterator:
+    """Wrap an iterable of byte chunks keeping track of the bytes it yields.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.count = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.chunks:
+            self.count += len(chunk)
+            yield chunk
+
+
+def save_image(
+    image: str, path: str, known_layers: Optional[Set[str]] = None
+) -> TransferStats:
+    """Save the given image to a zstd compressed archive at `path`,
+    leaving out the layers whose chain ID is in `known_layers`.
+    """
+    start = time.time()
+    skip_diff_ids = get_layers_to_skip(image, known_layers) if known_layers else set()
+    chunks = CountingIterator(docker_client.api.get_image(image, COPY_CHUNK_SIZE))
+    with open(path, "wb") as output:
+        process = subprocess.Popen(
+            zstd_command("-c"), stdin=subprocess.PIPE, stdout=output
+        )
+        assert process.stdin is not None
+        stdin = process.stdin
+        try:
+            skipped, skipped_size = filter_image_stream(
+                io.BufferedReader(IterStream(chunks)), stdin, skip_diff_ids
+            )
+        finally:
+            stdin.close()
+            returncode = process.wait()
+    if returncode:
+        raise RuntimeError(f"zstd exited with status {returncode}")
+    return TransferStats(
+        size=chunks.count,
+        compressed_size=os.path.getsize(path),
+        seconds=time.time() - start,
+        skipped_layers=skipped,
+        skipped_size=skipped_size,
+    )
+
+
+def load_image(path: str) -> Tuple[TransferStats, List[str]]:
+    """Load the images in the zstd compressed archive at `path` into the
+    docker daemon. Return the transfer statistics and the messages docker
+    printed (like the names of the loaded images).
+    """
+    start = time.time()
+    process = subprocess.Popen(zstd_command("-d", "-c", path), stdout=subprocess.PIPE)
+    assert process.stdout is not None
+    stdout = process.stdout
+    chunks = CountingIterator(iter(lambda: stdout.read(COPY_CHUNK_SIZE), b""))
+    messages = []
+    try:
+        for line in docker_client.api.load_image(iter(chunks)):
+            if "error" in line:
+                raise RuntimeError(line["error"])
+            if line.get("stream", "").strip():
+                messages.append(line["stream"].strip())
+    finally:
+        stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise RuntimeError(f"zstd exited with status {returncode}")
+    stats = TransferStats(
+        size=chunks.count,
+        compressed_size=os.path.getsize(path),
+        seconds=time.time() - start,
+    )
+    return stats, messages
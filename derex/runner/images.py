@@ -0,0 +1,181 @@
+"""Utility functions to manage the docker images derex builds for projects.
+"""
+from datetime import datetime
+from datetime import timezone
+from derex.runner.docker import client as docker_client
+from derex.runner.project import Project
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Set
+from typing import Tuple
+
+import docker
+import logging
+import re
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: The image stages derex builds for a project. Their tags are content hashes.
+PROJECT_IMAGE_STAGES = ("requirements", "assets", "themes")
+CONTENT_HASH_TAG = re.compile(r"^[0-9a-f]{6}$")
+
+
+class ProjectImage(NamedTuple):
+    """A content-addressed project image tag present in the local docker daemon"""
+
+    tag: str
+    stage: str
+    id: str
+    size: int
+    #: True if the image also carries tags that are not content hashes (like `latest`)
+    has_other_tags: bool
+    #: Unix timestamp of the last time this image was built, tagged
+    #: or used to create a container
+    last_used: float
+
+
+def parse_docker_time(value: str) -> float:
+    """Convert a timestamp as returned by the docker API (RFC 3339, possibly
+    with nanoseconds) to a unix timestamp.
+    """
+    match = re.match(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)", value or "")
+    if not match:
+        return 0
+    parsed = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S")
+    if parsed.year < 1970:  # Docker uses year 1 for "never"
+        return 0
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def is_content_hash_tag(tag: str, repository: str) -> bool:
+    tag_repository, _, tag_name = tag.rpartition(":")
+    return tag_repository == repository and bool(CONTENT_HASH_TAG.match(tag_name))
+
+
+def get_containers_image_usage() -> Dict[str, float]:
+    """Return a dictionary mapping the ID of every image used by a container
+    (running or not) to the creation time of its most recent container.
+    """
+    usage: Dict[str, float] = {}
+    for container in docker_client.api.containers(all=True):
+        image_id = container["ImageID"]
+        usage[image_id] = max(usage.get(image_id, 0), container["Created"])
+    return usage
+
+
+def get_running_images() -> Set[str]:
+    """Return the IDs of the images used by running containers.
+    """
+    return {
+        container["ImageID"] for container in docker_client.api.containers(all=False)
+    }
+
+
+def get_project_images(project: Project) -> Dict[str, List[ProjectImage]]:
+    """Return a dictionary mapping each project image stage to the content
+    addressed tags present locally for it, most recently used first.
+    """
+    containers_usage = get_containers_image_usage()
+    result: Dict[str, List[ProjectImage]] = {}
+    for stage in PROJECT_IMAGE_STAGES:
+        repository = f"{project.image_prefix}-{stage}"
+        stage_images = []
+        for image in docker_client.api.images(name=repository):
+            tags = image.get("RepoTags") or []
+            hash_tags = [tag for tag in tags if is_content_hash_tag(tag, repository)]
+            for tag in hash_tags:
+                metadata = docker_client.api.inspect_image(image["Id"])
+                last_used = max(
+                    image["Created"],
+                    parse_docker_time(metadata["Metadata"].get("LastTagTime", "")),
+                    containers_usage.get(image["Id"], 0),
+                )
+                stage_images.append(
+                    ProjectImage(
+                        tag,
+                        stage,
+                        image["Id"],
+                        image["Size"],
+                        len(tags) > len(hash_tags),
+                        last_used,
+                    )
+                )
+        stage_images.sort(key=lambda el: el.last_used, reverse=True)
+        result[stage] = stage_images
+    return result
+
+
+def select_images_to_remove(
+    project: Project, keep: int = 2, min_age: float = 3600
+) -> List[ProjectImage]:
+    """Apply the retention policy to the project images and return the ones
+    that should be removed:
+
+    * the `keep` most recently used tags for each stage are retained
+    * tags used less than `min_age` seconds ago are retained, so that images
+      being produced or consumed by a build running right now are left alone
+    * the images the project currently points to are retained
+    * images also tagged with a name that is not a content hash are retained
+    * images used by running containers are retained
+    """
+    protected_tags = {
+        project.requirements_image_name,
+        project.assets_image_name,
+        project.themes_image_name,
+    }
+    running_images = get_running_images()
+    now = time.time()
+    to_remove = []
+    for stage, images in get_project_images(project).items():
+        for image in images[keep:]:
+            if image.tag in protected_tags:
+                continue
+            if image.has_other_tags:
+                logger.info(f"Keeping {image.tag}: the image has other tags")
+                continue
+            if image.id in running_images:
+                logger.info(f"Keeping {image.tag}: used by a running container")
+                continue
+            if now - image.last_used < min_age:
+                logger.info(f"Keeping {image.tag}: used recently")
+                continue
+            to_remove.append(image)
+    return to_remove
+
+
+def get_layers_size() -> int:
+    """Return the space taken by all image layers in the docker daemon.
+    """
+    return docker_client.api.df()["LayersSize"]
+
+
+def gc_project_images(
+    project: Project, keep: int = 2, min_age: float = 3600, dry_run: bool = False
+) -> Tuple[List[ProjectImage], int]:
+    """Remove stale content-addressed images of the given project.
+    Return the list of removed images and the disk space reclaimed in bytes.
+
+    Tags are removed without forcing: if docker refuses to remove one
+    (for instance because a container was created from it in the meantime)
+    it is skipped.
+    """
+    candidates = select_images_to_remove(project, keep=keep, min_age=min_age)
+    if dry_run or not candidates:
+        return candidates, 0
+    size_before = get_layers_size()
+    removed = []
+    for image in candidates:
+        try:
+            docker_client.api.remove_image(image.tag)
+        except docker.errors.NotFound:
+            continue
+        except docker.errors.APIError as exc:
+            logger.warning(f"Could not remove {image.tag}: {exc.explanation}")
+            continue
+        removed.append(image)
+    # Builds running at the same time might add layers: never report negative values
+    reclaimed = max(size_before - get_layers_size(), 0)
+    return removed, reclaimed
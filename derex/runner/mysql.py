@@ -1,19 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from derex.runner.compose_utils import run_compose
 from derex.runner.docker import check_services
 from derex.runner.docker import client as docker_client
 from derex.runner.docker import wait_for_service
 from derex.runner.project import Project
 from derex.runner.utils import abspath_from_egg
+from derex.runner.utils import get_dir_hash
+from functools import lru_cache
 from typing import cast
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Tuple
 
+import atexit
+import hashlib
 import logging
 import pymysql
+import threading
 
 
 logger = logging.getLogger(__name__)
+#: Connections used to count users concurrently in show_databases
+SHOW_DATABASES_WORKERS = 4
+#: Table of pristine databases that holds the hash of the dump and fixtures they contain
+PRISTINE_META_TABLE = "derex_pristine"
 
 
 def wait_for_mysql(max_seconds: int = 20):
@@ -23,126 +37,347 @@ def wait_for_mysql(max_seconds: int = 20):
     return wait_for_service("mysql", 'mysql -psecret -e "SHOW DATABASES"', max_seconds)
 
 
+@lru_cache(maxsize=None)
+def get_mysql_host() -> str:
+    """Make sure the mysql service is up and return its IP address.
+    The result is cached: call `reset_mysql_pool` if the service is restarted.
+    """
+    if not check_services(["mysql"]):
+        raise RuntimeError(
+            "Mysql service not found.\nMaybe you forgot to run\nddc-services up -d"
+        )
+
+    wait_for_mysql()
+    container = docker_client.containers.get("mysql")
+    return container.attrs["NetworkSettings"]["Networks"]["derex"]["IPAddress"]
+
+
+def connect(**params) -> pymysql.connections.Connection:
+    """Open a new connection to the mysql service with the given pymysql parameters.
+    """
+    try:
+        return pymysql.connect(host=get_mysql_host(), port=3306, **params)
+    except pymysql.err.OperationalError:
+        # The service might have been restarted with a different IP address
+        get_mysql_host.cache_clear()
+        return pymysql.connect(host=get_mysql_host(), port=3306, **params)
+
+
+class ConnectionPool:
+    """A process-wide pool of connections to the mysql service.
+    Connections are kept open after use and handed out again to callers
+    asking for a connection with the same parameters.
+    """
+
+    def __init__(self):
+        self._idle: Dict[Tuple, List[pymysql.connections.Connection]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, **params) -> pymysql.connections.Connection:
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            idle = self._idle.get(key)
+            connection = idle.pop() if idle else None
+        if connection is not None:
+            try:
+                connection.ping(reconnect=False)
+                return connection
+            except pymysql.err.Error:
+                close_quietly(connection)
+        return connect(**params)
+
+    def release(self, connection: pymysql.connections.Connection, **params):
+        """Give back a connection, rolling back any uncommitted transaction.
+        """
+        try:
+            connection.rollback()
+            if connection.get_autocommit() != params.get("autocommit", False):
+                connection.autocommit(params.get("autocommit", False))
+        except pymysql.err.Error:
+            close_quietly(connection)
+            return
+        with self._lock:
+            self._idle.setdefault(tuple(sorted(params.items())), []).append(connection)
+
+    def close_all(self):
+        with self._lock:
+            connections = [el for idle in self._idle.values() for el in idle]
+            self._idle.clear()
+        for connection in connections:
+            close_quietly(connection)
+
+
+def close_quietly(connection: pymysql.connections.Connection):
+    try:
+        connection.close()
+    except pymysql.err.Error:
+        pass  # Already closed or broken
+
+
+pool = ConnectionPool()
+atexit.register(pool.close_all)
+
+
+def reset_mysql_pool():
+    """Close all pooled connections and forget the mysql service address.
+    """
+    pool.close_all()
+    get_mysql_host.cache_clear()
+
+
+@contextmanager
+def mysql_cursor(
+    user: str = "root", password: str = "secret", database: Optional[str] = "", **kwargs
+) -> Iterator[pymysql.cursors.Cursor]:
+    """Context manager that yields a cursor on a pooled connection to the mysql server.
+    The connection goes back to the pool when the block exits:
+    commit explicitly (or pass `autocommit=True`) to keep changes,
+    and don't change its default database.
+
+    .. code-block:: python
+
+        with mysql_cursor() as cursor:
+            cursor.execute("SHOW DATABASES")
+    """
+    params = dict(user=user, passwd=password, db=database, **kwargs)
+    connection = pool.acquire(**params)
+    try:
+        with connection.cursor() as cursor:
+            yield cursor
+    except pymysql.err.OperationalError:
+        # The connection might be broken: don't reuse it
+        close_quietly(connection)
+        raise
+    except BaseException:
+        pool.release(connection, **params)
+        raise
+    else:
+        pool.release(connection, **params)
+
+
 def get_mysql_client(
     user: str = "root", password: str = "secret", database: Optional[str] = "", **kwargs
 ) -> pymysql.cursors.Cursor:
-    """Return a cursor on the mysql server. If the connection object is needed
+    """Return a cursor on a new connection to the mysql server, that the caller
+    is responsible for closing. If the connection object is needed
     it can be accessed from the cursor object:
 
     .. code-block:: python
 
         mysql_client = get_mysql_client()
         mysql_client.connection.autocommit(True)
-    """
 
-    if not check_services(["mysql"]):
-        raise RuntimeError(
-            "Mysql service not found.\nMaybe you forgot to run\nddc-services up -d"
-        )
-
-    wait_for_mysql()
-    container = docker_client.containers.get("mysql")
-    mysql_host = container.attrs["NetworkSettings"]["Networks"]["derex"]["IPAddress"]
-
-    connection = pymysql.connect(
-        host=mysql_host, port=3306, user=user, passwd=password, db=database, **kwargs
-    )
-    return connection.cursor()
+    Prefer `mysql_cursor`, that reuses connections.
+    """
+    return connect(user=user, passwd=password, db=database, **kwargs).cursor()
 
 
 def show_databases() -> List[Tuple[str, int, int]]:
     """List all existing databases together with some
     useful infos (number of tables, number of Django users).
     """
-    client = get_mysql_client()
-    try:
-        databases_tuples = []
-        client.execute("SHOW DATABASES;")
-        query_result = cast(Tuple[Tuple[str]], client.fetchall())
+    with mysql_cursor() as cursor:
+        cursor.execute("SHOW DATABASES;")
+        query_result = cast(Tuple[Tuple[str]], cursor.fetchall())
         databases_names = [row[0] for row in query_result]
-        for database_name in databases_names:
-            client.execute(f"USE {database_name}")
-            table_count = client.execute("SHOW TABLES;")
-            try:
-                client.execute("SELECT COUNT(*) FROM auth_user;")
-                query_result = cast(Tuple[Tuple[str]], client.fetchall())
-                django_users_count = int(query_result[0][0])
-            except (pymysql.err.InternalError, pymysql.err.ProgrammingError):
-                django_users_count = 0
-            databases_tuples.append((database_name, table_count, django_users_count))
-    finally:
-        client.connection.close()
-    return databases_tuples
+        # Count tables of all databases at once, and find out which ones have users
+        cursor.execute(
+            "SELECT TABLE_SCHEMA, COUNT(*), SUM(TABLE_NAME = 'auth_user') "
+            "FROM information_schema.TABLES GROUP BY TABLE_SCHEMA;"
+        )
+        tables = {row[0]: (int(row[1]), bool(row[2])) for row in cursor.fetchall()}
+    django_users_counts = count_django_users(
+        [name for name in databases_names if tables.get(name, (0, False))[1]]
+    )
+    return [
+        (
+            database_name,
+            tables.get(database_name, (0, False))[0],
+            django_users_counts.get(database_name, 0),
+        )
+        for database_name in databases_names
+    ]
+
+
+def count_django_users(databases_names: List[str]) -> Dict[str, int]:
+    """Count the Django users in the given databases, using up to
+    SHOW_DATABASES_WORKERS concurrent connections.
+    """
+    if not databases_names:
+        return {}
+
+    def count(names: List[str]) -> Dict[str, int]:
+        result = {}
+        with mysql_cursor() as cursor:
+            for name in names:
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM `{name}`.auth_user;")
+                    result[name] = int(cursor.fetchone()[0])
+                except (pymysql.err.InternalError, pymysql.err.ProgrammingError):
+                    result[name] = 0
+        return result
+
+    workers = min(SHOW_DATABASES_WORKERS, len(databases_names))
+    chunks = [databases_names[index::workers] for index in range(workers)]
+    counts: Dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(count, chunks):
+            counts.update(result)
+    return counts
 
 
 def show_users() -> Optional[Tuple[Tuple[str, str, str]]]:
     """List all mysql users.
     """
-    client = get_mysql_client()
-    client.execute("SELECT user, host, password FROM mysql.user;")
-    users = cast(Tuple[Tuple[str, str, str]], client.fetchall())
+    with mysql_cursor() as cursor:
+        cursor.execute("SELECT user, host, password FROM mysql.user;")
+        users = cast(Tuple[Tuple[str, str, str]], cursor.fetchall())
     return users
 
 
 def create_database(database_name: str):
     """Create a database if doesn't exists"""
-    client = get_mysql_client()
     logger.info(f'Creating database "{database_name}"...')
-    client.execute(f"CREATE DATABASE {database_name} CHARACTER SET utf8")
+    with mysql_cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {database_name} CHARACTER SET utf8")
     logger.info(f'Successfully created database "{database_name}"')
 
 
 def create_user(user: str, password: str, host: str):
     """Create a user if doesn't exists"""
-    client = get_mysql_client()
     logger.info(f"Creating user '{user}'@'{host}'...")
-    client.execute(f"CREATE USER '{user}'@'{host}' IDENTIFIED BY '{password}';")
+    with mysql_cursor() as cursor:
+        cursor.execute(f"CREATE USER '{user}'@'{host}' IDENTIFIED BY '{password}';")
     logger.info(f"Successfully created user '{user}'@'{host}'")
 
 
 def drop_database(database_name: str):
     """Drops the selected database"""
-    client = get_mysql_client()
     logger.info(f'Dropping database "{database_name}"...')
-    client.execute(f"DROP DATABASE IF EXISTS {database_name};")
+    with mysql_cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {database_name};")
     logger.info(f'Successfully dropped database "{database_name}"')
 
 
 def drop_user(user: str, host: str):
     """Drops the selected user"""
-    client = get_mysql_client()
     logger.info(f"Dropping user '{user}'@'{host}'...")
-    client.execute(f"DROP USER '{user}'@'{host}';")
+    with mysql_cursor() as cursor:
+        cursor.execute(f"DROP USER '{user}'@'{host}';")
     logger.info(f"Successfully dropped user '{user}'@'{host}'")
 
 
-def copy_database(source_db_name: str, destination_db_name: str):
+def copy_database(
+    source_db_name: str,
+    destination_db_name: str,
+    workers: int = 4,
+    exclude_tables: Iterable[str] = (),
+):
     """
-    Copy an existing MySQL database. This actually involves exporting and importing back
-    the database with a different name.
+    Copy an existing MySQL database, copying `workers` tables at a time.
+    Return a list of `derex.runner.mysql_copy.TableCopy` with statistics about
+    each copied table.
     """
-    create_database(destination_db_name)
+    from derex.runner.mysql_copy import copy_database as copy_tables
+
     logger.info(f"Copying database {source_db_name} to {destination_db_name}")
-    run_compose(
-        [
-            "run",
-            "--rm",
-            "mysql",
-            "sh",
-            "-c",
-            f"""set -ex
-                mysqldump -h mysql -u root -psecret {source_db_name} --no-create-db |
-                mysql -h mysql --user=root -psecret {destination_db_name}
-            """,
-        ]
+    results = copy_tables(
+        source_db_name,
+        destination_db_name,
+        workers=workers,
+        exclude_tables=exclude_tables,
     )
     logger.info(
         f"Successfully copied database {source_db_name} to {destination_db_name}"
     )
+    return results
+
+
+def get_pristine_db_name(project: Project) -> str:
+    return f"{project.mysql_db_name}_pristine"
+
+
+def get_reset_hash(project: Project) -> str:
+    """Return a hash of what a reset restores: the dump included in the
+    base image and the project fixtures.
+    """
+    result = hashlib.sha256(
+        docker_client.api.inspect_image(project.base_image)["Id"].encode()
+    )
+    if project.fixtures_dir:
+        result.update(get_dir_hash(project.fixtures_dir).encode())
+    return result.hexdigest()
+
+
+def get_pristine_hash(project: Project) -> Optional[str]:
+    """Return the reset hash the pristine database of the project was created
+    with, or None if there is no pristine database.
+    """
+    pristine_db_name = get_pristine_db_name(project)
+    with mysql_cursor() as cursor:
+        found = cursor.execute(
+            "SELECT 1 FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+            (pristine_db_name, PRISTINE_META_TABLE),
+        )
+        if not found:
+            return None
+        cursor.execute(f"SELECT hash FROM `{pristine_db_name}`.`{PRISTINE_META_TABLE}`")
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_pristine_database(project: Project, reset_hash: str):
+    """Keep a copy of the freshly reset project database, to be cloned
+    by later resets.
+    """
+    pristine_db_name = get_pristine_db_name(project)
+    drop_database(pristine_db_name)
+    copy_database(project.mysql_db_name, pristine_db_name)
+    with mysql_cursor(autocommit=True) as cursor:
+        cursor.execute(
+            f"CREATE TABLE `{pristine_db_name}`.`{PRISTINE_META_TABLE}` "
+            "(hash VARCHAR(64) NOT NULL)"
+        )
+        cursor.execute(
+            f"INSERT INTO `{pristine_db_name}`.`{PRISTINE_META_TABLE}` VALUES (%s)",
+            (reset_hash,),
+        )
+
+
+def reset_mysql_openedx(project: Project, dry_run: bool = False, full: bool = False):
+    """Reset the project mysql db.
+    The first time the dump is restored and fixtures are loaded by a script
+    run in the derex/openedx image, and a pristine copy of the result is kept.
+    Later resets clone the pristine copy, unless the dump or the fixtures changed
+    or `full` is True.
+    """
+    if not dry_run:
+        reset_hash = get_reset_hash(project)
+        if not full and get_pristine_hash(project) == reset_hash:
+            logger.info(f"Restoring {project.mysql_db_name} from its pristine copy")
+            drop_database(project.mysql_db_name)
+            copy_database(
+                get_pristine_db_name(project),
+                project.mysql_db_name,
+                exclude_tables=[PRISTINE_META_TABLE],
+            )
+            return
+    run_restore_dump(project, dry_run=dry_run)
+    if not dry_run:
+        save_pristine_database(project, reset_hash)
+
+
+def load_fixtures(project: Project, dry_run: bool = False):
+    """Load the project fixtures that were added or changed since they were
+    last loaded, without restoring the database dump.
+    """
+    run_restore_dump(project, "--fixtures-only", dry_run=dry_run)
 
 
-def reset_mysql_openedx(project: Project, dry_run: bool = False):
-    """Run script from derex/openedx image to reset the mysql db.
+def run_restore_dump(project: Project, *args: str, dry_run: bool = False):
+    """Run the script that restores the dump and loads fixtures in a
+    project lms container.
     """
     restore_dump_path = abspath_from_egg(
         "derex.runner", "derex/runner/restore_dump.py.source"
@@ -159,6 +394,7 @@ def reset_mysql_openedx(project: Project, dry_run: bool = False):
             "lms",
             "python",
             "/restore_dump.py",
+            *args,
         ],
         project=project,
         dry_run=dry_run,
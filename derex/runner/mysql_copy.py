@@ -0,0 +1,363 @@
+"""Copy a mysql database into another one on the same server.
+
+Rows are copied server side with `INSERT ... SELECT`, one table at a time
+on each of a number of concurrent connections. Tables are created with only
+their primary key: secondary indexes and foreign keys are added once the
+data is in place, which is much faster than updating them row by row.
+
+Writes to the source tables are blocked while rows are copied, so that all
+tables are copied from the same state of the database: the connections
+copying them can't share a transaction snapshot like `mysqldump
+--single-transaction` does. Stored routines, views, triggers and events are
+copied last; triggers are created after the data, so that they don't fire
+while rows are inserted.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from derex.runner.mysql import create_database
+from derex.runner.mysql import get_mysql_client
+from derex.runner.mysql import mysql_cursor
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+from typing import TypeVar
+
+import logging
+import pymysql
+import queue
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Like mysqldump does: rows with a 0 id keep it, and data is trusted to be consistent
+COPY_SESSION_SETTINGS = (
+    "SET SESSION sql_mode = 'NO_AUTO_VALUE_ON_ZERO', "
+    "foreign_key_checks = 0, unique_checks = 0"
+)
+KEY_DEFINITION = re.compile(r"^(UNIQUE |FULLTEXT |SPATIAL )?KEY ")
+FOREIGN_KEY_DEFINITION = re.compile(r"^CONSTRAINT .* FOREIGN KEY ")
+AUTO_INCREMENT_COLUMN = re.compile(r"^(`[^`]+`) .* AUTO_INCREMENT")
+
+
+class TableCopy(NamedTuple):
+    name: str
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0
+
+
+class TableDefinition(NamedTuple):
+    #: The CREATE TABLE statement without secondary keys and foreign keys
+    create: str
+    keys: List[str]
+    foreign_keys: List[str]
+
+
+def split_table_definition(create_statement: str) -> TableDefinition:
+    """Separate the secondary keys and the foreign keys from the output of
+    SHOW CREATE TABLE. Keys on an auto increment column are kept in the
+    table definition, since mysql needs them.
+    """
+    lines = create_statement.split("\n")
+    # Column and key definitions are indented: the table options that follow
+    # them can span several lines, like a PARTITION BY clause
+    end = next(
+        index for index, line in enumerate(lines) if index and line.startswith(")")
+    )
+    head, tail = lines[0], "\n".join(lines[end:])
+    definitions = [line.strip().rstrip(",") for line in lines[1:end]]
+    auto_increment_columns = [
+        match.group(1)
+        for match in map(AUTO_INCREMENT_COLUMN.match, definitions)
+        if match
+    ]
+    kept, keys, foreign_keys = [], [], []
+    for definition in definitions:
+        if FOREIGN_KEY_DEFINITION.match(definition):
+            foreign_keys.append(definition)
+        elif KEY_DEFINITION.match(definition) and not any(
+            f"({column}" in definition for column in auto_increment_columns
+        ):
+            keys.append(definition)
+        else:
+            kept.append(definition)
+    create = "\n".join([head, ",\n".join(f"  {el}" for el in kept), tail])
+    return TableDefinition(create, keys, foreign_keys)
+
+
+def run_concurrently(
+    tasks: List[Callable[[pymysql.cursors.Cursor], T]], workers: int, database: str
+) -> List[T]:
+    """Run the given tasks on up to `workers` concurrent connections to `database`,
+    in the given order, and return their results.
+    Connections are not taken from the pool, since their session settings are changed.
+    """
+    to_do: "queue.Queue[Tuple[int, Callable]]" = queue.Queue()
+    for item in enumerate(tasks):
+        to_do.put(item)
+    results: Dict[int, T] = {}
+    failed = threading.Event()
+
+    def work():
+        client = get_mysql_client(database=database, autocommit=True)
+        try:
+            client.execute(COPY_SESSION_SETTINGS)
+            while not failed.is_set():
+                try:
+                    index, task = to_do.get_nowait()
+                except queue.Empty:
+                    return
+                results[index] = task(client)
+        except BaseException:
+            failed.set()  # Make other workers stop early
+            raise
+        finally:
+            client.connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work) for _ in range(min(workers, len(tasks)))]
+        for future in futures:
+            future.result()
+    return [results[index] for index in range(len(tasks))]
+
+
+def copy_table_data(source: str, table: str) -> Callable[..., TableCopy]:
+    def task(client: pymysql.cursors.Cursor) -> TableCopy:
+        start = time.time()
+        rows = client.execute(
+            f"INSERT INTO `{table}` SELECT * FROM `{source}`.`{table}`"
+        )
+        result = TableCopy(table, rows, time.time() - start)
+        logger.info(
+            f"Copied {table}: {rows} rows in {result.seconds:.1f}s "
+            f"({result.rows_per_second:.0f} rows/s)"
+        )
+        return result
+
+    return task
+
+
+def execute(*statements: str) -> Callable[[pymysql.cursors.Cursor], None]:
+    def task(client: pymysql.cursors.Cursor):
+        for statement in statements:
+            client.execute(statement)
+
+    return task
+
+
+def get_add_keys_statements(table: str, keys: List[str]) -> List[str]:
+    """Return the ALTER TABLE statements that add the given keys to `table`.
+    InnoDB can only add one FULLTEXT key at a time: each one gets its own statement.
+    """
+    fulltext_keys = [el for el in keys if el.startswith("FULLTEXT ")]
+    other_keys = [el for el in keys if not el.startswith("FULLTEXT ")]
+    groups = ([other_keys] if other_keys else []) + [[el] for el in fulltext_keys]
+    return [
+        f"ALTER TABLE `{table}` " + ", ".join(f"ADD {el}" for el in group)
+        for group in groups
+    ]
+
+
+@contextmanager
+def source_tables_locked(source: str, tables: List[str]) -> Iterator[None]:
+    """Block writes to the given tables of the `source` database.
+    Other connections can still read them.
+    """
+    if not tables:
+        yield
+        return
+    client = get_mysql_client(autocommit=True)
+    try:
+        client.execute(
+            "FLUSH TABLES "
+            + ", ".join(f"`{source}`.`{table}`" for table in tables)
+            + " WITH READ LOCK"
+        )
+        yield
+        client.execute("UNLOCK TABLES")
+    finally:
+        client.connection.close()
+
+
+def copyable_definition(source: str, definition: str) -> str:
+    """Remove the definer: the user might not exist. References to the
+    source database are qualified: make them point to the destination.
+    """
+    return re.sub(r"DEFINER=\S+ ", "", definition.replace(f"`{source}`.", ""))
+
+
+def copy_views(source: str, destination: str, views: List[str]):
+    """Create the given views in the destination database. Views can depend
+    on each other: retry the failed ones until no progress is made.
+    """
+    with mysql_cursor() as cursor:
+        definitions = {}
+        for view in views:
+            cursor.execute(f"SHOW CREATE VIEW `{source}`.`{view}`")
+            definitions[view] = copyable_definition(source, cursor.fetchone()[1])
+    client = get_mysql_client(database=destination, autocommit=True)
+    try:
+        while definitions:
+            errors = {}
+            for view, definition in list(definitions.items()):
+                try:
+                    client.execute(definition)
+                    del definitions[view]
+                except pymysql.err.ProgrammingError as exc:
+                    errors[view] = exc
+            if errors and len(errors) == len(definitions):
+                raise next(iter(errors.values()))
+    finally:
+        client.connection.close()
+
+
+class ProgramDefinition(NamedTuple):
+    name: str
+    #: The sql_mode the program was created with, that affects its behaviour
+    sql_mode: str
+    create: str
+
+
+def get_program_definitions(
+    source: str, exclude_tables: Iterable[str] = ()
+) -> Dict[str, List[ProgramDefinition]]:
+    """Return the definitions of the stored routines, triggers and events
+    of the `source` database. Triggers on tables in `exclude_tables` are left out.
+    Triggers on the same table and event are listed in the order they fire.
+    """
+    result: Dict[str, List[ProgramDefinition]] = {
+        "routines": [],
+        "triggers": [],
+        "events": [],
+    }
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SELECT ROUTINE_TYPE, ROUTINE_NAME FROM information_schema.ROUTINES "
+            "WHERE ROUTINE_SCHEMA = %s ORDER BY ROUTINE_NAME",
+            (source,),
+        )
+        for kind, name in cursor.fetchall():
+            cursor.execute(f"SHOW CREATE {kind} `{source}`.`{name}`")
+            _, sql_mode, create, *_ = cursor.fetchone()
+            result["routines"].append(ProgramDefinition(name, sql_mode, create))
+        cursor.execute(
+            "SELECT TRIGGER_NAME, EVENT_OBJECT_TABLE FROM information_schema.TRIGGERS "
+            "WHERE TRIGGER_SCHEMA = %s ORDER BY EVENT_OBJECT_TABLE, ACTION_ORDER",
+            (source,),
+        )
+        for name, table in cursor.fetchall():
+            if table in exclude_tables:
+                continue
+            cursor.execute(f"SHOW CREATE TRIGGER `{source}`.`{name}`")
+            _, sql_mode, create, *_ = cursor.fetchone()
+            result["triggers"].append(ProgramDefinition(name, sql_mode, create))
+        cursor.execute(
+            "SELECT EVENT_NAME FROM information_schema.EVENTS "
+            "WHERE EVENT_SCHEMA = %s ORDER BY EVENT_NAME",
+            (source,),
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f"SHOW CREATE EVENT `{source}`.`{name}`")
+            _, sql_mode, _, create, *_ = cursor.fetchone()
+            result["events"].append(ProgramDefinition(name, sql_mode, create))
+    return result
+
+
+def create_programs(
+    source: str, destination: str, programs: List[ProgramDefinition]
+) -> None:
+    """Create the given stored routines, triggers or events in the destination
+    database, each with the sql_mode it was created with.
+    """
+    if not programs:
+        return
+    client = get_mysql_client(database=destination, autocommit=True)
+    try:
+        for program in programs:
+            client.execute("SET SESSION sql_mode = %s", (program.sql_mode,))
+            client.execute(copyable_definition(source, program.create))
+    finally:
+        client.connection.close()
+
+
+def copy_database(
+    source: str, destination: str, workers: int = 4, exclude_tables: Iterable[str] = (),
+) -> List[TableCopy]:
+    """Copy the tables, views, stored routines, triggers and events of the
+    `source` database to the `destination` one, that is created.
+    Tables in `exclude_tables` are left out.
+    Return statistics about each copied table.
+
+    Writes to the source tables wait until their rows have been copied.
+    """
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME, TABLE_TYPE FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s ORDER BY DATA_LENGTH DESC",
+            (source,),
+        )
+        objects = cursor.fetchall()
+        if not objects:
+            cursor.execute("SHOW DATABASES LIKE %s", (source,))
+            if not cursor.fetchone():
+                raise ValueError(f"Database {source} does not exist")
+        objects = [el for el in objects if el[0] not in exclude_tables]
+        tables = [name for name, kind in objects if kind == "BASE TABLE"]
+        views = [name for name, kind in objects if kind == "VIEW"]
+        definitions = {}
+        for table in tables:
+            cursor.execute(f"SHOW CREATE TABLE `{source}`.`{table}`")
+            definitions[table] = split_table_definition(cursor.fetchone()[1])
+    programs = get_program_definitions(source, exclude_tables)
+
+    create_database(destination)
+    logger.info(f"Creating {len(tables)} tables in {destination}")
+    run_concurrently(
+        [execute(definitions[table].create) for table in tables], workers, destination
+    )
+    # Tables are sorted biggest first, so that workers finish at about the same time
+    with source_tables_locked(source, tables):
+        results = run_concurrently(
+            [copy_table_data(source, table) for table in tables], workers, destination
+        )
+    logger.info("Adding indexes")
+    run_concurrently(
+        [
+            execute(*get_add_keys_statements(table, keys))
+            for table, (_, keys, _) in definitions.items()
+            if keys
+        ],
+        workers,
+        destination,
+    )
+    # Foreign key checks are disabled: adding them only changes metadata
+    run_concurrently(
+        [
+            execute(
+                f"ALTER TABLE `{table}` "
+                + ", ".join(f"ADD {el}" for el in foreign_keys)
+            )
+            for table, (_, _, foreign_keys) in definitions.items()
+            if foreign_keys
+        ],
+        1,
+        destination,
+    )
+    # Views can use stored functions
+    create_programs(source, destination, programs["routines"])
+    if views:
+        copy_views(source, destination, views)
+    create_programs(source, destination, programs["triggers"])
+    create_programs(source, destination, programs["events"])
+    return results
@@ -0,0 +1,161 @@
+"""Capture slow queries on the running mysql server and summarize them.
+
+The slow query log is switched on at runtime with `SET GLOBAL`, writing to
+the `mysql.slow_log` table so that it can be read with a query: the server
+doesn't need to be restarted, and the setting is lost when it is.
+
+Queries are grouped by fingerprint: the query text with literal values
+replaced by placeholders, so that the same ORM query with different
+arguments is counted once.
+"""
+from datetime import timedelta
+from derex.runner.mysql import mysql_cursor
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Union
+
+import re
+
+
+SORT_KEYS = {
+    "time": lambda el: el.total_time,
+    "count": lambda el: el.calls,
+    "rows": lambda el: el.rows_examined,
+}
+
+STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"", re.DOTALL)
+COMMENTS = re.compile(r"/\*.*?\*/|--\s[^\n]*|#[^\n]*", re.DOTALL)
+NUMBERS = re.compile(r"\b0x[0-9a-f]+\b|-?\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b")
+IN_LISTS = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+VALUES_LISTS = re.compile(r"\bvalues\s*\([^)]*\)(?:\s*,\s*\([^)]*\))*")
+WHITESPACE = re.compile(r"\s+")
+
+
+class SlowQuery(NamedTuple):
+    sql: str
+    database: str
+    #: Seconds
+    query_time: float
+    lock_time: float
+    rows_sent: int
+    rows_examined: int
+
+
+class QueryDigest(NamedTuple):
+    fingerprint: str
+    calls: int
+    #: Seconds
+    total_time: float
+    max_time: float
+    rows_examined: int
+    rows_sent: int
+    #: The slowest query with this fingerprint
+    example: str
+
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.calls
+
+
+def get_slow_log_settings() -> Dict[str, str]:
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SHOW GLOBAL VARIABLES WHERE Variable_name IN ('slow_query_log', "
+            "'log_output', 'long_query_time', 'log_queries_not_using_indexes')"
+        )
+        return dict(cursor.fetchall())
+
+
+def enable_slow_log(long_query_time: float, not_using_indexes: bool = False):
+    """Log queries taking longer than `long_query_time` seconds to the
+    `mysql.slow_log` table. If `not_using_indexes` is True also log queries
+    that read all rows of a table.
+    The time threshold only applies to connections opened from now on.
+    """
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SET GLOBAL log_output = 'TABLE', long_query_time = %s, "
+            "log_queries_not_using_indexes = %s, slow_query_log = 1",
+            (long_query_time, "ON" if not_using_indexes else "OFF"),
+        )
+
+
+def disable_slow_log():
+    with mysql_cursor() as cursor:
+        cursor.execute("SET GLOBAL slow_query_log = 0")
+
+
+def clear_slow_log():
+    with mysql_cursor() as cursor:
+        cursor.execute("TRUNCATE TABLE mysql.slow_log")
+
+
+def to_seconds(value: Union[timedelta, float]) -> float:
+    """The columns of mysql.slow_log have the TIME type"""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def fetch_slow_queries(database: Optional[str] = None) -> List[SlowQuery]:
+    """Return the queries in the slow log, only the ones run on `database`
+    if it's given.
+    """
+    query = (
+        "SELECT sql_text, db, query_time, lock_time, rows_sent, rows_examined "
+        "FROM mysql.slow_log"
+    )
+    with mysql_cursor() as cursor:
+        if database is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query + " WHERE db = %s", (database,))
+        rows = cursor.fetchall()
+    return [
+        SlowQuery(
+            sql.decode(errors="replace") if isinstance(sql, bytes) else sql,
+            db,
+            to_seconds(query_time),
+            to_seconds(lock_time),
+            int(rows_sent),
+            int(rows_examined),
+        )
+        for sql, db, query_time, lock_time, rows_sent, rows_examined in rows
+    ]
+
+
+def fingerprint(sql: str) -> str:
+    """Normalize a query so that the same query with different values has
+    the same fingerprint.
+    """
+    result = STRINGS.sub("?", sql)
+    result = COMMENTS.sub(" ", result).lower()
+    result = NUMBERS.sub("?", result)
+    result = WHITESPACE.sub(" ", result).strip().rstrip(";").strip()
+    result = IN_LISTS.sub("in (?+)", result)
+    return VALUES_LISTS.sub("values (?+)", result)
+
+
+def digest(queries: Iterable[SlowQuery], sort: str = "time") -> List[QueryDigest]:
+    """Group the given queries by fingerprint, sorted by total time,
+    count or rows examined depending on `sort`.
+    """
+    groups: Dict[str, List[SlowQuery]] = {}
+    for query in queries:
+        groups.setdefault(fingerprint(query.sql), []).append(query)
+    result = [
+        QueryDigest(
+            key,
+            len(group),
+            sum(el.query_time for el in group),
+            max(el.query_time for el in group),
+            sum(el.rows_examined for el in group),
+            sum(el.rows_sent for el in group),
+            max(group, key=lambda el: el.query_time).sql,
+        )
+        for key, group in groups.items()
+    ]
+    return sorted(result, key=SORT_KEYS[sort], reverse=True)
@@ -0,0 +1,141 @@
+"""Statistics about the tables of a mysql database: sizes, row estimates,
+unused indexes and fragmentation, and online rebuilds of fragmented tables.
+
+Sizes and row counts come from `information_schema`, where InnoDB reports
+estimates: they're cheap to get even for huge tables, but can be off by a
+few percent. Index usage comes from `performance_schema`, and only covers
+the time since the server was started.
+"""
+from derex.runner.mysql import mysql_cursor
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import logging
+import pymysql
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TableStats(NamedTuple):
+    name: str
+    engine: str
+    #: An estimate for InnoDB tables
+    rows: int
+    data_size: int
+    index_size: int
+    #: Space allocated to the table but not used
+    free_size: int
+
+    @property
+    def size(self) -> int:
+        return self.data_size + self.index_size
+
+    @property
+    def fragmentation(self) -> float:
+        """The fraction of the space allocated to the table that is not used"""
+        allocated = self.size + self.free_size
+        return self.free_size / allocated if allocated else 0
+
+
+class UnusedIndex(NamedTuple):
+    table: str
+    index_name: str
+
+
+class OptimizeResult(NamedTuple):
+    table: str
+    #: Bytes of free space gained back
+    freed: int
+    seconds: float
+    error: Optional[str] = None
+
+
+def get_table_stats(database: str) -> List[TableStats]:
+    """Return statistics about the tables of `database`, biggest first.
+    """
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME, ENGINE, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH, DATA_FREE "
+            "FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' "
+            "ORDER BY DATA_LENGTH + INDEX_LENGTH DESC, TABLE_NAME",
+            (database,),
+        )
+        rows = cursor.fetchall()
+    return [
+        TableStats(name, engine or "", *(int(el or 0) for el in numbers))
+        for name, engine, *numbers in rows
+    ]
+
+
+def get_unused_indexes(database: str) -> Optional[List[UnusedIndex]]:
+    """Return the secondary indexes of `database` that were never used to
+    read or write rows since the server started, or None if
+    performance_schema is disabled.
+    """
+    with mysql_cursor() as cursor:
+        cursor.execute("SELECT @@performance_schema")
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute(
+            "SELECT OBJECT_NAME, INDEX_NAME "
+            "FROM performance_schema.table_io_waits_summary_by_index_usage "
+            "WHERE OBJECT_SCHEMA = %s AND INDEX_NAME IS NOT NULL "
+            "AND INDEX_NAME != 'PRIMARY' AND COUNT_STAR = 0 "
+            "ORDER BY OBJECT_NAME, INDEX_NAME",
+            (database,),
+        )
+        return [UnusedIndex(*row) for row in cursor.fetchall()]
+
+
+def get_tables_to_optimize(
+    stats: List[TableStats], min_free: int, min_fragmentation: float, limit: int
+) -> List[TableStats]:
+    """Pick the InnoDB tables wasting at least `min_free` bytes and
+    `min_fragmentation` of their space, the ones wasting most space first.
+    """
+    candidates = [
+        el
+        for el in stats
+        if el.engine == "InnoDB"
+        and el.free_size >= min_free
+        and el.fragmentation >= min_fragmentation
+    ]
+    return sorted(candidates, key=lambda el: el.free_size, reverse=True)[:limit]
+
+
+def get_free_size(database: str, table: str) -> int:
+    with mysql_cursor() as cursor:
+        cursor.execute(
+            "SELECT DATA_FREE FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+            (database, table),
+        )
+        return int(cursor.fetchone()[0] or 0)
+
+
+def optimize_table(database: str, table: str) -> OptimizeResult:
+    """Rebuild an InnoDB table to give back its free space.
+    The rebuild is online: reads and writes to the table can go on meanwhile.
+    If mysql can't rebuild the table online (for instance because it has a
+    FULLTEXT index) it's left untouched and the error is returned.
+    """
+    before = get_free_size(database, table)
+    start = time.time()
+    try:
+        with mysql_cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE `{database}`.`{table}` "
+                "ENGINE=InnoDB, ALGORITHM=INPLACE, LOCK=NONE"
+            )
+    except pymysql.err.MySQLError as exc:
+        logger.warning(f"Could not rebuild {table} online: {exc}")
+        return OptimizeResult(table, 0, time.time() - start, str(exc))
+    result = OptimizeResult(
+        table, max(before - get_free_size(database, table), 0), time.time() - start
+    )
+    logger.info(f"Rebuilt {table} in {result.seconds:.1f}s")
+    return result
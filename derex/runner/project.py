@@ -9,6 +9,7 @@ from enum import IntEnum
 from logging import getLogger
 from pathlib import Path
 from typing import Dict
+from typing import NamedTuple
 from typing import Optional
 from typing import Union
 
@@ -30,6 +31,21 @@ class ProjectRunMode(Enum):
     production = "production"
 
 
+#: Gunicorn worker classes that can be used to run the LMS and CMS. The C MySQLdb
+#: driver blocks the whole process on queries: the gevent worker is only usable
+#: with the pure python PyMySQL driver, that derex installs in its place
+GUNICORN_WORKER_CLASSES = ("sync", "gthread", "gevent")
+
+
+class GunicornOptions(NamedTuple):
+    """Options gunicorn is run with in production mode"""
+
+    worker_class: str = "gthread"
+    workers: int = 2
+    #: Only used by the gthread worker class
+    threads: int = 4
+
+
 class Project:
     """Represents a derex.runner project, i.e. a directory with a
     `derex.config.yaml` file and optionally a "themes", "settings" and
@@ -71,6 +87,10 @@ class Project:
     # The image name of the image that includes requirements
     requirements_image_name: str
 
+    # The image name of the image that includes requirements and compiled assets,
+    # if the project has requirements and `compile_assets` is enabled
+    assets_image_name: Optional[str] = None
+
     # The image name of the image that includes requirements and themes
     themes_image_name: str
 
@@ -89,6 +109,9 @@ class Project:
     # Keys are paths on the host system and values are path inside the container
     requirements_volumes: Optional[Dict[str, str]] = None
 
+    # Options to run gunicorn in production mode
+    gunicorn: GunicornOptions
+
     # Enum containing possible settings modules
     _available_settings = None
 
@@ -215,6 +238,7 @@ class Project:
             )
         self.name = self.config["project_name"]
         self.image_prefix = self.config.get("image_prefix", f"{self.name}/openedx")
+        self.gunicorn = get_gunicorn_options(self.config.get("gunicorn") or {})
         local_compose = self.root / "docker-compose.yml"
         if local_compose.is_file():
             self.local_compose = local_compose
@@ -241,15 +265,31 @@ class Project:
         else:
             self.requirements_image_name = self.base_image
 
+        if self.requirements_dir is not None and self.config.get("compile_assets"):
+            # The compiled assets only depend on the installed requirements and
+            # the base image, so the tag can be computed without looking at images
+            img_hash = hashlib.sha256(
+                f"{self.requirements_image_name}{self.base_image}".encode()
+            ).hexdigest()
+            self.assets_image_name = f"{self.image_prefix}-assets:{img_hash[:6]}"
+
         themes_dir = self.root / "themes"
         if themes_dir.is_dir():
             self.themes_dir = themes_dir
             img_hash = get_dir_hash(
                 self.themes_dir
             )  # XXX some files are generated. We should ignore them when we hash the directory
+            # The themes image also contains the requirements: its tag must change
+            # when they change, so that an existing tag can be trusted to be up to date
+            img_hash = hashlib.sha256(
+                f"{img_hash}{self.requirements_image_name}{self.final_base_image}"
+                f"{self.assets_image_name or ''}".encode()
+            ).hexdigest()
             self.themes_image_name = f"{self.image_prefix}-themes:{img_hash[:6]}"
         else:
-            self.themes_image_name = self.requirements_image_name
+            self.themes_image_name = (
+                self.assets_image_name or self.requirements_image_name
+            )
 
         settings_dir = self.root / "settings"
         if settings_dir.is_dir():
@@ -403,6 +443,22 @@ def get_requirements_hash(path: Path) -> str:
     return hasher.hexdigest()
 
 
+def get_gunicorn_options(config: Dict) -> GunicornOptions:
+    """Validate the `gunicorn` section of the project configuration.
+    """
+    unknown = set(config) - set(GunicornOptions._fields)
+    if unknown:
+        raise ValueError(f"Unknown gunicorn options: {', '.join(sorted(unknown))}")
+    options = GunicornOptions(**config)
+    if options.worker_class not in GUNICORN_WORKER_CLASSES:
+        raise ValueError(
+            f"Gunicorn worker_class must be one of {', '.join(GUNICORN_WORKER_CLASSES)}"
+        )
+    if not all(isinstance(el, int) and el > 0 for el in options[1:]):
+        raise ValueError("Gunicorn workers and threads must be positive integers")
+    return options
+
+
 def find_project_root(path: Path) -> Path:
     """Find the project directory walking up the filesystem starting on the
     given path until a configuration file is found.
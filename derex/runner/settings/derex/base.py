@@ -21,6 +21,7 @@ _settings_modules = [
     "caches",
     "logging",
     "staticfiles",
+    "mako",
     "storages",
     "celery",
     "email",
@@ -0,0 +1,4 @@
+# Use the Mako templates compiled when the image was built, if present
+MAKO_MODULE_DIR_PRECOMPILED = Path("/openedx/mako_modules") / SERVICE_VARIANT
+if MAKO_MODULE_DIR_PRECOMPILED.isdir():
+    MAKO_MODULE_DIR = MAKO_MODULE_DIR_PRECOMPILED
@@ -0,0 +1,276 @@
+"""Snapshots of the data of the derex services, to go back to a known state
+of mysql, mongodb and minio at once.
+
+A snapshot is taken with the services that use the volumes stopped, so that
+their files are consistent. By default every volume is copied to a new docker
+volume by `cp --reflink=auto` in a helper container: on filesystems that
+support it (like btrfs and XFS) data blocks are shared until they're
+modified, and taking or restoring a snapshot takes seconds whatever the size
+of the data. Hard links can't be used: database servers modify their files in
+place, and the change would show up in the snapshot too.
+
+Snapshots can also be stored as zstd compressed tar archives in the derex
+data directory, for instance when docker storage is on a filesystem without
+reflinks, where volume snapshots are full copies.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from derex.runner.docker import client as docker_client
+from derex.runner.image_transfer import COPY_CHUNK_SIZE
+from derex.runner.image_transfer import zstd_command
+from derex.runner.local_appdir import DEREX_DIR
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import docker
+import logging
+import re
+import shutil
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+SNAPSHOT_VOLUMES = ("derex_mysql", "derex_mongodb", "derex_minio")
+#: Image used to copy data between volumes: it needs GNU cp for --reflink
+HELPER_IMAGE = "debian:buster-slim"
+SNAPSHOT_LABEL = "derex.snapshot"
+SNAPSHOTS_DIR = DEREX_DIR / "snapshots"
+SNAPSHOT_NAME = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_.-]*$")
+ARCHIVE_SUFFIX = ".tar.zst"
+
+COPY_VOLUME_SCRIPT = "find /to -mindepth 1 -delete && cp -a --reflink=auto /from/. /to/"
+EMPTY_VOLUME_SCRIPT = "find /data -mindepth 1 -delete"
+
+
+class Snapshot(NamedTuple):
+    name: str
+    #: Either "volume" or "archive"
+    kind: str
+    created: datetime
+    #: Compressed size of archive snapshots, unknown for volume ones
+    size: Optional[int] = None
+
+
+def validate_snapshot_name(name: str):
+    if not SNAPSHOT_NAME.match(name):
+        raise ValueError(
+            f'Invalid snapshot name "{name}": use letters, digits, "_", "." and "-"'
+        )
+
+
+def get_snapshot_volume_name(name: str, volume: str) -> str:
+    return f"{volume}_snapshot_{name}"
+
+
+def get_archive_path(name: str, volume: str) -> Path:
+    return SNAPSHOTS_DIR / name / f"{volume}{ARCHIVE_SUFFIX}"
+
+
+def list_snapshots() -> List[Snapshot]:
+    """Return all snapshots, oldest first.
+    """
+    snapshots: Dict[str, Snapshot] = {}
+    for volume in docker_client.volumes.list(filters={"label": SNAPSHOT_LABEL}):
+        labels = volume.attrs.get("Labels") or {}
+        name = labels[SNAPSHOT_LABEL]
+        created = datetime.fromtimestamp(float(labels[f"{SNAPSHOT_LABEL}.created"]))
+        snapshots[name] = Snapshot(name, "volume", created)
+    if SNAPSHOTS_DIR.exists():
+        for directory in SNAPSHOTS_DIR.iterdir():
+            archives = list(directory.glob(f"*{ARCHIVE_SUFFIX}"))
+            if not archives or directory.name in snapshots:
+                continue
+            snapshots[directory.name] = Snapshot(
+                directory.name,
+                "archive",
+                datetime.fromtimestamp(min(el.stat().st_mtime for el in archives)),
+                sum(el.stat().st_size for el in archives),
+            )
+    return sorted(snapshots.values(), key=lambda el: el.created)
+
+
+def get_snapshot(name: str) -> Optional[Snapshot]:
+    for snapshot in list_snapshots():
+        if snapshot.name == name:
+            return snapshot
+    return None
+
+
+@contextmanager
+def services_stopped(volumes: List[str]) -> Iterator[List[str]]:
+    """Stop the running containers using the given volumes, and start them
+    again on exit. Yield the names of the stopped containers.
+    """
+    containers: Dict[str, docker.models.containers.Container] = {}
+    for volume in volumes:
+        for container in docker_client.containers.list(filters={"volume": volume}):
+            containers[container.name] = container
+    for container in containers.values():
+        logger.info(f"Stopping {container.name}")
+        container.stop()
+    try:
+        yield sorted(containers)
+    finally:
+        for container in containers.values():
+            logger.info(f"Starting {container.name}")
+            container.start()
+
+
+def run_helper(script: str, volumes: Dict[str, Dict[str, str]]):
+    try:
+        docker_client.containers.run(
+            HELPER_IMAGE, ["sh", "-c", script], volumes=volumes, remove=True
+        )
+    except docker.errors.ContainerError as exc:
+        raise RuntimeError(
+            f"Error copying volume data: {exc.stderr.decode(errors='replace')}"
+        )
+
+
+def copy_volume(source: str, destination: str):
+    """Replace the content of the `destination` volume with a copy of the
+    `source` one, sharing data blocks if the filesystem supports it.
+    """
+    logger.info(f"Copying volume {source} to {destination}")
+    run_helper(
+        COPY_VOLUME_SCRIPT,
+        {
+            source: {"bind": "/from", "mode": "ro"},
+            destination: {"bind": "/to", "mode": "rw"},
+        },
+    )
+
+
+@contextmanager
+def volume_container(volume: str) -> Iterator[docker.models.containers.Container]:
+    """Create (without starting it) a helper container with `volume` mounted
+    on /data, to copy files from and to it.
+    """
+    container = docker_client.containers.create(
+        HELPER_IMAGE, volumes={volume: {"bind": "/data", "mode": "rw"}}
+    )
+    try:
+        yield container
+    finally:
+        container.remove(force=True)
+
+
+def archive_volume(volume: str, path: Path):
+    """Store the content of `volume` in a zstd compressed tar archive at `path`.
+    """
+    logger.info(f"Archiving volume {volume} to {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with volume_container(volume) as container, open(path, "wb") as output:
+        chunks, _ = docker_client.api.get_archive(
+            container.id, "/data", COPY_CHUNK_SIZE
+        )
+        process = subprocess.Popen(
+            zstd_command("-c"), stdin=subprocess.PIPE, stdout=output
+        )
+        assert process.stdin is not None
+        stdin = process.stdin
+        try:
+            for chunk in chunks:
+                stdin.write(chunk)
+        finally:
+            stdin.close()
+            returncode = process.wait()
+    if returncode:
+        raise RuntimeError(f"zstd exited with status {returncode}")
+
+
+def extract_volume(path: Path, volume: str):
+    """Replace the content of `volume` with the archive at `path`.
+    """
+    logger.info(f"Restoring volume {volume} from {path}")
+    run_helper(EMPTY_VOLUME_SCRIPT, {volume: {"bind": "/data", "mode": "rw"}})
+    with volume_container(volume) as container:
+        process = subprocess.Popen(
+            zstd_command("-d", "-c", str(path)), stdout=subprocess.PIPE
+        )
+        assert process.stdout is not None
+        stdout = process.stdout
+        try:
+            # The archive entries are relative to the parent of /data
+            docker_client.api.put_archive(
+                container.id, "/", iter(lambda: stdout.read(COPY_CHUNK_SIZE), b""),
+            )
+        finally:
+            stdout.close()
+            returncode = process.wait()
+    if returncode:
+        raise RuntimeError(f"zstd exited with status {returncode}")
+
+
+def run_on_volumes(function: Callable[[str], None]):
+    """Call `function` with each snapshot volume concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=len(SNAPSHOT_VOLUMES)) as executor:
+        futures = [executor.submit(function, volume) for volume in SNAPSHOT_VOLUMES]
+        for future in futures:
+            future.result()
+
+
+def create_snapshot(name: str, archive: bool = False) -> Snapshot:
+    """Take a snapshot of the services data. If `archive` is True store it
+    as compressed archives instead of docker volumes.
+    """
+    validate_snapshot_name(name)
+    if get_snapshot(name) is not None:
+        raise ValueError(f"Snapshot {name} already exists")
+    created = datetime.now()
+
+    def snapshot_volume(volume: str):
+        if archive:
+            archive_volume(volume, get_archive_path(name, volume))
+            return
+        destination = get_snapshot_volume_name(name, volume)
+        docker_client.volumes.create(
+            destination,
+            labels={
+                SNAPSHOT_LABEL: name,
+                f"{SNAPSHOT_LABEL}.volume": volume,
+                f"{SNAPSHOT_LABEL}.created": str(created.timestamp()),
+            },
+        )
+        copy_volume(volume, destination)
+
+    with services_stopped(list(SNAPSHOT_VOLUMES)):
+        try:
+            run_on_volumes(snapshot_volume)
+        except BaseException:
+            delete_snapshot(name)  # Don't leave an incomplete snapshot around
+            raise
+    return get_snapshot(name) or Snapshot(name, "volume", created)
+
+
+def restore_snapshot(name: str) -> Snapshot:
+    """Replace the services data with the content of the given snapshot.
+    """
+    snapshot = get_snapshot(name)
+    if snapshot is None:
+        raise ValueError(f"Snapshot {name} does not exist")
+
+    def restore_volume(volume: str):
+        if snapshot.kind == "archive":
+            extract_volume(get_archive_path(name, volume), volume)
+        else:
+            copy_volume(get_snapshot_volume_name(name, volume), volume)
+
+    with services_stopped(list(SNAPSHOT_VOLUMES)):
+        run_on_volumes(restore_volume)
+    return snapshot
+
+
+def delete_snapshot(name: str):
+    for volume in docker_client.volumes.list(filters={"label": SNAPSHOT_LABEL}):
+        if (volume.attrs.get("Labels") or {}).get(SNAPSHOT_LABEL) == name:
+            volume.remove()
+    if (SNAPSHOTS_DIR / name).exists():
+        shutil.rmtree(str(SNAPSHOTS_DIR / name))
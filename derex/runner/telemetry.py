@@ -0,0 +1,217 @@
+"""Collect timing and caching information about docker image builds.
+
+Each build produces a JSON report stored in the `builds` directory of the
+project private dir (or of the derex data dir for builds that do not belong
+to a project). Reports of successive builds can be compared to spot
+regressions.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import datetime
+import json
+import logging
+import re
+import time
+
+
+logger = logging.getLogger(__name__)
+BUILDS_DIR = "builds"
+CLASSIC_STEP_RE = re.compile(r"^Step (\d+)/\d+ : (.*)$")
+BUILDKIT_VERTEX_RE = re.compile(r"^#(\d+) \[(.+?)\] (.*)$")
+BUILDKIT_STATUS_RE = re.compile(r"^#(\d+) (CACHED|DONE ([\d.]+)s|ERROR.*)$")
+# The buildkit vertex that sends the build context to the daemon
+BUILDKIT_CONTEXT_VERTEX = "internal] load build context"
+
+
+class BuildTelemetry:
+    """Accumulate information about a single image build.
+    Feed it the output of the build as it comes, and save it when done.
+    """
+
+    def __init__(self, name: str, tag: str):
+        self.name = name
+        self.tag = tag
+        self.started = time.time()
+        self.duration: Optional[float] = None
+        self.success = False
+        self.context_size: Optional[int] = None
+        self.context_upload_time: Optional[float] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.layers: List[Dict[str, Any]] = []
+        self.metrics: Dict[str, float] = {}
+        self._buildkit_steps: Dict[str, Dict[str, Any]] = {}
+
+    def record_context(self, size: int, upload_time: float):
+        self.context_size = size
+        self.context_upload_time = upload_time
+
+    def _close_current_step(self, now: float):
+        if self.steps and "started" in self.steps[-1]:
+            self.steps[-1]["duration"] = now - self.steps[-1].pop("started")
+
+    def feed_docker_line(self, line: Dict[str, Any]):
+        """Process a decoded line of the JSON stream returned by the classic
+        docker builder.
+        """
+        stream = line.get("stream", "").strip()
+        now = time.time()
+        match = CLASSIC_STEP_RE.match(stream)
+        if match:
+            self._close_current_step(now)
+            self.steps.append(
+                {
+                    "step": match.group(2),
+                    "cached": False,
+                    "duration": None,
+                    "started": now,
+                }
+            )
+        elif stream == "---> Using cache" and self.steps:
+            self.steps[-1]["cached"] = True
+
+    def feed_buildkit_line(self, line: str):
+        """Process a line of `docker buildx build --progress=plain` output.
+        """
+        line = line.strip()
+        match = BUILDKIT_VERTEX_RE.match(line)
+        if match:
+            vertex, stage, step = match.groups()
+            if vertex not in self._buildkit_steps:
+                self._buildkit_steps[vertex] = {
+                    "step": f"[{stage}] {step}",
+                    "cached": False,
+                    "duration": None,
+                }
+                self.steps.append(self._buildkit_steps[vertex])
+            return
+        match = BUILDKIT_STATUS_RE.match(line)
+        if not match or match.group(1) not in self._buildkit_steps:
+            return
+        step = self._buildkit_steps[match.group(1)]
+        if match.group(2) == "CACHED":
+            step["cached"] = True
+        elif match.group(3) is not None:
+            step["duration"] = float(match.group(3))
+            if BUILDKIT_CONTEXT_VERTEX in step["step"]:
+                self.context_upload_time = step["duration"]
+
+    def record_layers(self, layers: Iterable[Dict[str, Any]]):
+        """Record the size of the image layers, as returned by `docker history`.
+        """
+        self.layers = [
+            {"created_by": layer.get("CreatedBy", ""), "size": layer.get("Size", 0)}
+            for layer in layers
+        ]
+
+    def record_metric(self, name: str, value: float):
+        """Record a measurement taken during the build, like the startup time
+        of a program in the built image.
+        """
+        self.metrics[name] = value
+
+    def finish(self, success: bool = True):
+        """Mark the build as finished.
+        """
+        now = time.time()
+        self._close_current_step(now)
+        self.duration = now - self.started
+        self.success = success
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "tag": self.tag,
+            "started": self.started,
+            "duration": self.duration,
+            "success": self.success,
+            "context_size": self.context_size,
+            "context_upload_time": self.context_upload_time,
+            "steps": self.steps,
+            "layers": self.layers,
+            "metrics": self.metrics,
+        }
+
+    def save(self, directory: Path) -> Path:
+        """Write the report as a JSON file in the given directory and return its path.
+        """
+        if not directory.exists():
+            directory.mkdir(parents=True)
+        timestamp = datetime.datetime.fromtimestamp(self.started).strftime(
+            "%Y%m%dT%H%M%S"
+        )
+        path = directory / f"{self.name}-{timestamp}.json"
+        path.write_text(json.dumps(self.as_dict(), indent=2))
+        return path
+
+
+@contextmanager
+def recording_build(directory: Path, name: str, tag: str) -> Iterator[BuildTelemetry]:
+    """Context manager that yields a `BuildTelemetry` object and saves its
+    report in `directory` when the build is over, whether it succeeded or not.
+    """
+    telemetry = BuildTelemetry(name, tag)
+    success = False
+    try:
+        yield telemetry
+        success = True
+    finally:
+        telemetry.finish(success=success)
+        path = telemetry.save(directory)
+        logger.info(f"Build report saved to {path}")
+
+
+def load_reports(directory: Path, name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Load the reports stored in the given directory, oldest first.
+    If `name` is given only reports for builds with that name are returned.
+    """
+    if not directory.is_dir():
+        return []
+    reports = [json.loads(path.read_text()) for path in directory.glob("*.json")]
+    if name is not None:
+        reports = [report for report in reports if report["name"] == name]
+    return sorted(reports, key=lambda report: report["started"])
+
+
+def compare_reports(
+    previous: Dict[str, Any],
+    current: Dict[str, Any],
+    min_seconds: float = 1,
+    min_ratio: float = 0.2,
+) -> List[Dict[str, Any]]:
+    """Compare the steps of two reports for the same build and return the
+    ones that got slower by more than `min_seconds` seconds and by more
+    than `min_ratio` (relative to the previous duration).
+    Steps are matched by their instruction text.
+    """
+    previous_steps = {
+        step["step"]: step for step in previous["steps"] if step["duration"]
+    }
+    regressions = []
+    for step in current["steps"]:
+        before = previous_steps.get(step["step"])
+        if before is None or step["duration"] is None:
+            continue
+        delta = step["duration"] - before["duration"]
+        if delta > min_seconds and delta > before["duration"] * min_ratio:
+            regressions.append(
+                {
+                    "step": step["step"],
+                    "before": before["duration"],
+                    "after": step["duration"],
+                    "cache_lost": before["cached"] and not step["cached"],
+                }
+            )
+    return regressions
+
+
+def cache_hit_ratio(report: Dict[str, Any]) -> float:
+    if not report["steps"]:
+        return 0
+    return sum(step["cached"] for step in report["steps"]) / len(report["steps"])
@@ -0,0 +1,111 @@
+"""Utility functions to compile the sass files of project themes.
+
+Compiled themes are remembered in the project private directory together with
+a hash of their inputs, so that only themes that changed are compiled again.
+"""
+from derex.runner.project import Project
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+import hashlib
+import json
+import os
+
+
+SASS_CACHE_FILENAME = "sass_cache.json"
+SASS_EXTENSIONS = (".scss", ".sass")
+# `paver compile_sass --themes` also compiles the default theme every time:
+# call the function it uses to compile a single theme instead
+COMPILE_THEME_COMMAND = (
+    'python -c "from path import Path; from pavelib.assets import _compile_sass; '
+    "[_compile_sass(system, Path('/openedx/themes/{theme}'), False, False, []) "
+    "for system in ('lms', 'cms')]\""
+)
+
+
+def get_theme_sass_hash(theme_dir: Path, base_image: str) -> str:
+    """Return a hash of the sass files of the given theme and of the image
+    (and therefore the edx-platform version) used to compile them.
+    Keep in sync with `watch_themes.py.source`.
+    """
+    result = hashlib.sha256(base_image.encode())
+    for root, dirs, files in os.walk(theme_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith(SASS_EXTENSIONS):
+                continue
+            path = Path(root) / filename
+            result.update(str(path.relative_to(theme_dir)).encode())
+            result.update(hashlib.sha256(path.read_bytes()).digest())
+    return result.hexdigest()
+
+
+def get_sass_cache_path(project: Project) -> Path:
+    """Return the path of the sass cache of the project, creating an empty
+    one if it doesn't exist, so that it can be mounted in a container.
+    """
+    path = project.private_filepath(SASS_CACHE_FILENAME)
+    if not path.exists():
+        path.write_text("{}")
+    return path
+
+
+def load_sass_cache(project: Project) -> Dict[str, str]:
+    path = project.private_filepath(SASS_CACHE_FILENAME)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_sass_cache(project: Project, hashes: Dict[str, str]):
+    """Remember the given themes as compiled, together with their hash.
+    """
+    cache = load_sass_cache(project)
+    cache.update(hashes)
+    project.private_filepath(SASS_CACHE_FILENAME).write_text(
+        json.dumps(cache, indent=2, sort_keys=True)
+    )
+
+
+def get_themes_to_compile(
+    project: Project, force: bool = False
+) -> Tuple[List[str], Dict[str, str]]:
+    """Return the names of the themes whose sass files changed since they were
+    last compiled (all themes if `force` is True) and a dictionary with the
+    current hash of each of them.
+    """
+    cache = {} if force else load_sass_cache(project)
+    hashes = {
+        theme_dir.name: get_theme_sass_hash(theme_dir, project.base_image)
+        for theme_dir in sorted(project.themes_dir.iterdir())
+        if theme_dir.is_dir()
+    }
+    to_compile = [name for name, value in hashes.items() if cache.get(name) != value]
+    return to_compile, {name: hashes[name] for name in to_compile}
+
+
+def compile_themes_script(themes: Iterable[str], uid: int) -> str:
+    """Return a shell script that compiles the default theme, then the given
+    themes in parallel processes, and fails if any of them fails.
+    """
+    lines = [
+        "set -ex",
+        "export PATH=/openedx/edx-platform/node_modules/.bin:$PATH  # FIXME: this should not be necessary",
+        "paver compile_sass",
+        "pids=''",
+    ]
+    for theme in themes:
+        command = COMPILE_THEME_COMMAND.format(theme=theme)
+        lines.append(f'{command} & pids="$pids $!"')
+    lines.extend(
+        [
+            "status=0",
+            "for pid in $pids; do wait $pid || status=1; done",
+            f"chown {uid}:{uid} /openedx/themes/* -R",
+            "exit $status",
+        ]
+    )
+    return "\n".join(lines)
@@ -78,6 +78,18 @@ def asbool(s: Any) -> bool:
     return s.lower() in truthy
 
 
+def human_size(size: float) -> str:
+    """Format a size in bytes for humans, like `12.3 MB`
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:.1f} {unit}"
+
+
 def abspath_from_egg(egg: str, path: str) -> Optional[Path]:
     """Given a path relative to the egg root, find the absolute
     filesystem path for that resource.
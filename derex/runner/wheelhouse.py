@@ -0,0 +1,96 @@
+"""A wheelhouse shared by all projects on this host.
+
+Building wheels for xblocks and other project requirements can take a long
+time, and projects based on the same image often need the same packages.
+Wheels are built once in a container based on the project base image and
+stored in a host directory keyed by that base image: wheel file names
+already encode package name, version and python ABI.
+
+Every project build collects the wheels it needs in its private `.derex/wheels`
+directory (reusing the shared ones and adding the missing ones to the shared
+wheelhouse). In the image build pip installs them in a separate stage,
+so that the wheels are not shipped in the image.
+"""
+from derex.runner.docker import client as docker_client
+from derex.runner.local_appdir import DEREX_DIR
+from derex.runner.project import Project
+from pathlib import Path
+
+import logging
+import os
+import shutil
+
+
+logger = logging.getLogger(__name__)
+WHEELHOUSE_DIR = DEREX_DIR / "wheelhouse"
+PROJECT_WHEELS_DIR = "wheels"
+
+FILL_WHEELHOUSE_SCRIPT = """set -e
+pip install pip==20.0.2
+grep == /openedx/edx-platform/requirements/edx/base.txt |grep -v ^git+https > /tmp/base.txt
+cd /openedx/derex.requirements
+for requirements_file in *.txt; do
+    pip wheel --find-links /wheelhouse --wheel-dir /wheels -c /tmp/base.txt -r $requirements_file
+done
+# Publish new wheels with a rename, so that concurrent builds never
+# pick up partially written files
+for wheel in /wheels/*.whl; do
+    name=$(basename $wheel)
+    if [ ! -e /wheelhouse/$name ]; then
+        cp $wheel /wheelhouse/.$name.tmp && mv /wheelhouse/.$name.tmp /wheelhouse/$name
+    fi
+done
+chown -R {uid}:{gid} /wheels /wheelhouse
+"""
+
+
+def get_wheelhouse_dir(image: str) -> Path:
+    """Return the shared wheelhouse directory for wheels built on the given image.
+    The directory is keyed by image ID, so that a new version of the base image
+    (possibly with a different python version) gets a fresh wheelhouse.
+    """
+    image_id = docker_client.api.inspect_image(image)["Id"]
+    return WHEELHOUSE_DIR / image_id.rpartition(":")[2][:12]
+
+
+def uses_shared_wheelhouse(project: Project) -> bool:
+    return bool(project.requirements_dir and project.config.get("shared_wheelhouse"))
+
+
+def fill_wheelhouse(project: Project) -> Path:
+    """Collect in the project private directory the wheels needed to install
+    the project requirements, building the ones missing from the shared
+    wheelhouse and adding them to it.
+    Return the path of the directory containing the project wheels.
+    """
+    wheelhouse = get_wheelhouse_dir(project.base_image)
+    project_wheels = project.private_filepath(PROJECT_WHEELS_DIR)
+    # Start from scratch so that only wheels for the current requirements are used
+    if project_wheels.exists():
+        shutil.rmtree(str(project_wheels))
+    for directory in (wheelhouse, project_wheels):
+        directory.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Collecting wheels using shared wheelhouse {wheelhouse}")
+    volumes = {
+        str(wheelhouse): {"bind": "/wheelhouse", "mode": "rw"},
+        str(project_wheels): {"bind": "/wheels", "mode": "rw"},
+        str(project.requirements_dir): {
+            "bind": "/openedx/derex.requirements",
+            "mode": "ro",
+        },
+    }
+    for src, dest in (project.requirements_volumes or {}).items():
+        volumes[src] = {"bind": dest, "mode": "ro"}
+    script = FILL_WHEELHOUSE_SCRIPT.format(uid=os.getuid(), gid=os.getgid())
+    container = docker_client.containers.run(
+        project.base_image, ["sh", "-c", script], volumes=volumes, detach=True
+    )
+    try:
+        for line in container.logs(stream=True, follow=True):
+            print(line.decode(errors="replace"), end="")
+        result = container.wait()
+    finally:
+        container.remove(force=True)
+    if result["StatusCode"] != 0:
+        raise RuntimeError("Could not build wheels for project requirements")
+    return project_wheels
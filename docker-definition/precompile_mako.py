@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Compile all Mako templates to python modules in the given directory,
+so that they don't need to be compiled when first rendered.
+
+Run it from the edx-platform directory with SERVICE_VARIANT and
+DJANGO_SETTINGS_MODULE set, for instance:
+
+    SERVICE_VARIANT=lms DJANGO_SETTINGS_MODULE=lms.envs.derex.assets \
+        python precompile_mako.py /openedx/mako_modules/lms
+
+Templates are compiled through the edxmako lookups, once for every theme,
+so that the module file names are the same the running application will use.
+With `--themes-only` only the templates found in the theme directories are
+compiled, for instance after adding themes to an image whose default
+templates are already compiled.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+
+COMPILED_EXTENSIONS = (".html", ".txt", ".xml", ".underscore", ".js", ".mako")
+
+
+def setup_django(module_dir):
+    sys.path.insert(0, os.getcwd())
+    from django.conf import settings
+
+    # The lookups are created when django starts: they need to know the directory now
+    settings.MAKO_MODULE_DIR = module_dir
+    import django
+
+    django.setup()
+
+
+def get_themes():
+    """Return the themes we should compile templates for: None stands for
+    the default templates.
+    """
+    try:
+        from openedx.core.djangoapps.theming.helpers import get_themes
+    except ImportError:
+        return [None]
+    return [None] + list(get_themes())
+
+
+def set_current_theme(theme):
+    from openedx.core.djangoapps.theming import helpers
+
+    helpers.get_current_theme = lambda *args, **kwargs: theme
+
+
+def get_directory_template_uris(directory):
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith(COMPILED_EXTENSIONS):
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, directory)
+
+
+def get_template_uris(lookup):
+    for directory in lookup.directories:
+        for uri in get_directory_template_uris(directory):
+            yield uri
+
+
+def get_theme_template_uris(theme):
+    for directory in getattr(theme, "template_dirs", []):
+        for uri in get_directory_template_uris(str(directory)):
+            yield uri
+
+
+def main():
+    module_dir = sys.argv[1]
+    themes_only = "--themes-only" in sys.argv[2:]
+    if not os.path.isdir(module_dir):
+        os.makedirs(module_dir)
+    setup_django(module_dir)
+    from edxmako.paths import LOOKUP
+
+    compiled, failed = 0, 0
+    for theme in get_themes():
+        if themes_only and theme is None:
+            continue
+        set_current_theme(theme)
+        for namespace, lookup in LOOKUP.items():
+            if themes_only:
+                # A theme template can override a template of any namespace
+                uris = set(get_theme_template_uris(theme))
+            else:
+                uris = set(get_template_uris(lookup))
+            for uri in sorted(uris):
+                try:
+                    lookup.get_template(uri)
+                except Exception:
+                    # Not all files in template directories are valid Mako templates:
+                    # they will be compiled (and fail) at runtime as before
+                    failed += 1
+                else:
+                    compiled += 1
+    print(
+        "Compiled {} templates in {} ({} could not be compiled)".format(
+            compiled, module_dir, failed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Compile python files to bytecode and measure how much this speeds up
+the startup of the LMS.
+
+Run it from the edx-platform directory. Results are printed and saved
+as JSON in the file given as first argument.
+With `--only DIRECTORY...` only the given directories are compiled and
+startup time is not measured.
+
+On python 3.7+ checked-hash pyc files are written: they stay valid when
+file modification times change, for instance when a directory is copied
+or mounted from the host.
+"""
+from __future__ import print_function
+
+import compileall
+import json
+import os
+import re
+import site
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+
+DIRECTORIES = [
+    "/openedx/edx-platform",
+    "/openedx/derex.requirements",
+]
+EXCLUDE = re.compile(r"/node_modules/|/\.git/")
+COLD_START_SCRIPT = "import django; django.setup()"
+
+
+def measure_cold_start(runs=3, ignore_bytecode=False):
+    """Return the best time it takes to setup django in a new python process.
+    Run python with -B so that the measurement itself does not write bytecode.
+    If `ignore_bytecode` is True python looks for bytecode in an empty directory
+    instead of next to the source files (only supported by python 3.8+).
+    """
+    env = dict(
+        os.environ,
+        SERVICE_VARIANT="lms",
+        DJANGO_SETTINGS_MODULE="lms.envs.derex.assets",
+        PYTHONPATH=os.getcwd(),
+    )
+    if ignore_bytecode:
+        env["PYTHONPYCACHEPREFIX"] = tempfile.mkdtemp()
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-B", "-c", COLD_START_SCRIPT], env=env)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def compile_directories(directories):
+    kwargs = dict(maxlevels=50, quiet=1, rx=EXCLUDE)
+    if sys.version_info >= (3, 5):
+        kwargs["workers"] = 0  # Use all available CPUs
+    if sys.version_info >= (3, 7):
+        import py_compile
+
+        kwargs["invalidation_mode"] = py_compile.PycInvalidationMode.CHECKED_HASH
+    success = True
+    for directory in directories:
+        if os.path.isdir(directory):
+            success = compileall.compile_dir(directory, **kwargs) and success
+    return success
+
+
+def main():
+    if sys.argv[1] == "--only":
+        if not compile_directories(sys.argv[2:]):
+            print("Some files could not be compiled")
+        return
+    stats_path = sys.argv[1]
+    # Requirements installed from the shared wheelhouse are in the user site
+    directories = DIRECTORIES + sorted(
+        set(
+            [
+                sysconfig.get_paths()["purelib"],
+                sysconfig.get_paths()["platlib"],
+                site.getusersitepackages(),
+            ]
+        )
+    )
+    # Older pythons always use the bytecode next to the source files: the
+    # measure before compiling then includes the bytecode of the base image
+    ignore_bytecode = sys.version_info >= (3, 8)
+    if ignore_bytecode:
+        before_name, before_label = "cold_start_no_bytecode", "without bytecode"
+    else:
+        before_name, before_label = (
+            "cold_start_base_bytecode",
+            "with the base image bytecode only",
+        )
+    before = measure_cold_start(ignore_bytecode=ignore_bytecode)
+    start = time.time()
+    if not compile_directories(directories):
+        print("Some files could not be compiled")
+    compile_time = time.time() - start
+    after = measure_cold_start()
+    stats = {
+        before_name: before,
+        "cold_start_after": after,
+        "compile_time": compile_time,
+    }
+    with open(stats_path, "w") as fh:
+        json.dump(stats, fh)
+    print(
+        "Bytecode compiled in {:.1f}s. Cold start: {:.2f}s {}, {:.2f}s after".format(
+            compile_time, before, before_label, after
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
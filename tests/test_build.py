@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.build` module."""
+from pathlib import Path
+
+
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
+
+
+def test_themes_image_installs_requirements_before_themes(workdir_copy, mocker):
+    from derex.runner.build import build_themes_image
+    from derex.runner.project import Project
+
+    build_image = mocker.patch("derex.runner.build.build_image")
+    mocker.patch("derex.runner.build.docker_has_experimental", return_value=False)
+    mocker.patch("derex.runner.build.record_bytecode_stats")
+    mocker.patch("derex.runner.build.get_image_id", return_value="sha256:abcdef")
+    with workdir_copy(COMPLETE_PROJ):
+        build_themes_image(Project())
+
+    lines = build_image.call_args[0][0].splitlines()
+    themes_index = lines.index("COPY themes/ /openedx/themes/")
+    requirements_index = lines.index("COPY requirements /openedx/derex.requirements/")
+    # A change in the themes must not invalidate the requirements layers
+    assert requirements_index < themes_index
+    assert all("pip install" not in line for line in lines[themes_index:])
+    # Templates and bytecode are compiled before the themes are copied,
+    # then only the themes are compiled
+    mako_lines = [
+        index for index, line in enumerate(lines) if "bin/precompile_mako.py" in line
+    ]
+    python_lines = [
+        index for index, line in enumerate(lines) if "bin/precompile_python.py" in line
+    ]
+    assert mako_lines[0] < themes_index < mako_lines[1]
+    assert "--themes-only" in lines[mako_lines[1]]
+    assert python_lines[0] < themes_index < python_lines[1]
+    assert "--only /openedx/themes" in lines[python_lines[1]]
+    assert "precompile_mako.py" in str(build_image.call_args[0][1])
+    # The image records what it was built from
+    labels = build_image.call_args[1]["extra_opts"]["labels"]
+    assert "io.derex.build-inputs" in labels
+
+
+def test_assets_image(workdir_copy, mocker):
+    from derex.runner.build import build_assets_image
+    from derex.runner.build import build_themes_image
+    from derex.runner.project import Project
+
+    build_image = mocker.patch("derex.runner.build.build_image")
+    mocker.patch("derex.runner.build.docker_has_experimental", return_value=False)
+    mocker.patch("derex.runner.build.record_bytecode_stats")
+    mocker.patch("derex.runner.build.get_image_id", return_value="sha256:abcdef")
+    image_exists = mocker.patch("derex.runner.build.image_exists")
+    docker_client = mocker.patch("derex.runner.build.docker_client")
+    docker_client.containers.run.return_value = b"0123456789abcdef\n"
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        # The name does not depend on any local state
+        assets_image_name = project.assets_image_name
+        assert assets_image_name.startswith("complete/openedx-assets:")
+        assert Project().assets_image_name == assets_image_name
+
+        image_exists.return_value = False
+        build_assets_image(project)
+        assert build_image.call_args[1]["tag"] == assets_image_name
+        assert "paver update_assets" in build_image.call_args[0][0]
+        # The image is also tagged with a name that only depends on the static files
+        compiled_tag = docker_client.api.tag.call_args[0]
+        assert compiled_tag[0] == assets_image_name
+        assert compiled_tag[1] == "complete/openedx-assets"
+
+        # Same static files: the compiled assets are copied, not compiled again
+        build_image.reset_mock()
+        docker_client.api.tag.reset_mock()
+        image_exists.return_value = True
+        build_assets_image(project)
+        docker_client.api.tag.assert_not_called()
+        assert build_image.call_args[1]["tag"] == assets_image_name
+        dockerfile_text = build_image.call_args[0][0]
+        assert "paver update_assets" not in dockerfile_text
+        assert (
+            "COPY --from=complete/openedx-assets:"
+            f"{compiled_tag[2]} /openedx/staticfiles /openedx/staticfiles"
+        ) in dockerfile_text
+
+        build_themes_image(project)
+    assert f"FROM {assets_image_name} as static" in build_image.call_args[0][0]
+
+
+def test_assets_image_python_requirement_change(workdir_copy, mocker):
+    """When only python requirements change the compiled assets are reused,
+    but the assets image must include the new requirements"""
+    from derex.runner.build import build_assets_image
+    from derex.runner.project import Project
+
+    build_image = mocker.patch("derex.runner.build.build_image")
+    mocker.patch("derex.runner.build.get_image_id", return_value="sha256:abcdef")
+    image_exists = mocker.patch("derex.runner.build.image_exists")
+    docker_client = mocker.patch("derex.runner.build.docker_client")
+    # Static files don't change: the fingerprint stays the same
+    docker_client.containers.run.return_value = b"0123456789abcdef\n"
+    with workdir_copy(COMPLETE_PROJ):
+        old_project = Project()
+        image_exists.return_value = False
+        build_assets_image(old_project)
+        compiled_image_name = "complete/openedx-assets:" + (
+            docker_client.api.tag.call_args[0][2]
+        )
+
+        with (old_project.requirements_dir / "xblocks.txt").open("a") as fh:
+            fh.write("pure-python-package==1.0\n")
+        project = Project()
+        assert project.requirements_image_name != old_project.requirements_image_name
+        assert project.assets_image_name != old_project.assets_image_name
+        image_exists.return_value = True
+        build_assets_image(project)
+
+    assert build_image.call_args[1]["tag"] == project.assets_image_name
+    lines = build_image.call_args[0][0].splitlines()
+    # The new package comes from the new requirements image
+    assert lines[0] == f"FROM {project.requirements_image_name}"
+    assert all(
+        line.startswith(f"COPY --from={compiled_image_name} ") for line in lines[1:]
+    )
+
+
+def test_project_image_includes_assets(workdir_copy):
+    from derex.runner.project import Project
+
+    import shutil
+
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        assert project.image_name == project.themes_image_name
+        # Without themes the project runs the image with compiled assets
+        shutil.rmtree(str(project.themes_dir))
+        project = Project()
+        assert project.image_name == project.assets_image_name
+
+
+def test_record_bytecode_stats(mocker):
+    from derex.runner.build import record_bytecode_stats
+    from derex.runner.telemetry import BuildTelemetry
+
+    docker_client = mocker.patch("derex.runner.build.docker_client")
+    docker_client.containers.run.return_value = b'{"cold_start_base_bytecode": 4.5, "cold_start_after": 2.5, "compile_time": 30}'
+    telemetry = BuildTelemetry("themes", "complete/openedx-themes:abcdef")
+    record_bytecode_stats("complete/openedx-themes:abcdef", telemetry)
+    assert telemetry.metrics["cold_start_after"] == 2.5
+    assert telemetry.metrics["cold_start_base_bytecode"] == 4.5
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.build_plan` module."""
+from .conftest import assert_result_ok
+from click.testing import CliRunner
+from pathlib import Path
+
+import pytest
+import threading
+
+
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
+
+
+def test_plan_build_skips_existing_images(workdir, mocker):
+    from derex.runner.build_plan import plan_build
+    from derex.runner.project import Project
+
+    with workdir(COMPLETE_PROJ):
+        project = Project()
+    # The base images are not present: the existing images are trusted
+    mocker.patch("derex.runner.build.get_image_id", return_value=None)
+    image_exists = mocker.patch("derex.runner.build_plan.image_exists")
+    image_exists.side_effect = lambda tag: tag == project.requirements_image_name
+
+    plan = plan_build(project, ["themes"])
+    assert [(el.stage.name, el.stage.tag, el.action) for el in plan] == [
+        ("requirements", project.requirements_image_name, "skip"),
+        ("assets", project.assets_image_name, "build"),
+        ("themes", project.themes_image_name, "build"),
+    ]
+    plan = plan_build(project, ["requirements"], force=True)
+    assert [(el.stage.name, el.action) for el in plan] == [("requirements", "build")]
+
+    # Dependencies of a stage are not needed if the stage is not built
+    image_exists.side_effect = lambda tag: tag == project.themes_image_name
+    plan = plan_build(project, ["themes"])
+    assert [(el.stage.name, el.action) for el in plan] == [("themes", "skip")]
+
+
+def test_plan_build_pulls_from_registry(workdir, mocker):
+    from derex.runner.build_plan import plan_build
+    from derex.runner.project import Project
+
+    with workdir(COMPLETE_PROJ):
+        project = Project()
+    mocker.patch("derex.runner.build_plan.image_exists", return_value=False)
+    image_in_registry = mocker.patch("derex.runner.build_plan.image_in_registry")
+    image_in_registry.side_effect = lambda tag: tag == project.themes_image_name
+
+    # The project image prefix does not include a registry host
+    plan = plan_build(project, ["requirements", "themes"])
+    assert [el.action for el in plan] == ["build", "build", "build"]
+    image_in_registry.assert_not_called()
+
+    plan = plan_build(project, ["requirements", "themes"], pull=True)
+    assert [(el.stage.name, el.action) for el in plan] == [
+        ("requirements", "build"),
+        ("themes", "pull"),
+    ]
+
+    project.image_prefix = "registry.example.com/complete/openedx"
+    plan = plan_build(project, ["themes"])
+    assert [(el.stage.name, el.action) for el in plan] == [("themes", "pull")]
+
+
+def test_plan_build_rebuilds_outdated_images(workdir, mocker):
+    from derex.runner.build import BUILD_INPUTS_LABEL
+    from derex.runner.build import get_requirements_build_inputs
+    from derex.runner.build_plan import plan_build
+    from derex.runner.project import Project
+
+    with workdir(COMPLETE_PROJ):
+        project = Project()
+    image_ids = {project.base_image: "sha256:1", project.final_base_image: "sha256:2"}
+    mocker.patch("derex.runner.build.get_image_id", side_effect=image_ids.get)
+    mocker.patch("derex.runner.build_plan.image_exists", return_value=True)
+    get_image_labels = mocker.patch("derex.runner.build_plan.get_image_labels")
+    get_image_labels.return_value = {
+        BUILD_INPUTS_LABEL: get_requirements_build_inputs(project)
+    }
+    plan = plan_build(project, ["requirements"])
+    assert [(el.stage.name, el.action) for el in plan] == [("requirements", "skip")]
+
+    # A newer base image was pulled
+    image_ids[project.base_image] = "sha256:3"
+    plan = plan_build(project, ["requirements"])
+    assert [(el.stage.name, el.action) for el in plan] == [("requirements", "rebuild")]
+    plan = plan_build(project, ["themes"])
+    assert [(el.stage.name, el.action) for el in plan] == [
+        ("requirements", "rebuild"),
+        ("assets", "rebuild"),
+        ("themes", "rebuild"),
+    ]
+
+
+def test_execute_plan_runs_independent_stages_concurrently():
+    from derex.runner.build_plan import BuildStage
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import PlannedStage
+
+    # Both theme stages wait for each other: they only complete if run concurrently
+    barrier = threading.Barrier(2, timeout=5)
+    built = []
+
+    def build(name):
+        def func():
+            if name.startswith("theme"):
+                barrier.wait()
+            built.append(name)
+
+        return func
+
+    plan = [
+        PlannedStage(BuildStage("requirements", "r:1", build("requirements")), "build"),
+        PlannedStage(
+            BuildStage("theme1", "t:1", build("theme1"), ("requirements",)), "build"
+        ),
+        PlannedStage(
+            BuildStage("theme2", "t:2", build("theme2"), ("requirements",)), "build"
+        ),
+        PlannedStage(
+            BuildStage("final", "f:1", build("final"), ("theme1", "theme2")), "build"
+        ),
+    ]
+    execute_plan(plan)
+    assert built[0] == "requirements"
+    assert set(built[1:3]) == {"theme1", "theme2"}
+    assert built[3] == "final"
+
+
+def test_execute_plan_pulls_and_pushes_while_building(mocker):
+    from derex.runner.build_plan import BuildStage
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import PlannedStage
+
+    # The pull and the push only complete if run while the builds are running
+    pull_barrier = threading.Barrier(2, timeout=5)
+    push_barrier = threading.Barrier(2, timeout=5)
+    mocker.patch(
+        "derex.runner.build_plan.pull_images", side_effect=lambda _: pull_barrier.wait()
+    )
+    push_image = mocker.patch(
+        "derex.runner.build_plan.push_image",
+        side_effect=lambda tag: tag == "r:1" and push_barrier.wait(),
+    )
+    built = []
+
+    def build(name, barrier):
+        def func():
+            barrier.wait()
+            built.append(name)
+
+        return func
+
+    plan = [
+        PlannedStage(
+            BuildStage("requirements", "r:1", build("requirements", pull_barrier)),
+            "build",
+        ),
+        PlannedStage(BuildStage("assets", "a:1", mocker.Mock()), "pull"),
+        PlannedStage(
+            BuildStage(
+                "themes",
+                "t:1",
+                build("themes", push_barrier),
+                ("requirements", "assets"),
+            ),
+            "build",
+        ),
+    ]
+    execute_plan(plan, push=True)
+    assert built == ["requirements", "themes"]
+    assert {el[0][0] for el in push_image.call_args_list} == {"r:1", "t:1"}
+
+
+def test_execute_plan_propagates_errors():
+    from derex.runner.build_plan import BuildStage
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import PlannedStage
+
+    def fail():
+        raise RuntimeError("Build failed")
+
+    with pytest.raises(RuntimeError):
+        execute_plan([PlannedStage(BuildStage("requirements", "r:1", fail), "build")])
+
+
+def test_derex_build_plan(workdir_copy, mocker):
+    from derex.runner.cli.build import build
+    from derex.runner.project import Project
+
+    mocker.patch("derex.runner.build.get_image_id", return_value=None)
+    image_exists = mocker.patch("derex.runner.build_plan.image_exists")
+    build_image = mocker.patch("derex.runner.build.build_image")
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        image_exists.side_effect = lambda tag: tag != project.assets_image_name
+        result = CliRunner().invoke(build, ["final", "--plan"], obj=project)
+        assert_result_ok(result)
+        assert project.themes_image_name in result.output
+        assert project.assets_image_name in result.output
+        assert "present, skip" in result.output
+
+        image_exists.side_effect = lambda tag: True
+        result = CliRunner().invoke(build, ["final"], obj=project)
+        assert_result_ok(result)
+    build_image.assert_not_called()
+
+
+def test_execute_plan_pulls_and_pushes(mocker):
+    from derex.runner.build_plan import BuildStage
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import PlannedStage
+
+    pull_images = mocker.patch("derex.runner.build_plan.pull_images")
+    push_image = mocker.patch("derex.runner.build_plan.push_image")
+    build = mocker.Mock()
+    plan = [
+        PlannedStage(BuildStage("requirements", "r:1", build), "build"),
+        PlannedStage(BuildStage("themes", "t:1", build, ("requirements",)), "pull"),
+    ]
+    execute_plan(plan, push=True)
+    build.assert_called_once()
+    pull_images.assert_called_once_with(["t:1"])
+    push_image.assert_called_once_with("r:1")
+
+
+def test_assets_stage_is_pulled_and_pushed(workdir_copy, mocker):
+    from derex.runner.build_plan import execute_plan
+    from derex.runner.build_plan import plan_build
+    from derex.runner.project import Project
+
+    mocker.patch("derex.runner.build_plan.image_exists", return_value=False)
+    image_in_registry = mocker.patch("derex.runner.build_plan.image_in_registry")
+    pull_images = mocker.patch("derex.runner.build_plan.pull_images")
+    push_image = mocker.patch("derex.runner.build_plan.push_image")
+    mocker.patch("derex.runner.build_plan.build_requirements_image")
+    build_assets_image = mocker.patch("derex.runner.build_plan.build_assets_image")
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+    image_in_registry.side_effect = lambda tag: tag == project.assets_image_name
+    plan = plan_build(project, ["assets"], pull=True)
+    assert [(el.stage.name, el.action) for el in plan] == [("assets", "pull")]
+    execute_plan(plan)
+    pull_images.assert_called_once_with([project.assets_image_name])
+
+    plan = plan_build(project, ["assets"], force=True)
+    execute_plan(plan, push=True)
+    build_assets_image.assert_called_once_with(project)
+    push_image.assert_any_call(project.assets_image_name)
@@ -2,6 +2,7 @@
 from types import SimpleNamespace
 
 import docker
+import pytest
 
 
 def test_ensure_volumes_present(mocker):
@@ -48,3 +49,43 @@ def test_wait_for_service(mocker):
     wait_for_service("mysql", 'mysql -psecret -e "SHOW DATABASES"', 1)
     client.containers.get.assert_called_with("mysql")
     container.exec_run.assert_called_with('mysql -psecret -e "SHOW DATABASES"')
+
+
+def test_get_image_registry():
+    from derex.runner.docker import get_image_registry
+
+    assert get_image_registry("derex/edx-ironwood-dev:0.0.2") is None
+    assert get_image_registry("project/openedx-themes:abcdef") is None
+    assert get_image_registry("localhost/project/openedx") == "localhost"
+    assert get_image_registry("localhost:5000/project/openedx") == "localhost:5000"
+    assert get_image_registry("registry.example.com/openedx") == "registry.example.com"
+
+
+@pytest.mark.slowtest
+def test_registry_push_and_pull():
+    from derex.runner.docker import client
+    from derex.runner.docker import image_exists
+    from derex.runner.docker import image_in_registry
+    from derex.runner.docker import pull_images
+    from derex.runner.docker import push_image
+
+    registry = client.containers.run(
+        "registry:2", detach=True, ports={"5000/tcp": None}, remove=True
+    )
+    try:
+        registry.reload()
+        port = registry.ports["5000/tcp"][0]["HostPort"]
+        image_name = f"localhost:{port}/derex-test/openedx-themes:abcdef"
+        client.images.pull("busybox:latest").tag(image_name)
+        assert not image_in_registry(image_name)
+
+        push_image(image_name)
+        client.images.remove(image_name)
+        assert not image_exists(image_name)
+        assert image_in_registry(image_name)
+
+        pull_images([image_name])
+        assert image_exists(image_name)
+        client.images.remove(image_name)
+    finally:
+        registry.stop()
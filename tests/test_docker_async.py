@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.docker_async` module.
+A fake docker daemon listening on a unix socket stands in for the real one.
+"""
+from tempfile import TemporaryDirectory
+
+import asyncio
+import json
+import pytest
+
+
+class FakeDockerDaemon:
+    """Answer HTTP requests on a unix socket with canned responses.
+    `routes` maps `(method, path)` tuples to `(status, body)` tuples.
+    If body is a list, its elements are sent as separate chunks
+    using chunked transfer encoding.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.headers = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode()
+        method, url, _ = request_line.split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        path = url.partition("?")[0]
+        self.requests.append((method, url, body))
+        self.headers.append(headers)
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        # Give other requests a chance to come in
+        await asyncio.sleep(0.05)
+        self.concurrent -= 1
+        status, response = self.routes.get(
+            (method, path), (404, {"message": f"No such object: {path}"})
+        )
+        if isinstance(response, list):
+            writer.write(
+                f"HTTP/1.1 {status} OK\r\nTransfer-Encoding: chunked\r\n\r\n".encode()
+            )
+            for chunk in response:
+                data = (json.dumps(chunk) + "\r\n").encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            writer.write(b"0\r\n\r\n")
+        else:
+            data = json.dumps(response).encode()
+            writer.write(
+                f"HTTP/1.1 {status} OK\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+                + data
+            )
+        await writer.drain()
+        writer.close()
+
+
+@pytest.fixture
+def fake_docker(mocker):
+    """Return a function that runs a coroutine against a fake docker daemon
+    serving the given routes. The daemon is returned as well, to inspect
+    the requests it received.
+    """
+    from derex.runner.docker_async import AsyncDockerClient
+
+    def run_with_routes(coroutine_function, routes):
+        daemon = FakeDockerDaemon(routes)
+        with TemporaryDirectory("-derex-docker") as tmpdir:
+            socket_path = f"{tmpdir}/docker.sock"
+            mocker.patch(
+                "derex.runner.docker_async.client", AsyncDockerClient(socket_path)
+            )
+
+            async def main():
+                server = await asyncio.start_unix_server(daemon.handle, socket_path)
+                try:
+                    return await coroutine_function()
+                finally:
+                    server.close()
+                    await server.wait_closed()
+
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(main()), daemon
+            finally:
+                loop.close()
+
+    return run_with_routes
+
+
+def test_ensure_volumes_present(fake_docker):
+    from derex.runner.docker import VOLUMES
+    from derex.runner.docker_async import ensure_volumes_present
+
+    routes = {
+        ("GET", "/volumes"): (200, {"Volumes": [{"Name": "derex_mysql"}]}),
+        ("POST", "/volumes/create"): (201, {}),
+    }
+    _, daemon = fake_docker(ensure_volumes_present, routes)
+    created = [
+        json.loads(body)["Name"]
+        for method, url, body in daemon.requests
+        if url == "/volumes/create"
+    ]
+    assert sorted(created) == sorted(VOLUMES - {"derex_mysql"})
+    # Volumes should have been created concurrently
+    assert daemon.max_concurrent == len(created)
+
+
+def test_check_services(fake_docker):
+    from derex.runner.docker_async import check_services
+
+    running = (200, {"State": {"Status": "running"}})
+    routes = {
+        ("GET", "/containers/mysql/json"): running,
+        ("GET", "/containers/mongodb/json"): running,
+        ("GET", "/containers/rabbitmq/json"): (200, {"State": {"Status": "exited"}}),
+    }
+    result, daemon = fake_docker(lambda: check_services(["mysql", "mongodb"]), routes)
+    assert result is True
+    assert daemon.max_concurrent == 2
+
+    result, _ = fake_docker(lambda: check_services(["mysql", "rabbitmq"]), routes)
+    assert result is False
+
+    result, _ = fake_docker(lambda: check_services(["mysql", "missing"]), routes)
+    assert result is False
+
+
+def test_get_running_containers(fake_docker):
+    from derex.runner.docker_async import get_running_containers
+
+    names = [f"container{i}" for i in range(20)]
+    routes = {
+        ("GET", "/networks/derex"): (
+            200,
+            {"Containers": {f"id{i}": {"Name": name} for i, name in enumerate(names)}},
+        )
+    }
+    for i, name in enumerate(names):
+        routes[("GET", f"/containers/id{i}/json")] = (200, {"Name": f"/{name}"})
+    result, daemon = fake_docker(get_running_containers, routes)
+    assert sorted(result) == sorted(names)
+    assert daemon.max_concurrent == len(names)
+
+
+def test_pull_images(fake_docker, capsys):
+    from derex.runner.docker_async import pull_images
+
+    routes = {
+        ("POST", "/images/create"): (
+            200,
+            [
+                {"status": "Pulling fs layer", "id": "abc"},
+                {"status": "Downloading", "progress": "[==>  ]", "id": "abc"},
+                {"status": "Download complete", "id": "abc"},
+            ],
+        )
+    }
+    _, daemon = fake_docker(
+        lambda: pull_images(["derex/edx-ironwood-dev:0.0.2", "mysql"]), routes
+    )
+    urls = sorted(url for _, url, _ in daemon.requests)
+    assert urls == [
+        "/images/create?fromImage=derex%2Fedx-ironwood-dev&tag=0.0.2",
+        "/images/create?fromImage=mysql&tag=latest",
+    ]
+    output = capsys.readouterr().out
+    assert "derex/edx-ironwood-dev:0.0.2: Download complete" in output
+    assert "[==>  ]" not in output
+
+
+def test_get_docker_socket_path(monkeypatch):
+    from derex.runner.docker_async import get_docker_socket_path
+    from derex.runner.docker_async import is_available
+
+    monkeypatch.delenv("DOCKER_HOST", raising=False)
+    assert get_docker_socket_path() == "/var/run/docker.sock"
+    monkeypatch.setenv("DOCKER_HOST", "unix:///run/user/1000/docker.sock")
+    assert get_docker_socket_path() == "/run/user/1000/docker.sock"
+    # Remote daemons are not silently replaced by the local one
+    for host in ("tcp://10.0.0.1:2376", "ssh://user@host"):
+        monkeypatch.setenv("DOCKER_HOST", host)
+        assert get_docker_socket_path() is None
+        assert not is_available()
+
+
+def test_pull_image_digest_and_auth(fake_docker, mocker):
+    from derex.runner.docker_async import pull_image
+
+    load_config = mocker.patch("docker.auth.load_config")
+    load_config.return_value = {
+        "auths": {"registry:5000": {"username": "derex", "password": "secret"}}
+    }
+    routes = {("POST", "/images/create"): (200, [{"status": "Downloaded"}])}
+    _, daemon = fake_docker(lambda: pull_image("registry:5000/repo@sha256:abc"), routes)
+    assert daemon.requests[0][1] == (
+        "/images/create?fromImage=registry%3A5000%2Frepo&tag=sha256%3Aabc"
+    )
+    assert "x-registry-auth" in daemon.headers[0]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.dump_benchmark` module."""
+import bz2
+import pytest
+import shutil
+
+
+def test_get_compression(tmp_path):
+    from derex.runner.dump_benchmark import get_compression
+
+    assert get_compression(tmp_path / "empty_dump.sql.zst") == "zstd"
+    assert get_compression(tmp_path / "empty_dump.sql") == "none"
+    with pytest.raises(ValueError):
+        get_compression(tmp_path / "empty_dump.sql.gz")
+
+
+def test_benchmark_dump_formats(tmp_path):
+    from derex.runner.dump_benchmark import benchmark_dump_formats
+
+    formats = [el for el in ("zstd", "lz4") if shutil.which(el)] + ["bzip2", "none"]
+    if shutil.which("bzip2") is None:
+        pytest.skip("bzip2 is not installed")
+    sql = b"INSERT INTO `auth_user` VALUES (1,'user');\n" * 10000
+    dump_path = tmp_path / "empty_dump.sql.bz2"
+    dump_path.write_bytes(bz2.compress(sql))
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+
+    results = benchmark_dump_formats(dump_path, formats, workdir)
+    assert [el.compression for el in results] == formats
+    assert all(el.size == len(sql) for el in results)
+    by_format = {el.compression: el for el in results}
+    assert by_format["none"].compressed_size == len(sql)
+    assert by_format["bzip2"].ratio > 10
+    # Temporary files are removed after each format
+    assert sorted(el.name for el in workdir.iterdir()) == ["dump.sql", "restored.sql"]
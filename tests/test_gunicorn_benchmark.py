@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.gunicorn_benchmark` module."""
+from pathlib import Path
+
+import json
+import pytest
+
+
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
+
+
+def test_parse_gunicorn_options():
+    from derex.runner.gunicorn_benchmark import parse_gunicorn_options
+    from derex.runner.project import GunicornOptions
+
+    assert parse_gunicorn_options("sync") == GunicornOptions("sync", 2, 4)
+    assert parse_gunicorn_options("gthread:3:8") == GunicornOptions("gthread", 3, 8)
+    for wrong in ("eventlet", "sync:two", "gthread:1:2:3", "sync:0"):
+        with pytest.raises(ValueError):
+            parse_gunicorn_options(wrong)
+
+
+def test_benchmark_gunicorn(workdir_copy, mocker):
+    from derex.runner.gunicorn_benchmark import benchmark_gunicorn
+    from derex.runner.gunicorn_benchmark import parse_gunicorn_options
+    from derex.runner.project import Project
+
+    started_with = []
+    run_compose = mocker.patch("derex.runner.gunicorn_benchmark.run_compose")
+    run_compose.side_effect = lambda args, project: started_with.append(
+        project.gunicorn.worker_class
+    )
+    client = mocker.patch("derex.runner.gunicorn_benchmark.docker_client")
+    stats = {"requests": 100, "errors": 0, "seconds": 10.0}
+    stats.update(p50=0.1, p95=0.2, p99=0.3)
+    client.containers.run.return_value = ("Warming up\n" + json.dumps(stats)).encode()
+
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        configurations = [parse_gunicorn_options(el) for el in ("sync", "gevent:4")]
+        results = benchmark_gunicorn(project, configurations, duration=10)
+
+    assert [el.options for el in results] == configurations
+    assert results[0].requests_per_second == 10
+    # The LMS is restarted with the project configuration at the end
+    assert started_with == ["sync", "gevent", "gthread"]
+    assert project.gunicorn.worker_class == "gthread"
+    command = client.containers.run.call_args[0][1]
+    assert command[-2:] == [
+        "http://complete.localhost.derex/heartbeat",
+        "http://complete.localhost.derex/",
+    ]
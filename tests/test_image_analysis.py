@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.image_analysis` module."""
+from .conftest import assert_result_ok
+from click.testing import CliRunner
+
+import io
+import json
+import tarfile
+
+
+BIG = b"x" * 4096
+OTHER = b"y" * 2048
+
+
+def make_tar(files):
+    """Return the bytes of a tar archive with the given {name: content} files.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def make_image(layers, oci=False):
+    """Return the tar stream of an image with the given layers, in chunks
+    like the docker client returns them.
+    """
+    names = [
+        f"blobs/sha256/{index:064x}" if oci else f"{index:064x}/layer.tar"
+        for index in range(len(layers))
+    ]
+    files = dict(zip(names, map(make_tar, layers)))
+    if oci:
+        files["blobs/sha256/" + "c" * 64] = b'{"config": {}}'
+    files["manifest.json"] = json.dumps([{"Layers": names}]).encode()
+    data = make_tar(files)
+    return (data[i : i + 1000] for i in range(0, len(data), 1000))  # noqa: E203
+
+
+LAYERS = [
+    {
+        "./usr/lib/big.so": BIG,
+        "./usr/lib/copy.so": BIG,
+        "./openedx/node_modules/pkg/index.js": OTHER,
+        "./tmp/cache.bin": OTHER,
+    },
+    {"./tmp/.wh.cache.bin": b"", "./openedx/settings.py": b"DEBUG = False"},
+    {"./openedx/settings.py": b"DEBUG = True"},
+]
+
+
+def test_read_image_layers():
+    from derex.runner.image_analysis import read_image_layers
+
+    for oci in (False, True):
+        layers = read_image_layers(make_image(LAYERS, oci=oci))
+        assert len(layers) == 3
+        assert set(layers[0].files) == {
+            "/usr/lib/big.so",
+            "/usr/lib/copy.so",
+            "/openedx/node_modules/pkg/index.js",
+            "/tmp/cache.bin",
+        }
+        assert layers[0].size == 2 * len(BIG) + 2 * len(OTHER)
+        assert layers[1].deleted == {"/tmp/cache.bin"}
+        assert layers[2].files["/openedx/settings.py"][0] == len("DEBUG = True")
+
+
+def test_analyze_layers():
+    from derex.runner.image_analysis import analyze_layers
+    from derex.runner.image_analysis import read_image_layers
+
+    analysis = analyze_layers(read_image_layers(make_image(LAYERS)))
+    assert analysis.largest_dirs[0] == ("/usr/lib", 2 * len(BIG))
+    # /usr has the same size as /usr/lib: only the deepest one is reported
+    assert "/usr" not in dict(analysis.largest_dirs)
+    assert "/tmp" not in dict(analysis.largest_dirs)
+
+    assert len(analysis.duplicates) == 1
+    assert analysis.duplicates[0].paths == ["/usr/lib/big.so", "/usr/lib/copy.so"]
+    assert analysis.duplicates[0].wasted == len(BIG)
+
+    assert analysis.shadowed_size == len(OTHER) + len("DEBUG = False")
+    assert len(analysis.suggestions) == 3
+
+
+def test_analyze_command(mocker):
+    from derex.runner.cli.build import analyze
+
+    client = mocker.patch("derex.runner.image_analysis.docker_client")
+    client.api.get_image.return_value = make_image(LAYERS)
+    client.api.history.return_value = [
+        {"Size": 12, "CreatedBy": "/bin/sh -c echo True > settings.py"},
+        {"Size": 0, "CreatedBy": "/bin/sh -c #(nop) ENV FOO=bar"},
+        {"Size": 13, "CreatedBy": "/bin/sh -c rm /tmp/cache.bin"},
+        {"Size": 12288, "CreatedBy": "/bin/sh -c #(nop) ADD rootfs.tar /"},
+    ]
+    result = CliRunner().invoke(analyze, ["some-image"], obj=None)
+    assert_result_ok(result)
+    client.api.get_image.assert_called_once_with("some-image")
+    assert "rm /tmp/cache.bin" in result.output
+    assert "/usr/lib/copy.so" in result.output
+    assert "Suggestions" in result.output
+
+
+def test_remove_deleted():
+    from derex.runner.image_analysis import remove_deleted
+
+    files = {
+        "/a": 1,
+        "/a/b": 2,
+        "/a/b/c": 3,
+        "/a.txt": 4,
+        "/a0": 5,
+        "/ab/c": 6,
+        "/d/e": 7,
+    }
+    # Only the path and what is below it are removed, not paths sharing a prefix
+    assert sorted(remove_deleted(files, ["/a", "/d/"])) == [1, 2, 3, 7]
+    assert files == {"/a.txt": 4, "/a0": 5, "/ab/c": 6}
+    assert remove_deleted(files, []) == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.image_transfer` module."""
+from .conftest import assert_result_ok
+from click.testing import CliRunner
+
+import hashlib
+import io
+import json
+import pytest
+import shutil
+import tarfile
+
+
+LAYERS = [b"base layer" * 1000, b"requirements layer" * 1000]
+DIFF_IDS = ["sha256:" + hashlib.sha256(el).hexdigest() for el in LAYERS]
+
+
+def make_tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def make_image(oci=False):
+    if oci:
+        names = ["blobs/sha256/" + el.split(":")[1] for el in DIFF_IDS]
+    else:
+        names = [f"{index:064x}/layer.tar" for index in range(len(LAYERS))]
+    files = dict(zip(names, LAYERS))
+    files["manifest.json"] = json.dumps([{"Layers": names}]).encode()
+    return make_tar(files)
+
+
+def read_members(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        return {member.name: tar.extractfile(member).read() for member in tar}
+
+
+def test_get_chain_ids():
+    from derex.runner.image_transfer import get_chain_ids
+
+    chain_ids = get_chain_ids(DIFF_IDS)
+    assert chain_ids[0] == DIFF_IDS[0]
+    expected = hashlib.sha256(f"{DIFF_IDS[0]} {DIFF_IDS[1]}".encode()).hexdigest()
+    assert chain_ids[1] == f"sha256:{expected}"
+    # The same layer on top of a different base has a different chain ID
+    assert get_chain_ids(DIFF_IDS[::-1])[1] != chain_ids[1]
+
+
+def test_get_layers_to_skip(mocker):
+    from derex.runner.image_transfer import get_chain_ids
+    from derex.runner.image_transfer import get_layers_to_skip
+
+    client = mocker.patch("derex.runner.image_transfer.docker_client")
+    client.api.inspect_image.return_value = {"RootFS": {"Layers": DIFF_IDS}}
+    known = set(get_chain_ids(DIFF_IDS[:1]))
+    assert get_layers_to_skip("image", known) == {DIFF_IDS[0]}
+    assert get_layers_to_skip("image", set()) == set()
+    # The requirements layer on top of another base is not the same layer
+    assert get_layers_to_skip("image", set(get_chain_ids(DIFF_IDS[::-1]))) == set()
+
+
+@pytest.mark.parametrize("oci", [False, True])
+def test_filter_image_stream(oci):
+    from derex.runner.image_transfer import filter_image_stream
+
+    output = io.BytesIO()
+    skipped = filter_image_stream(io.BytesIO(make_image(oci)), output, {DIFF_IDS[0]})
+    assert skipped == (1, len(LAYERS[0]))
+    members = read_members(output.getvalue())
+    assert LAYERS[0] not in members.values()
+    assert LAYERS[1] in members.values()
+    assert "manifest.json" in members
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="zstd is not installed")
+def test_save_and_load(mocker, tmp_path):
+    from derex.runner.cli.images import load
+    from derex.runner.cli.images import save
+
+    client = mocker.patch("derex.runner.image_transfer.docker_client")
+    client.api.inspect_image.return_value = {"RootFS": {"Layers": DIFF_IDS}}
+    data = make_image()
+    client.api.get_image.return_value = [data[:1000], data[1000:]]
+    known_layers = tmp_path / "known.txt"
+    known_layers.write_text(DIFF_IDS[0] + "\n")
+    archive = str(tmp_path / "image.tar.zst")
+
+    result = CliRunner().invoke(
+        save, ["some-image", "-o", archive, "--known-layers", str(known_layers)]
+    )
+    assert_result_ok(result)
+    assert "Left out 1 known layers" in result.output
+
+    loaded = []
+
+    def load_image(chunks):
+        loaded.append(b"".join(chunks))
+        return [{"stream": "Loaded image: some-image:latest\n"}]
+
+    client.api.load_image.side_effect = load_image
+    result = CliRunner().invoke(load, [archive])
+    assert_result_ok(result)
+    assert "Loaded image: some-image:latest" in result.output
+    members = read_members(loaded[0])
+    assert list(members.values()) == [LAYERS[1], members["manifest.json"]]
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.images` module."""
+from derex.runner.project import Project
+
+import docker
+import time
+
+
+def image(tags, id, created, size=100):
+    return {"Id": id, "RepoTags": tags.split(), "Created": created, "Size": size}
+
+
+def setup_docker(mocker, images, containers=(), running=()):
+    client = mocker.patch("derex.runner.images.docker_client")
+
+    def list_images(name):
+        return [el for el in images if el["RepoTags"][0].startswith(name + ":")]
+
+    client.api.images.side_effect = list_images
+    client.api.inspect_image.return_value = {
+        "Metadata": {"LastTagTime": "0001-01-01T00:00:00Z"}
+    }
+    client.api.containers.side_effect = lambda all: [
+        {"ImageID": id, "Created": created}
+        for id, created in (containers if all else running)
+    ]
+    return client
+
+
+def test_parse_docker_time():
+    from derex.runner.images import parse_docker_time
+
+    assert parse_docker_time("0001-01-01T00:00:00Z") == 0
+    assert parse_docker_time("") == 0
+    assert parse_docker_time("2020-05-06T10:00:00.123456789Z") == 1588759200
+
+
+def test_select_images_to_remove(testproj, mocker):
+    from derex.runner.images import select_images_to_remove
+
+    with testproj:
+        project = Project()
+        prefix = project.image_prefix
+        old = time.time() - 10 * 24 * 3600
+        setup_docker(
+            mocker,
+            [
+                image(
+                    f"{prefix}-requirements:aaaaaa {prefix}-requirements:latest",
+                    "a",
+                    old + 4,
+                ),
+                image(f"{prefix}-requirements:bbbbbb", "b", old + 3),
+                image(f"{prefix}-requirements:cccccc", "c", old + 2),
+                image(f"{prefix}-requirements:dddddd", "d", old + 1),
+                image(f"{prefix}-requirements:eeeeee", "e", old),
+                image(f"{prefix}-themes:ffffff", "f", old),
+            ],
+            # Images e and d were used recently to create containers
+            containers=[("e", time.time()), ("d", time.time() - 60), ("c", old)],
+            # Image c is used by a running container
+            running=[("c", old)],
+        )
+        to_remove = select_images_to_remove(project, keep=1, min_age=3600)
+        # Image a is also tagged as latest, c is running and d was used recently
+        assert [el.tag for el in to_remove] == [f"{prefix}-requirements:bbbbbb"]
+
+        to_remove = select_images_to_remove(project, keep=1, min_age=0)
+    assert [el.tag for el in to_remove] == [
+        f"{prefix}-requirements:dddddd",
+        f"{prefix}-requirements:bbbbbb",
+    ]
+
+
+def test_gc_project_images(testproj, mocker):
+    from derex.runner.images import gc_project_images
+
+    with testproj:
+        project = Project()
+        prefix = project.image_prefix
+        old = time.time() - 10 * 24 * 3600
+        client = setup_docker(
+            mocker,
+            [
+                image(f"{prefix}-themes:aaaaaa", "a", old + 2),
+                image(f"{prefix}-themes:bbbbbb", "b", old + 1),
+                image(f"{prefix}-themes:cccccc", "c", old),
+            ],
+        )
+        client.api.df.side_effect = [{"LayersSize": 1000}, {"LayersSize": 400}]
+        client.api.remove_image.side_effect = [
+            docker.errors.APIError("conflict: image is being used"),
+            None,
+        ]
+
+        removed, reclaimed = gc_project_images(project, keep=1, dry_run=True)
+        assert len(removed) == 2
+        client.api.remove_image.assert_not_called()
+
+        removed, reclaimed = gc_project_images(project, keep=1)
+    assert [el.tag for el in removed] == [f"{prefix}-themes:cccccc"]
+    assert reclaimed == 600
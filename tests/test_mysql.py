@@ -11,6 +11,7 @@ import uuid
 
 
 MINIMAL_PROJ = Path(__file__).with_name("fixtures") / "minimal"
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
 runner = CliRunner(mix_stderr=False)
 
 
@@ -91,3 +92,218 @@ def test_derex_reset_mysql(sys_argv, mocker, workdir_copy):
         result = runner.invoke(reset_mysql_cmd, input="y")
     assert_result_ok(result)
     assert result.exit_code == 0
+
+
+def test_show_databases(start_mysql):
+    """Table and user counts should be reported for every database"""
+    from derex.runner.mysql import create_database
+
+    users_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    empty_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    create_database(users_db_name)
+    create_database(empty_db_name)
+
+    mysql_client = get_mysql_client(database=users_db_name)
+    mysql_client.connection.autocommit(True)
+    mysql_client.execute("CREATE TABLE auth_user (username VARCHAR(255));")
+    mysql_client.execute("CREATE TABLE other (field VARCHAR(255));")
+    mysql_client.execute("INSERT INTO auth_user VALUES ('staff'), ('student');")
+    mysql_client.connection.close()
+
+    databases = {database[0]: database for database in show_databases()}
+    assert databases[users_db_name] == (users_db_name, 2, 2)
+    assert databases[empty_db_name] == (empty_db_name, 0, 0)
+
+
+def test_mysql_connection_pool(start_mysql):
+    """Successive calls should reuse the same connection"""
+    from derex.runner.mysql import create_database
+    from derex.runner.mysql import drop_database
+    from derex.runner.mysql import mysql_cursor
+    from derex.runner.mysql import pool
+    from derex.runner.mysql import reset_mysql_pool
+
+    reset_mysql_pool()
+    with mysql_cursor() as cursor:
+        cursor.execute("SELECT CONNECTION_ID();")
+        connection_id = cursor.fetchone()[0]
+
+    test_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    create_database(test_db_name)
+    drop_database(test_db_name)
+    with mysql_cursor() as cursor:
+        cursor.execute("SELECT CONNECTION_ID();")
+        assert cursor.fetchone()[0] == connection_id
+
+    # Uncommitted changes are rolled back when a connection goes back to the pool
+    create_database(test_db_name)
+    with mysql_cursor(database=test_db_name) as cursor:
+        cursor.execute("CREATE TABLE test (field VARCHAR(255)) ENGINE=InnoDB;")
+    with mysql_cursor(database=test_db_name) as cursor:
+        cursor.execute("INSERT INTO test VALUES ('uncommitted');")
+    with mysql_cursor(database=test_db_name) as cursor:
+        assert cursor.execute("SELECT * FROM test;") == 0
+
+    reset_mysql_pool()
+    assert not any(pool._idle.values())
+
+
+def test_copy_database_keeps_definitions(start_mysql):
+    """Indexes, foreign keys and views should be the same in the copy"""
+    from derex.runner.mysql import copy_database
+    from derex.runner.mysql import create_database
+
+    test_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    test_db_copy_name = f"derex_test_db_copy_{uuid.uuid4().hex[:20]}"
+    create_database(test_db_name)
+    mysql_client = get_mysql_client(database=test_db_name, autocommit=True)
+    mysql_client.execute(
+        "CREATE TABLE auth_user (id INT AUTO_INCREMENT PRIMARY KEY, "
+        "username VARCHAR(32) NOT NULL UNIQUE) ENGINE=InnoDB;"
+    )
+    mysql_client.execute(
+        "CREATE TABLE profile (id INT AUTO_INCREMENT PRIMARY KEY, user_id INT, "
+        "KEY user_idx (user_id), FOREIGN KEY (user_id) REFERENCES auth_user (id)) "
+        "ENGINE=InnoDB;"
+    )
+    mysql_client.execute("CREATE VIEW usernames AS SELECT username FROM auth_user;")
+    mysql_client.execute("INSERT INTO auth_user (username) VALUES ('a'), ('b');")
+    mysql_client.execute("INSERT INTO profile (user_id) VALUES (1), (2), (2);")
+
+    results = copy_database(test_db_name, test_db_copy_name, workers=2)
+    assert {el.name: el.rows for el in results} == {"auth_user": 2, "profile": 3}
+
+    for table in ("auth_user", "profile", "usernames"):
+        mysql_client.execute(f"SHOW CREATE TABLE {test_db_name}.{table};")
+        original = mysql_client.fetchone()[1]
+        mysql_client.execute(f"SHOW CREATE TABLE {test_db_copy_name}.{table};")
+        copy = mysql_client.fetchone()[1]
+        # View definitions mention their database
+        assert copy.replace(test_db_copy_name, test_db_name) == original
+    mysql_client.connection.close()
+
+
+def test_copy_database_partitioned_and_fulltext(start_mysql):
+    """Partitioned tables and tables with several FULLTEXT keys should be copied"""
+    from derex.runner.mysql import copy_database
+    from derex.runner.mysql import create_database
+
+    test_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    test_db_copy_name = f"derex_test_db_copy_{uuid.uuid4().hex[:20]}"
+    create_database(test_db_name)
+    mysql_client = get_mysql_client(database=test_db_name, autocommit=True)
+    mysql_client.execute(
+        "CREATE TABLE event (id INT NOT NULL, name VARCHAR(32), "
+        "PRIMARY KEY (id), KEY name_idx (name)) ENGINE=InnoDB "
+        "PARTITION BY RANGE (id) (PARTITION p0 VALUES LESS THAN (10), "
+        "PARTITION p1 VALUES LESS THAN MAXVALUE);"
+    )
+    mysql_client.execute(
+        "CREATE TABLE document (id INT PRIMARY KEY, title TEXT, body TEXT, "
+        "FULLTEXT KEY title_idx (title), FULLTEXT KEY body_idx (body)) ENGINE=InnoDB;"
+    )
+    mysql_client.execute("INSERT INTO event VALUES (1, 'a'), (20, 'b');")
+    mysql_client.execute("INSERT INTO document VALUES (1, 'a', 'b');")
+
+    results = copy_database(test_db_name, test_db_copy_name)
+    assert {el.name: el.rows for el in results} == {"event": 2, "document": 1}
+    for table in ("event", "document"):
+        mysql_client.execute(f"SHOW CREATE TABLE {test_db_name}.{table};")
+        original = mysql_client.fetchone()[1]
+        mysql_client.execute(f"SHOW CREATE TABLE {test_db_copy_name}.{table};")
+        assert mysql_client.fetchone()[1] == original
+    mysql_client.connection.close()
+
+
+def test_copy_database_copies_programs(start_mysql):
+    """Stored routines, triggers and events should be copied, and triggers
+    should not fire while rows are copied"""
+    from derex.runner.mysql import copy_database
+    from derex.runner.mysql import create_database
+
+    test_db_name = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+    test_db_copy_name = f"derex_test_db_copy_{uuid.uuid4().hex[:20]}"
+    create_database(test_db_name)
+    mysql_client = get_mysql_client(database=test_db_name, autocommit=True)
+    mysql_client.execute("CREATE TABLE counter (value INT) ENGINE=InnoDB;")
+    mysql_client.execute("CREATE TABLE item (id INT PRIMARY KEY) ENGINE=InnoDB;")
+    mysql_client.execute(
+        "CREATE TRIGGER count_items AFTER INSERT ON item "
+        "FOR EACH ROW UPDATE counter SET value = value + 1;"
+    )
+    mysql_client.execute(
+        "CREATE FUNCTION double_it (x INT) RETURNS INT DETERMINISTIC RETURN x * 2;"
+    )
+    mysql_client.execute(
+        "CREATE EVENT reset_counter ON SCHEDULE EVERY 1 DAY DISABLE "
+        "DO UPDATE counter SET value = 0;"
+    )
+    mysql_client.execute("INSERT INTO counter VALUES (0);")
+    mysql_client.execute("INSERT INTO item VALUES (1), (2);")
+
+    copy_database(test_db_name, test_db_copy_name)
+    mysql_client.execute(f"SELECT value FROM {test_db_copy_name}.counter;")
+    assert mysql_client.fetchone()[0] == 2
+    mysql_client.execute(f"INSERT INTO {test_db_copy_name}.item VALUES (3);")
+    mysql_client.execute(f"SELECT value FROM {test_db_copy_name}.counter;")
+    assert mysql_client.fetchone()[0] == 3
+    mysql_client.execute(f"SELECT {test_db_copy_name}.double_it(2);")
+    assert mysql_client.fetchone()[0] == 4
+    mysql_client.execute(
+        "SELECT COUNT(*) FROM information_schema.EVENTS WHERE EVENT_SCHEMA = %s",
+        (test_db_copy_name,),
+    )
+    assert mysql_client.fetchone()[0] == 1
+    mysql_client.connection.close()
+
+
+def test_reset_mysql_pristine(start_mysql, workdir_copy, mocker):
+    """After the first reset the database should be cloned from a pristine copy"""
+    from derex.runner.mysql import get_pristine_db_name
+    from derex.runner.mysql import reset_mysql_openedx
+    from derex.runner.project import Project
+
+    def restore(*args, project, **kwargs):
+        client = get_mysql_client(autocommit=True)
+        client.execute(f"DROP DATABASE IF EXISTS {project.mysql_db_name};")
+        client.execute(f"CREATE DATABASE {project.mysql_db_name};")
+        client.execute(f"CREATE TABLE {project.mysql_db_name}.auth_user (id INT);")
+        client.connection.close()
+
+    run_compose = mocker.patch("derex.runner.mysql.run_compose", side_effect=restore)
+    get_reset_hash = mocker.patch("derex.runner.mysql.get_reset_hash")
+    get_reset_hash.return_value = "first"
+    with workdir_copy(MINIMAL_PROJ):
+        project = Project()
+    project.config["mysql_db_name"] = f"derex_test_db_{uuid.uuid4().hex[:20]}"
+
+    reset_mysql_openedx(project)
+    assert run_compose.call_count == 1
+    assert get_pristine_db_name(project) in [el[0] for el in show_databases()]
+
+    client = get_mysql_client(database=project.mysql_db_name, autocommit=True)
+    client.execute("INSERT INTO auth_user VALUES (1);")
+    reset_mysql_openedx(project)
+    assert run_compose.call_count == 1
+    client.execute(f"SHOW TABLES IN {project.mysql_db_name};")
+    assert client.fetchall() == (("auth_user",),)
+    assert client.execute(f"SELECT * FROM {project.mysql_db_name}.auth_user;") == 0
+
+    # A different dump or different fixtures make the pristine copy stale
+    get_reset_hash.return_value = "second"
+    reset_mysql_openedx(project)
+    assert run_compose.call_count == 2
+    client.connection.close()
+
+
+def test_derex_load_fixtures(mocker, workdir_copy):
+    """Only fixtures are loaded, the dump is not restored"""
+    from derex.runner.cli.mysql import load_fixtures_cmd
+    from derex.runner.project import Project
+
+    run_compose = mocker.patch("derex.runner.mysql.run_compose")
+    with workdir_copy(COMPLETE_PROJ):
+        result = runner.invoke(load_fixtures_cmd, obj=Project())
+    assert_result_ok(result)
+    args = run_compose.call_args[0][0]
+    assert args[-2:] == ["/restore_dump.py", "--fixtures-only"]
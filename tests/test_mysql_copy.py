@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.mysql_copy` module."""
+
+
+CREATE_STATEMENT = """CREATE TABLE `courseware_studentmodule` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `module_type` varchar(32) NOT NULL,
+  `student_id` int(11) NOT NULL,
+  `course_id` varchar(255) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `courseware_studentmodule_student_id_635d77aea1256de5_uniq` (`student_id`,`course_id`),
+  KEY `courseware_studentmodule_ea134da7` (`course_id`),
+  CONSTRAINT `courseware_studentmodule_student_id_57005a9a97046500_fk_auth_user_id` FOREIGN KEY (`student_id`) REFERENCES `auth_user` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=42 DEFAULT CHARSET=utf8"""
+
+
+def test_split_table_definition():
+    from derex.runner.mysql_copy import split_table_definition
+
+    definition = split_table_definition(CREATE_STATEMENT)
+    assert definition.create == (
+        "CREATE TABLE `courseware_studentmodule` (\n"
+        "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"
+        "  `module_type` varchar(32) NOT NULL,\n"
+        "  `student_id` int(11) NOT NULL,\n"
+        "  `course_id` varchar(255) NOT NULL,\n"
+        "  PRIMARY KEY (`id`)\n"
+        ") ENGINE=InnoDB AUTO_INCREMENT=42 DEFAULT CHARSET=utf8"
+    )
+    assert definition.keys == [
+        "UNIQUE KEY `courseware_studentmodule_student_id_635d77aea1256de5_uniq` "
+        "(`student_id`,`course_id`)",
+        "KEY `courseware_studentmodule_ea134da7` (`course_id`)",
+    ]
+    assert len(definition.foreign_keys) == 1
+    assert "REFERENCES `auth_user` (`id`)" in definition.foreign_keys[0]
+
+
+def test_split_table_definition_auto_increment_key():
+    """A key on an auto increment column that is not the primary key must stay"""
+    from derex.runner.mysql_copy import split_table_definition
+
+    definition = split_table_definition(
+        "CREATE TABLE `t` (\n"
+        "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"
+        "  `name` varchar(32) NOT NULL,\n"
+        "  PRIMARY KEY (`name`),\n"
+        "  KEY `t_id` (`id`)\n"
+        ") ENGINE=InnoDB"
+    )
+    assert "KEY `t_id` (`id`)" in definition.create
+    assert definition.keys == []
+
+
+def test_split_table_definition_partitioned():
+    """Table options spanning several lines should be kept"""
+    from derex.runner.mysql_copy import split_table_definition
+
+    tail = (
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8\n"
+        "/*!50100 PARTITION BY RANGE (`id`)\n"
+        "(PARTITION p0 VALUES LESS THAN (100) ENGINE = InnoDB,\n"
+        " PARTITION p1 VALUES LESS THAN MAXVALUE ENGINE = InnoDB) */"
+    )
+    definition = split_table_definition(
+        "CREATE TABLE `t` (\n"
+        "  `id` int(11) NOT NULL,\n"
+        "  `name` varchar(32) NOT NULL,\n"
+        "  PRIMARY KEY (`id`),\n"
+        "  KEY `t_name` (`name`)\n" + tail
+    )
+    assert definition.create == (
+        "CREATE TABLE `t` (\n"
+        "  `id` int(11) NOT NULL,\n"
+        "  `name` varchar(32) NOT NULL,\n"
+        "  PRIMARY KEY (`id`)\n" + tail
+    )
+    assert definition.keys == ["KEY `t_name` (`name`)"]
+
+
+def test_get_add_keys_statements():
+    """FULLTEXT keys should be added one at a time"""
+    from derex.runner.mysql_copy import get_add_keys_statements
+
+    assert get_add_keys_statements(
+        "t",
+        [
+            "KEY `t_a` (`a`)",
+            "FULLTEXT KEY `t_b` (`b`)",
+            "UNIQUE KEY `t_c` (`c`)",
+            "FULLTEXT KEY `t_d` (`d`)",
+        ],
+    ) == [
+        "ALTER TABLE `t` ADD KEY `t_a` (`a`), ADD UNIQUE KEY `t_c` (`c`)",
+        "ALTER TABLE `t` ADD FULLTEXT KEY `t_b` (`b`)",
+        "ALTER TABLE `t` ADD FULLTEXT KEY `t_d` (`d`)",
+    ]
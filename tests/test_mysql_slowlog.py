@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.mysql_slowlog` module."""
+from contextlib import contextmanager
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def cursor(mocker):
+    cursor = mocker.MagicMock()
+
+    @contextmanager
+    def mysql_cursor():
+        yield cursor
+
+    mocker.patch("derex.runner.mysql_slowlog.mysql_cursor", mysql_cursor)
+    return cursor
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        (
+            "SELECT `auth_user`.`id` FROM `auth_user` WHERE `auth_user`.`username` = 'staff'",
+            "select `auth_user`.`id` from `auth_user` where `auth_user`.`username` = ?",
+        ),
+        (
+            "SELECT * FROM courseware_studentmodule  WHERE id IN (1, 2,3) LIMIT 10;",
+            "select * from courseware_studentmodule where id in (?+) limit ?",
+        ),
+        (
+            "INSERT INTO t1 (a, b) VALUES (1, 'x'), (-2.5, \"it's\")",
+            "insert into t1 (a, b) values (?+)",
+        ),
+        (
+            "/* a comment */ SELECT 0x1F, 'a''b' -- trailing\n FROM t2",
+            "select ?, ? from t2",
+        ),
+    ],
+)
+def test_fingerprint(sql, expected):
+    from derex.runner.mysql_slowlog import fingerprint
+
+    assert fingerprint(sql) == expected
+
+
+def make_query(sql, query_time, rows_examined=0):
+    from derex.runner.mysql_slowlog import SlowQuery
+
+    return SlowQuery(sql, "edxapp", query_time, 0, 1, rows_examined)
+
+
+def test_digest():
+    from derex.runner.mysql_slowlog import digest
+
+    queries = [
+        make_query("SELECT * FROM a WHERE id = 1", 0.1, rows_examined=10),
+        make_query("SELECT * FROM a WHERE id = 2", 0.3, rows_examined=10),
+        make_query("SELECT * FROM a WHERE id = 3", 0.1, rows_examined=10),
+        make_query("SELECT * FROM b", 1.0, rows_examined=100000),
+    ]
+    by_time = digest(queries)
+    assert [el.fingerprint for el in by_time] == [
+        "select * from b",
+        "select * from a where id = ?",
+    ]
+    assert by_time[1].calls == 3
+    assert by_time[1].total_time == pytest.approx(0.5)
+    assert by_time[1].max_time == 0.3
+    assert by_time[1].example == "SELECT * FROM a WHERE id = 2"
+    assert [el.calls for el in digest(queries, sort="count")] == [3, 1]
+    assert [el.rows_examined for el in digest(queries, sort="rows")] == [100000, 30]
+
+
+def test_fetch_slow_queries(cursor):
+    from derex.runner.mysql_slowlog import fetch_slow_queries
+
+    cursor.fetchall.return_value = (
+        (b"SELECT 1", "edxapp", timedelta(seconds=1, microseconds=500000), 0, 1, 5),
+    )
+    assert fetch_slow_queries("edxapp")[0] == ("SELECT 1", "edxapp", 1.5, 0, 1, 5)
+    assert cursor.execute.call_args[0][1] == ("edxapp",)
+
+
+def test_enable_slow_log(cursor):
+    from derex.runner.mysql_slowlog import enable_slow_log
+
+    enable_slow_log(0.5, not_using_indexes=True)
+    statement, params = cursor.execute.call_args[0]
+    assert "log_output = 'TABLE'" in statement
+    assert params == (0.5, "ON")
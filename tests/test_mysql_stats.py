@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.mysql_stats` module."""
+from contextlib import contextmanager
+
+import pytest
+
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def cursor(mocker):
+    cursor = mocker.MagicMock()
+
+    @contextmanager
+    def mysql_cursor():
+        yield cursor
+
+    mocker.patch("derex.runner.mysql_stats.mysql_cursor", mysql_cursor)
+    return cursor
+
+
+def test_get_table_stats(cursor):
+    from derex.runner.mysql_stats import get_table_stats
+
+    cursor.fetchall.return_value = (
+        ("courseware_studentmodule", "InnoDB", 1000, 80 * MB, 20 * MB, 25 * MB),
+        ("django_session", "InnoDB", None, 16384, 0, None),
+    )
+    stats = get_table_stats("edxapp")
+    assert cursor.execute.call_args[0][1] == ("edxapp",)
+    assert stats[0].size == 100 * MB
+    assert stats[0].fragmentation == 0.2
+    assert stats[1].rows == 0
+    assert stats[1].fragmentation == 0
+
+
+def test_get_unused_indexes(cursor):
+    from derex.runner.mysql_stats import get_unused_indexes
+
+    cursor.fetchone.return_value = (0,)
+    assert get_unused_indexes("edxapp") is None
+
+    cursor.fetchone.return_value = (1,)
+    cursor.fetchall.return_value = (("grades_persistentsubsectiongrade", "idx"),)
+    assert get_unused_indexes("edxapp")[0].index_name == "idx"
+
+
+def test_get_tables_to_optimize():
+    from derex.runner.mysql_stats import TableStats
+    from derex.runner.mysql_stats import get_tables_to_optimize
+
+    stats = [
+        TableStats("big_fragmented", "InnoDB", 0, 100 * MB, 0, 50 * MB),
+        TableStats("small_fragmented", "InnoDB", 0, 1 * MB, 0, 5 * MB),
+        TableStats("big_compact", "InnoDB", 0, 1000 * MB, 0, 20 * MB),
+        TableStats("myisam", "MyISAM", 0, 100 * MB, 0, 90 * MB),
+        TableStats("fragmented", "InnoDB", 0, 100 * MB, 0, 80 * MB),
+    ]
+    tables = get_tables_to_optimize(
+        stats, min_free=10 * MB, min_fragmentation=0.1, limit=5
+    )
+    assert [el.name for el in tables] == ["fragmented", "big_fragmented"]
+    tables = get_tables_to_optimize(
+        stats, min_free=10 * MB, min_fragmentation=0.1, limit=1
+    )
+    assert [el.name for el in tables] == ["fragmented"]
+
+
+def test_optimize_table(cursor):
+    from derex.runner.mysql_stats import optimize_table
+
+    import pymysql
+
+    cursor.fetchone.side_effect = [(50 * MB,), (4 * MB,)]
+    result = optimize_table("edxapp", "courseware_studentmodule")
+    assert result.freed == 46 * MB
+    assert result.error is None
+    assert "ALGORITHM=INPLACE, LOCK=NONE" in cursor.execute.call_args_list[1][0][0]
+
+    cursor.fetchone.side_effect = [(50 * MB,)]
+    cursor.execute.side_effect = [
+        None,
+        pymysql.err.InternalError(1846, "LOCK=NONE is not supported"),
+    ]
+    result = optimize_table("edxapp", "search_index")
+    assert result.freed == 0
+    assert "LOCK=NONE" in result.error
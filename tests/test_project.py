@@ -238,3 +238,36 @@ def create_settings_file(project_root: Path, filename: str):
         settings_dir.mkdir()
         (settings_dir / "__init__.py").write_text("")
     (settings_dir / f"{filename}.py").write_text("# Empty file")
+
+
+def test_gunicorn_options(testproj, mocker):
+    from derex.runner.compose_generation import generate_local_docker_compose
+    from derex.runner.project import GunicornOptions
+
+    mocker.patch("derex.runner.compose_generation.image_exists", return_value=True)
+    with testproj as projdir:
+        conf_file = Path(projdir) / "derex.config.yaml"
+        config = yaml.load(conf_file.open(), Loader=yaml.FullLoader)
+        assert Project().gunicorn == GunicornOptions("gthread", 2, 4)
+
+        config["gunicorn"] = {"worker_class": "gevent", "workers": 3}
+        conf_file.write_text(yaml.dump(config))
+        project = Project()
+        assert project.gunicorn == GunicornOptions("gevent", 3, 4)
+        project.runmode = ProjectRunMode.production
+        compose = yaml.load(
+            generate_local_docker_compose(project).open(), Loader=yaml.FullLoader
+        )
+        command = compose["services"]["lms"]["command"]
+        assert "--worker-class gevent --workers 3 " in command
+        assert "--threads" not in command
+        assert (
+            compose["services"]["lms"]["environment"]["DEREX_GUNICORN_WORKER_CLASS"]
+            == "gevent"
+        )
+
+        for wrong in ({"worker_class": "eventlet"}, {"workers": 0}, {"foo": 1}):
+            config["gunicorn"] = wrong
+            conf_file.write_text(yaml.dump(config))
+            with pytest.raises(ValueError):
+                Project()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Tests for the `restore_dump.py.source` script, run inside containers."""
+from pathlib import Path
+from types import SimpleNamespace
+
+import bz2
+import json
+import pytest
+import runpy
+import shutil
+import subprocess
+import sys
+
+
+DUMP = b"""-- MySQL dump 10.13
+--
+-- Host: localhost    Database: edxapp
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40101 SET NAMES utf8 */;
+
+--
+-- Table structure for table `auth_user`
+--
+
+DROP TABLE IF EXISTS `auth_user`;
+CREATE TABLE `auth_user` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `username` varchar(30) NOT NULL COMMENT 'no; split',
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+INSERT INTO `auth_user` VALUES (1,'it\\'s; fine'),(2,'say \\"hi\\";'),(3,'a''b;');
+INSERT INTO `weird;name` VALUES (4,"double; quoted");
+DELIMITER ;;
+/*!50003 CREATE TRIGGER t BEFORE INSERT ON auth_user FOR EACH ROW BEGIN SET @a = 1; END */;;
+DELIMITER ;
+# A hash comment; with a delimiter
+SELECT 1 /* block; comment */;
+--
+-- Dump completed
+"""
+
+EXPECTED = [
+    b"/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */",
+    b"/*!40101 SET NAMES utf8 */",
+    b"DROP TABLE IF EXISTS `auth_user`",
+    b") ENGINE=InnoDB DEFAULT CHARSET=utf8",
+    b"INSERT INTO `auth_user` VALUES (1,'it\\'s; fine'),(2,'say \\\"hi\\\";'),(3,'a''b;')",
+    b'INSERT INTO `weird;name` VALUES (4,"double; quoted")',
+    b"/*!50003 CREATE TRIGGER t BEFORE INSERT ON auth_user FOR EACH ROW BEGIN SET @a = 1; END */",
+    b"SELECT 1 /* block; comment */",
+]
+
+
+@pytest.fixture
+def restore_dump(mocker):
+    """Load the script, providing the modules only present in the container"""
+    for name in ("django", "django.conf", "MySQLdb"):
+        mocker.patch.dict(sys.modules, {name: mocker.MagicMock()})
+    path = Path(__file__).parent.parent / "derex" / "runner" / "restore_dump.py.source"
+    return SimpleNamespace(**runpy.run_path(str(path)))
+
+
+def split(restore_dump, data, chunk_size):
+    chunks = [data[start:][:chunk_size] for start in range(0, len(data), chunk_size)]
+    return list(restore_dump.iter_statements(chunks))
+
+
+def test_statement_splitter(restore_dump):
+    statements = split(restore_dump, DUMP, len(DUMP))
+    assert len(statements) == len(EXPECTED)
+    for statement, expected in zip(statements, EXPECTED):
+        # Comments before a statement are sent together with it
+        assert statement.strip().split(b"\n")[-1] == expected.split(b"\n")[-1]
+    assert statements[3].strip().startswith(b"CREATE TABLE `auth_user` (")
+    # Tokens split between chunks must not make a difference
+    for chunk_size in range(1, 40):
+        assert split(restore_dump, DUMP, chunk_size) == statements
+
+
+def test_statement_splitter_unterminated(restore_dump):
+    assert split(restore_dump, b"SELECT 1;\nSELECT 2\n", 5) == [
+        b"SELECT 1",
+        b"\nSELECT 2\n",
+    ]
+    assert split(restore_dump, b"SELECT 1;\n-- The end\n", 5) == [b"SELECT 1"]
+
+
+def test_batch_statements(restore_dump):
+    restore_dump.batch_statements.__globals__["BATCH_SIZE"] = 10
+    batches = list(restore_dump.batch_statements([b"a" * 4, b"b" * 4, b"c" * 20, b"d"]))
+    assert batches == [[b"a" * 4, b"b" * 4], [b"c" * 20], [b"d"]]
+
+
+def compress(data, compression):
+    if compression == "bzip2":
+        return bz2.compress(data)
+    if compression == "none":
+        return data
+    if shutil.which(compression) is None:
+        pytest.skip(f"{compression} is not installed")
+    return subprocess.run(
+        [compression, "-q", "-c"], input=data, stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+@pytest.mark.parametrize("compression", ["zstd", "lz4", "bzip2", "none"])
+def test_read_dump_chunks(restore_dump, tmp_path, compression):
+    dump_path = tmp_path / "empty_dump.sql"
+    dump_path.write_bytes(compress(DUMP * 1000, compression))
+    expected = None if compression == "none" else compression
+    assert restore_dump.detect_compression(dump_path.read_bytes()[:4]) == expected
+    progress = []
+    chunks = restore_dump.read_dump_chunks(str(dump_path), progress.append)
+    assert b"".join(chunks) == DUMP * 1000
+    assert progress[-1] == dump_path.stat().st_size
+
+
+def write_fixture(path, models):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps([{"model": el, "pk": 1, "fields": {}} for el in models]))
+
+
+def test_get_pending_fixtures(restore_dump, tmp_path):
+    write_fixture(tmp_path / "lms" / "b.json", ["auth.user", "sites.site"])
+    write_fixture(tmp_path / "lms" / "a.json", ["auth.user"])
+    write_fixture(tmp_path / "cms" / "c.json", ["auth.user"])
+    files = restore_dump.get_fixture_files(str(tmp_path))
+    assert list(files) == ["cms", "lms"]
+    assert [el.rpartition("/")[2] for el in files["lms"]] == ["a.json", "b.json"]
+
+    content_hash = restore_dump.hash_content((tmp_path / "lms" / "a.json").read_bytes())
+    applied = {"lms/a.json": content_hash, "lms/b.json": content_hash}
+    # b.json has a different content from the one recorded
+    assert restore_dump.get_pending_fixtures(files["lms"], applied) == [
+        str(tmp_path / "lms" / "b.json")
+    ]
+
+
+def test_models_are_disjoint(restore_dump, tmp_path):
+    write_fixture(tmp_path / "cms" / "a.json", ["Auth.User"])
+    write_fixture(tmp_path / "lms" / "a.json", ["theming.sitetheme"])
+    write_fixture(tmp_path / "lms" / "b.json", ["auth.user", "sites.site"])
+    (tmp_path / "lms" / "c.yaml").write_text("- model: sites.site\n")
+    cms, lms_a, lms_b, lms_c = (
+        str(tmp_path / el)
+        for el in ("cms/a.json", "lms/a.json", "lms/b.json", "lms/c.yaml")
+    )
+    assert restore_dump.models_are_disjoint([[cms], [lms_a]])
+    assert not restore_dump.models_are_disjoint([[cms], [lms_a, lms_b]])
+    # Models in non JSON fixtures are unknown
+    assert not restore_dump.models_are_disjoint([[cms], [lms_a, lms_c]])
+
+
+def test_run_fixtures_retries_in_order(restore_dump, mocker):
+    pending = restore_dump.OrderedDict([("cms", ["cms.json"]), ("lms", ["lms.json"])])
+    patched = mocker.patch.dict(
+        restore_dump.run_fixtures.__globals__,
+        {
+            "get_pending_by_variant": lambda variants: restore_dump.OrderedDict(
+                (el, pending[el]) for el in variants
+            ),
+            "models_are_disjoint": lambda groups: True,
+            "load_variants": mocker.MagicMock(side_effect=[["lms"], []]),
+        },
+    )
+    restore_dump.run_fixtures()
+    load_variants = patched["load_variants"]
+    assert load_variants.call_args_list == [
+        mocker.call(pending, True),
+        mocker.call(restore_dump.OrderedDict([("lms", ["lms.json"])]), False),
+    ]
+
+
+def test_chunked(restore_dump):
+    assert list(restore_dump.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
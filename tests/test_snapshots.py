@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.snapshots` module."""
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def docker_client(mocker, tmp_path):
+    mocker.patch("derex.runner.snapshots.SNAPSHOTS_DIR", tmp_path)
+    client = mocker.patch("derex.runner.snapshots.docker_client")
+    volumes = []
+
+    def create(name, labels):
+        volume = mocker.MagicMock()
+        volume.name = name
+        volume.attrs = {"Labels": labels}
+        volume.remove.side_effect = lambda: volumes.remove(volume)
+        volumes.append(volume)
+
+    client.volumes.create.side_effect = create
+    client.volumes.list.side_effect = lambda filters: list(volumes)
+    client.containers.list.return_value = []
+    return client
+
+
+def test_validate_snapshot_name():
+    from derex.runner.snapshots import validate_snapshot_name
+
+    validate_snapshot_name("before-upgrade_2.0")
+    for name in ("", "-foo", "foo/bar", "foo bar"):
+        with pytest.raises(ValueError):
+            validate_snapshot_name(name)
+
+
+def test_services_stopped(mocker, docker_client):
+    from derex.runner.snapshots import services_stopped
+
+    mysql = mocker.MagicMock()
+    mysql.name = "mysql"
+    docker_client.containers.list.side_effect = lambda filters: (
+        [mysql] if filters["volume"] == "derex_mysql" else []
+    )
+    with pytest.raises(RuntimeError):
+        with services_stopped(["derex_mysql", "derex_mongodb"]) as stopped:
+            assert stopped == ["mysql"]
+            mysql.stop.assert_called_once()
+            mysql.start.assert_not_called()
+            raise RuntimeError
+    # Services are started again even if the copy fails
+    mysql.start.assert_called_once()
+
+
+def test_create_restore_volume_snapshot(docker_client):
+    from derex.runner.snapshots import create_snapshot
+    from derex.runner.snapshots import list_snapshots
+    from derex.runner.snapshots import restore_snapshot
+
+    snapshot = create_snapshot("test")
+    assert snapshot.kind == "volume"
+    assert [el.name for el in list_snapshots()] == ["test"]
+    copies = [
+        (set(call[1]["volumes"]), call[0][1][2])
+        for call in docker_client.containers.run.call_args_list
+    ]
+    assert sorted(el[0] for el in copies) == sorted(
+        {volume, f"{volume}_snapshot_test"}
+        for volume in ("derex_mysql", "derex_mongodb", "derex_minio")
+    )
+    assert all("--reflink=auto" in el[1] for el in copies)
+
+    with pytest.raises(ValueError):
+        create_snapshot("test")
+
+    docker_client.containers.run.reset_mock()
+    restore_snapshot("test")
+    assert sorted(
+        call[1]["volumes"]["derex_mysql_snapshot_test"]["bind"]
+        for call in docker_client.containers.run.call_args_list
+        if "derex_mysql_snapshot_test" in call[1]["volumes"]
+    ) == ["/from"]
+
+
+def test_failed_snapshot_is_removed(docker_client):
+    from derex.runner.snapshots import create_snapshot
+    from derex.runner.snapshots import list_snapshots
+
+    docker_client.containers.run.side_effect = RuntimeError("No space left on device")
+    with pytest.raises(RuntimeError):
+        create_snapshot("test")
+    assert list_snapshots() == []
+
+
+def test_list_snapshots(docker_client, tmp_path):
+    from derex.runner.snapshots import list_snapshots
+
+    docker_client.volumes.create(
+        "derex_mysql_snapshot_first",
+        labels={
+            "derex.snapshot": "first",
+            "derex.snapshot.created": str(datetime(2020, 6, 1).timestamp()),
+        },
+    )
+    (tmp_path / "second").mkdir()
+    (tmp_path / "second" / "derex_mysql.tar.zst").write_bytes(b"a" * 10)
+    (tmp_path / "second" / "derex_minio.tar.zst").write_bytes(b"a" * 5)
+    (tmp_path / "empty").mkdir()
+
+    snapshots = list_snapshots()
+    assert [(el.name, el.kind) for el in snapshots] == [
+        ("first", "volume"),
+        ("second", "archive"),
+    ]
+    assert snapshots[0].created == datetime(2020, 6, 1)
+    assert snapshots[1].size == 15
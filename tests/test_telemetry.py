@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.telemetry` module."""
+from .conftest import assert_result_ok
+from click.testing import CliRunner
+from derex.runner.telemetry import BuildTelemetry
+from derex.runner.telemetry import compare_reports
+from derex.runner.telemetry import load_reports
+from derex.runner.telemetry import recording_build
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+
+CLASSIC_OUTPUT = [
+    {"stream": "Step 1/3 : FROM derex/edx-ironwood-dev:0.0.2"},
+    {"stream": "\n"},
+    {"stream": " ---> 0123456789ab\n"},
+    {"stream": "Step 2/3 : COPY requirements /openedx/derex.requirements/"},
+    {"stream": " ---> Using cache\n"},
+    {"stream": " ---> 123456789abc\n"},
+    {"stream": "Step 3/3 : RUN pip install -r xblocks.txt"},
+    {"stream": " ---> Running in 23456789abcd\n"},
+    {"stream": "Collecting xblock-poll\n"},
+    {"aux": {"ID": "sha256:3456789abcde"}},
+]
+
+BUILDKIT_OUTPUT = """#1 [internal] load build definition from Dockerfile
+#1 transferring dockerfile: 37B done
+#1 DONE 0.1s
+#2 [internal] load build context
+#2 transferring context: 2.34MB 0.1s done
+#2 DONE 0.3s
+#3 [base 2/8] RUN apk add gettext git
+#3 CACHED
+#4 [sourceonly 1/2] RUN git clone https://github.com/edx/edx-platform.git
+#4 0.512 Cloning into '/openedx/edx-platform'...
+#4 DONE 42.5s
+"""
+
+
+def test_classic_builder_telemetry():
+    telemetry = BuildTelemetry("requirements", "project/openedx-requirements:abcdef")
+    for line in CLASSIC_OUTPUT:
+        telemetry.feed_docker_line(line)
+    telemetry.record_layers([{"CreatedBy": "RUN pip install", "Size": 1000}])
+    telemetry.finish()
+
+    report = telemetry.as_dict()
+    assert [step["cached"] for step in report["steps"]] == [False, True, False]
+    assert all(step["duration"] is not None for step in report["steps"])
+    assert report["steps"][2]["step"] == "RUN pip install -r xblocks.txt"
+    assert report["layers"] == [{"created_by": "RUN pip install", "size": 1000}]
+    assert report["success"]
+
+
+def test_buildkit_telemetry():
+    telemetry = BuildTelemetry("openedx-ironwood-dev", "derex/edx-ironwood-dev")
+    for line in BUILDKIT_OUTPUT.splitlines(keepends=True):
+        telemetry.feed_buildkit_line(line)
+    telemetry.finish()
+
+    steps = telemetry.as_dict()["steps"]
+    assert len(steps) == 4
+    assert steps[2] == {
+        "step": "[base 2/8] RUN apk add gettext git",
+        "cached": True,
+        "duration": None,
+    }
+    assert steps[3]["duration"] == 42.5
+    assert telemetry.context_upload_time == 0.3
+
+
+def make_report(directory, step_durations, cached=False):
+    with recording_build(directory, "themes", "project/openedx-themes:abcdef") as t:
+        for step, duration in step_durations.items():
+            t.steps.append({"step": step, "cached": cached, "duration": duration})
+
+
+def test_reports_are_saved_and_compared(mocker):
+    time = mocker.patch("derex.runner.telemetry.time")
+    with TemporaryDirectory() as tmpdir:
+        directory = Path(tmpdir) / "builds"
+        time.time.return_value = 1000000
+        make_report(directory, {"COPY themes/": 2, "RUN pip install": 10}, cached=True)
+        time.time.return_value = 2000000
+        make_report(directory, {"COPY themes/": 2.5, "RUN pip install": 100})
+        time.time.return_value = 3000000
+        with pytest.raises(RuntimeError):
+            with recording_build(directory, "themes", "project/openedx-themes:fedcba"):
+                raise RuntimeError("Build failed")
+
+        reports = load_reports(directory, "themes")
+        assert len(reports) == 3
+        assert [report["success"] for report in reports] == [True, True, False]
+
+        regressions = compare_reports(reports[0], reports[1])
+        assert regressions == [
+            {"step": "RUN pip install", "before": 10, "after": 100, "cache_lost": True}
+        ]
+
+
+def test_derex_build_report(testproj):
+    from derex.runner.cli.build import build
+    from derex.runner.project import Project
+
+    with testproj:
+        project = Project()
+        make_report(project.private_filepath("builds"), {"RUN pip install": 10})
+        with recording_build(
+            project.private_filepath("builds"), "themes", "project/openedx-themes:fe"
+        ) as telemetry:
+            telemetry.record_metric("cold_start_before", 4.2)
+            telemetry.record_metric("cold_start_after", 2.1)
+        result = CliRunner().invoke(build, ["report"], obj=project)
+        assert_result_ok(result)
+        assert "themes" in result.output
+        assert "project/openedx-themes:fe" in result.output
+        assert "cold_start_after" in result.output
+        assert "2.10" in result.output
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.themes` module."""
+from .conftest import assert_result_ok
+from click.testing import CliRunner
+from pathlib import Path
+from types import SimpleNamespace
+
+import os
+import runpy
+
+
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
+
+
+def test_get_themes_to_compile(workdir_copy):
+    from derex.runner.project import Project
+    from derex.runner.themes import get_themes_to_compile
+    from derex.runner.themes import save_sass_cache
+
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        other_theme = project.themes_dir / "other-theme" / "lms" / "static" / "sass"
+        other_theme.mkdir(parents=True)
+        (other_theme / "lms-main.scss").write_text("body { color: red; }")
+
+        themes, hashes = get_themes_to_compile(project)
+        assert themes == ["demo-theme", "other-theme"]
+        save_sass_cache(project, hashes)
+        assert get_themes_to_compile(project) == ([], {})
+        assert get_themes_to_compile(project, force=True)[0] == themes
+
+        # Only the theme whose sass files changed needs to be compiled again
+        (other_theme / "lms-main.scss").write_text("body { color: blue; }")
+        (other_theme / "lms-main.css").write_text("body { color: blue; }")
+        assert get_themes_to_compile(project)[0] == ["other-theme"]
+
+        # A different base image means a different edx-platform version
+        project.base_image = "derex/edx-juniper-dev:0.0.2"
+        assert get_themes_to_compile(project)[0] == themes
+
+
+def test_derex_compile_theme_uses_cache(workdir_copy, mocker):
+    from derex.runner.cli import derex
+
+    run_compose = mocker.patch("derex.runner.compose_utils.run_compose")
+    with workdir_copy(COMPLETE_PROJ):
+        result = CliRunner().invoke(derex, ["compile-theme"])
+        assert_result_ok(result)
+        assert run_compose.call_count == 1
+        script = run_compose.call_args[0][0][-1]
+        assert "/openedx/themes/demo-theme'" in script
+
+        result = CliRunner().invoke(derex, ["compile-theme"])
+        assert_result_ok(result)
+        assert "nothing to compile" in result.output
+        assert run_compose.call_count == 1
+
+        result = CliRunner().invoke(derex, ["compile-theme", "--force"])
+        assert_result_ok(result)
+        assert run_compose.call_count == 2
+
+
+def test_compile_themes_script():
+    from derex.runner.themes import compile_themes_script
+
+    lines = compile_themes_script(["theme1", "theme2"], 1000).splitlines()
+    # The default theme is compiled once, before the themes compiled in parallel
+    assert lines.count("paver compile_sass") == 1
+    theme_lines = [line for line in lines if "_compile_sass" in line]
+    assert len(theme_lines) == 2
+    assert lines.index("paver compile_sass") < lines.index(theme_lines[0])
+    assert "/openedx/themes/theme1" in theme_lines[0]
+    assert all(line.endswith('& pids="$pids $!"') for line in theme_lines)
+
+
+def load_watch_themes_module():
+    path = Path(__file__).parent.parent / "derex" / "runner" / "watch_themes.py.source"
+    return SimpleNamespace(**runpy.run_path(str(path)))
+
+
+def test_watch_themes_affected_target():
+    watch_themes = load_watch_themes_module()
+
+    sass_path = "/openedx/themes/demo-theme/lms/static/sass/partials/_variables.scss"
+    assert watch_themes.affected_target(sass_path) == ("demo-theme", "lms")
+    css_path = "/openedx/themes/demo-theme/cms/static/css/studio-main.css"
+    assert watch_themes.affected_target(css_path) is None
+    assert watch_themes.affected_target("/openedx/themes/demo-theme/x.scss") is None
+
+
+def test_watch_themes_inotify(tmp_path):
+    watch_themes = load_watch_themes_module()
+
+    inotify = watch_themes.Inotify()
+    (tmp_path / "sass").mkdir()
+    inotify.add_watch_recursive(str(tmp_path))
+    (tmp_path / "sass" / "main.scss").write_text("body { color: red; }")
+    events = inotify.read_events(timeout=1)
+    assert str(tmp_path / "sass" / "main.scss") in [path for path, mask in events]
+
+
+def test_derex_compile_theme_watch(workdir_copy, mocker):
+    from derex.runner.cli import derex
+    from derex.runner.project import Project
+
+    run_compose = mocker.patch("derex.runner.compose_utils.run_compose")
+    with workdir_copy(COMPLETE_PROJ):
+        result = CliRunner().invoke(derex, ["compile-theme", "--watch"])
+        base_image = Project().base_image
+    assert_result_ok(result)
+    args = run_compose.call_args[0][0]
+    assert args[-6:] == [
+        "python",
+        "/watch_themes.py",
+        str(os.getuid()),
+        "/sass_cache.json",
+        base_image,
+        "demo-theme",
+    ]
+    assert any(arg.endswith(".derex/sass_cache.json:/sass_cache.json") for arg in args)
+
+
+def test_watch_themes_updates_sass_cache(workdir_copy, mocker):
+    from derex.runner.project import Project
+    from derex.runner.themes import get_sass_cache_path
+    from derex.runner.themes import get_themes_to_compile
+
+    watch_themes = load_watch_themes_module()
+    compiler = mocker.Mock()
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        sass_cache = str(get_sass_cache_path(project))
+        themes_dir = str(project.themes_dir)
+        module_globals = watch_themes.compile_targets.__globals__
+        mocker.patch.dict(
+            module_globals, THEMES_DIR=themes_dir, subprocess=mocker.Mock()
+        )
+        watcher = watch_themes.Watcher(compiler, "1000", sass_cache, project.base_image)
+
+        # A failure for one system keeps the theme out of the cache
+        compiler.side_effect = lambda theme, system: system == "cms" and 1 / 0
+        watcher.compile([("demo-theme", "lms"), ("demo-theme", "cms")])
+        assert get_themes_to_compile(project)[0] == ["demo-theme"]
+
+        compiler.side_effect = None
+        watcher.compile([("demo-theme", "cms")])
+        # The hash computed in the container matches the one derex computes
+        assert get_themes_to_compile(project)[0] == []
@@ -19,3 +19,12 @@ def test_abspath_from_egg():
     assert derex.runner.utils.abspath_from_egg(
         "derex.runner", "derex/runner/templates/local.yml.j2"
     )
+
+
+def test_human_size():
+    from derex.runner.utils import human_size
+
+    assert human_size(10) == "10.0 B"
+    assert human_size(1536) == "1.5 KB"
+    assert human_size(3 * 1024 ** 3) == "3.0 GB"
+    assert human_size(2 * 1024 ** 4) == "2.0 TB"
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Tests for `derex.runner.wheelhouse` module."""
+from pathlib import Path
+
+import pytest
+
+
+COMPLETE_PROJ = Path(__file__).with_name("fixtures") / "complete"
+
+
+def test_fill_wheelhouse(workdir_copy, mocker, tmp_path):
+    from derex.runner.project import Project
+    from derex.runner.wheelhouse import fill_wheelhouse
+
+    client = mocker.patch("derex.runner.wheelhouse.docker_client")
+    mocker.patch("derex.runner.wheelhouse.WHEELHOUSE_DIR", tmp_path)
+    client.api.inspect_image.return_value = {"Id": "sha256:0123456789abcdef"}
+    container = client.containers.run.return_value
+    container.logs.return_value = [b"Saved /wheels/xblock_poll-1.9.0-py2-none-any.whl"]
+    container.wait.return_value = {"StatusCode": 0}
+
+    with workdir_copy(COMPLETE_PROJ):
+        project = Project()
+        wheels_dir = fill_wheelhouse(project)
+        assert wheels_dir == project.private_filepath("wheels")
+        assert wheels_dir.is_dir()
+
+    assert (tmp_path / "0123456789ab").is_dir()
+    volumes = client.containers.run.call_args[1]["volumes"]
+    assert volumes[str(tmp_path / "0123456789ab")]["bind"] == "/wheelhouse"
+    assert volumes[str(wheels_dir)]["bind"] == "/wheels"
+    container.remove.assert_called_once()
+
+    container.wait.return_value = {"StatusCode": 1}
+    with workdir_copy(COMPLETE_PROJ):
+        with pytest.raises(RuntimeError):
+            fill_wheelhouse(Project())
+
+
+def test_docker_commands_use_wheels(workdir):
+    from derex.runner.build import docker_commands_to_install_requirements
+    from derex.runner.build import docker_stage_to_install_wheels
+    from derex.runner.project import Project
+
+    with workdir(COMPLETE_PROJ):
+        project = Project()
+        commands = docker_commands_to_install_requirements(project)
+        assert "--find-links" not in "".join(commands)
+        assert docker_stage_to_install_wheels(project, "base", None) == []
+
+        wheels_dir = project.root / ".derex" / "wheels"
+        stage = docker_stage_to_install_wheels(project, "base", wheels_dir)
+        commands = docker_commands_to_install_requirements(project, wheels_dir)
+    # Requirements are installed from the wheels in a separate stage
+    assert stage[0] == "FROM base as derex-wheels"
+    assert "COPY wheels /tmp/derex.wheels/\n" in "".join(stage)
+    assert (
+        "RUN cd /openedx/derex.requirements && pip install --user "
+        "--find-links /tmp/derex.wheels -c /tmp/base.txt -r xblocks.txt\n"
+    ) in stage
+    # and only the installed packages are copied in the final image
+    assert "/tmp/derex.wheels" not in "".join(commands)
+    assert "pip install -c" not in "".join(commands)
+    assert (
+        "COPY --from=derex-wheels /openedx/derex.install /openedx/derex.install\n"
+        in "".join(commands)
+    )
+    assert "ENV PATH=/openedx/derex.install/bin:${PATH}\n" in "".join(commands)